@@ -0,0 +1,96 @@
+"""
+Rejoin time of a secondary against catch-up parallelism: master log of `--n` entries is sent
+to a simulated secondary whose link adds `--rtt-ms` to every request and carries
+`--bandwidth-mbps` shared by all requests, so the numbers show when catch-up stops being
+bound by round trips and becomes bound by bandwidth.
+
+    python benchmarks/bench_catch_up.py --parallelism 1 2 4 8 --n 9000 --rtt-ms 20 --bandwidth-mbps 100
+
+Secondary stores chunks in a local log as they arrive, the run checks its contiguous prefix
+covers the whole log.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from const import Item
+from rlog import RLogLocal, SecondaryStateManagement
+import wire
+
+
+def new_item(_id, payload):
+    item = Item(payload=payload)
+    item.id = _id
+    return item
+
+
+class SimulatedSecondary(object):
+    """Remote node behind a link with fixed latency and bandwidth shared by concurrent requests"""
+
+    role = 'secondary'
+
+    def __init__(self, rtt_s, bandwidth_bps):
+        self.id = 'secondary'
+        self.url = 'http://secondary'
+        self.acked_end = 0
+        self.log = RLogLocal('secondary', self.url, 'secondary')
+        self._rtt_s = rtt_s
+        self._bandwidth_bps = bandwidth_bps
+        self._link = asyncio.Lock()
+
+    async def async_append_batch(self, items, repair=False, end=None, catch_up=None):
+        size = len(wire.encode_items(items))
+        async with self._link:
+            await asyncio.sleep(size * 8 / self._bandwidth_bps)
+        await asyncio.sleep(self._rtt_s)
+        for item in items:
+            if self.log.get(item.id) is None:
+                self.log.append(new_item(item.id, item.payload))
+        return items
+
+
+async def measure(parallelism, args):
+    master = RLogLocal('master', 'http://master', 'master')
+    for offset in range(args.n):
+        master.append(new_item(str(offset), {'msg': 'x' * args.payload_size}))
+    secondary = SimulatedSecondary(args.rtt_ms / 1000, args.bandwidth_mbps * 1e6)
+    sm = SecondaryStateManagement(master, chunk_size=args.chunk_size, snapshot_threshold=args.n + 1,
+                                  catch_up_parallelism=parallelism)
+    t = time.perf_counter()
+    assert await sm.sync(secondary, 0), 'Catch-up should not fail'
+    elapsed = time.perf_counter() - t
+    assert secondary.log.committed == args.n, 'Secondary should assemble the whole log'
+    return {
+        'parallelism': parallelism,
+        'rejoin_s': round(elapsed, 3),
+        'entries_per_s': round(args.n / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--parallelism', type=int, nargs='+', default=[1, 2, 4, 8], help='Concurrent catch-up requests to compare')
+    parser.add_argument('--n', type=int, default=9000, help='Entries missing on secondary')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Entries in one catch-up request')
+    parser.add_argument('--payload-size', type=int, default=64, help='Payload bytes of every entry')
+    parser.add_argument('--rtt-ms', type=float, default=20, help='Round trip time of the link, ms')
+    parser.add_argument('--bandwidth-mbps', type=float, default=100, help='Bandwidth of the link, Mbit/s')
+    args = parser.parse_args()
+
+    results = [asyncio.run(measure(parallelism, args)) for parallelism in args.parallelism]
+    print(json.dumps({
+        'n': args.n,
+        'chunk_size': args.chunk_size,
+        'rtt_ms': args.rtt_ms,
+        'bandwidth_mbps': args.bandwidth_mbps,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Throughput and latency of a local cluster: master and N secondaries are started
+from src/main.py as uvicorn processes on localhost, concurrent clients drive a mix
+of appends and reads for every combination of write concern w and read quorum r.
+
+    python benchmarks/bench_cluster.py --secondaries 2 --clients 32 --duration 10 --read-ratio 0.2
+    python benchmarks/bench_cluster.py --w 1 3 --r 1 --node-arg=--data-dir={dir}
+
+Result is printed as JSON, node logs are kept in --log-dir if set.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main.py')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def summary(latencies, duration):
+    return {
+        'count': len(latencies),
+        'per_s': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'p999_ms': round(percentile(latencies, 0.999) * 1000, 3) if latencies else None,
+    }
+
+
+class Cluster(object):
+    """Master and secondaries as child processes, stopped on exit"""
+
+    def __init__(self, secondaries, node_args, log_dir, data_dir):
+        self._secondaries = secondaries
+        self._node_args = node_args
+        self._log_dir = log_dir
+        self._data_dir = data_dir
+        self._procs = []
+        self.master_url = None
+
+    def _spawn(self, name, port, master_url=None):
+        url = f'http://127.0.0.1:{port}'
+        cmd = [sys.executable, MAIN, '--port', str(port), '-u', url]
+        if master_url:
+            cmd += ['-m', master_url]
+        node_dir = os.path.join(self._data_dir, name)
+        cmd += [arg.format(dir=node_dir) for arg in self._node_args]
+        log = open(os.path.join(self._log_dir, name + '.log'), 'wb')
+        self._procs.append(subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT,
+                                            cwd=os.path.dirname(MAIN)))
+        return url
+
+    def _wait(self, url, check, timeout=30):
+        import requests
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if check(requests.get(url + '/info', timeout=1).json()):
+                    return
+            except Exception:
+                pass
+            if any(p.poll() is not None for p in self._procs):
+                raise RuntimeError(f'Node exited during start, see logs in {self._log_dir}')
+            time.sleep(0.2)
+        raise RuntimeError(f'Cluster did not start in {timeout}s, see logs in {self._log_dir}')
+
+    def __enter__(self):
+        self.master_url = self._spawn('master', free_port())
+        self._wait(self.master_url, lambda info: True)
+        for i in range(self._secondaries):
+            self._spawn(f'secondary{i}', free_port(), self.master_url)
+        # secondaries register themselves on master
+        self._wait(self.master_url, lambda info: len(info['transport']) >= self._secondaries)
+        return self
+
+    def __exit__(self, *exc):
+        for p in self._procs:
+            p.terminate()
+        for p in self._procs:
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+async def run_load(url, w, r, clients, duration, read_ratio, read_limit, payload_size):
+    appends, reads, errors = [], [], 0
+    appended = 0
+    payload = {'msg': 'x' * payload_size}
+    deadline = time.perf_counter() + duration
+
+    async def client(session):
+        nonlocal appended, errors
+        while time.perf_counter() < deadline:
+            read = random.random() < read_ratio
+            t = time.perf_counter()
+            try:
+                if read:
+                    since = max(appended - read_limit, 0)
+                    async with session.get(url + '/logs', params={'r': r, 'since': since, 'limit': read_limit}) as resp:
+                        await resp.read()
+                else:
+                    async with session.post(url + '/log', json={'w': w, 'payload': payload}) as resp:
+                        await resp.read()
+                ok = resp.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if not ok:
+                errors += 1
+                continue
+            if read:
+                reads.append(time.perf_counter() - t)
+            else:
+                appends.append(time.perf_counter() - t)
+                appended += 1
+
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        t = time.perf_counter()
+        await asyncio.gather(*[client(session) for _ in range(clients)])
+        elapsed = time.perf_counter() - t
+    return {
+        'w': w,
+        'r': r,
+        'total_per_s': round((len(appends) + len(reads)) / elapsed, 1),
+        'errors': errors,
+        'append': summary(appends, elapsed),
+        'read': summary(reads, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--secondaries', type=int, default=2, help='Number of secondary nodes')
+    parser.add_argument('--w', type=int, nargs='+', default=None, help='Write concerns to run, all 1..nodes by default')
+    parser.add_argument('--r', type=int, nargs='+', default=None, help='Read quorums to run, all 1..nodes by default')
+    parser.add_argument('--clients', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='Load time for every (w, r), s')
+    parser.add_argument('--warmup', type=float, default=1, help='Load time before every measurement, s')
+    parser.add_argument('--read-ratio', type=float, default=0.2, help='Fraction of requests which are reads')
+    parser.add_argument('--read-limit', type=int, default=100, help='Items per read, the latest ones are read')
+    parser.add_argument('--payload-size', type=int, default=64, help='Size of payload string')
+    parser.add_argument('--node-arg', action='append', default=[],
+                        help='Extra argument for every node, {dir} is replaced by node data directory')
+    parser.add_argument('--log-dir', type=str, default=None, help='Directory for node logs')
+    args = parser.parse_args()
+
+    nodes = args.secondaries + 1
+    ws = args.w or list(range(1, nodes + 1))
+    rs = args.r or list(range(1, nodes + 1))
+    assert max(ws + rs) <= nodes, f'w and r should not exceed number of nodes {nodes}'
+
+    work_dir = tempfile.mkdtemp(prefix='rlog-bench-')
+    log_dir = args.log_dir or work_dir
+    os.makedirs(log_dir, exist_ok=True)
+
+    results = []
+    with Cluster(args.secondaries, args.node_arg, log_dir, work_dir) as cluster:
+        for w in ws:
+            for r in rs:
+                if args.warmup > 0:
+                    asyncio.run(run_load(cluster.master_url, w, r, args.clients, args.warmup,
+                                         args.read_ratio, args.read_limit, args.payload_size))
+                results.append(asyncio.run(run_load(cluster.master_url, w, r, args.clients, args.duration,
+                                                    args.read_ratio, args.read_limit, args.payload_size)))
+    print(json.dumps({
+        'nodes': nodes,
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'read_ratio': args.read_ratio,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
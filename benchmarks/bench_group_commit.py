@@ -0,0 +1,93 @@
+"""
+Append throughput of master against the number of group commits in flight: secondaries are
+simulated in process by nodes which ack replication requests after `--rtt-ms`, so the numbers
+show how much of the time group commit spends waiting for quorum.
+
+    python benchmarks/bench_group_commit.py --pipeline 1 2 4 8 --rtt-ms 5 --clients 256 --w 2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from const import Item
+from rlog import RLogServer
+
+
+class SimulatedSecondary(object):
+    """Remote node which stores nothing and acks every batch after a fixed delay"""
+
+    role = 'secondary'
+
+    def __init__(self, i, rtt_s):
+        self.id = f'secondary{i}'
+        self.url = f'http://secondary{i}'
+        self.acked_end = 0
+        self._rtt_s = rtt_s
+
+    async def async_append_batch(self, items, repair=False, end=None):
+        await asyncio.sleep(self._rtt_s)
+        return items
+
+    def close(self):
+        pass
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def measure(pipeline, args):
+    server = RLogServer(url='http://master', role='master', commit_pipeline=pipeline,
+                        batch_max_size=args.batch_max_size, topic='bench')
+    for i in range(args.secondaries):
+        server.add_node(SimulatedSecondary(i, args.rtt_ms / 1000))
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            await server.append(Item(payload={'msg': 'x' * 64}, w=args.w))
+            latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(args.clients)])
+    elapsed = time.perf_counter() - t
+    assert server.committed == len(latencies), 'Committed prefix should cover every acked append'
+    server.stop()
+    return {
+        'pipeline': pipeline,
+        'appends_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pipeline', type=int, nargs='+', default=[1, 2, 4, 8], help='Group commits in flight to compare')
+    parser.add_argument('--secondaries', type=int, default=2, help='Number of simulated secondaries')
+    parser.add_argument('--w', type=int, default=2, help='Write concern of appends')
+    parser.add_argument('--rtt-ms', type=float, default=5, help='Delay of every replication ack, ms')
+    parser.add_argument('--clients', type=int, default=256, help='Concurrent appends')
+    parser.add_argument('--batch-max-size', type=int, default=64, help='Max items in one group commit')
+    parser.add_argument('--duration', type=float, default=5, help='Load time for every pipeline depth, s')
+    args = parser.parse_args()
+
+    results = [asyncio.run(measure(pipeline, args)) for pipeline in args.pipeline]
+    print(json.dumps({
+        'rtt_ms': args.rtt_ms,
+        'w': args.w,
+        'clients': args.clients,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
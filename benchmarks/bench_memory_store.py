@@ -0,0 +1,96 @@
+"""
+Memory footprint and read speed of in-memory log store.
+
+Compares the previous layout (dict keyed by string id, items with __dict__,
+sort by int(id) on every read) with MemoryStorage and __slots__ Item.
+
+    python benchmarks/bench_memory_store.py --n 1000000
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from const import Item
+from storage import MemoryStorage
+
+
+class LegacyItem:
+    def __init__(self, payload=None):
+        self.payload = payload
+        self.id = -1
+        self.t0 = time.time()
+        self.node_id = None
+        self.w = None
+
+
+def fill_legacy(n):
+    db = dict()
+    for i in range(n):
+        item = LegacyItem(payload={'n': i})
+        item.id = str(len(db))
+        db[item.id] = item
+    return db
+
+
+def read_legacy(db):
+    # RLog.get_all + sorting in RLogServer.get_all
+    items = {it.id: [it] for it in list(db.values())}
+    return [items[i][0] for i in sorted(items.keys(), key=lambda x: int(x))]
+
+
+def fill_store(n):
+    store = MemoryStorage()
+    for i in range(n):
+        item = Item(payload={'n': i})
+        item.id = str(i)
+        store.put(i, item)
+    return store
+
+
+def read_store(store):
+    return list(store.range(0))
+
+
+def measure(fill, read, n, repeat):
+    gc.collect()
+    tracemalloc.start()
+    t = time.perf_counter()
+    store = fill(n)
+    fill_s = time.perf_counter() - t
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    read_s = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        read(store)
+        read_s.append(time.perf_counter() - t)
+    return {
+        'bytes_per_entry': round(used / n, 1),
+        'append_per_s': round(n / fill_s),
+        'get_all_s': round(min(read_s), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=200000, help='Number of entries')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of full reads, best is reported')
+    args = parser.parse_args()
+
+    result = {
+        'n': args.n,
+        'legacy_dict': measure(fill_legacy, read_legacy, args.n, args.repeat),
+        'memory_storage': measure(fill_store, read_store, args.n, args.repeat),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
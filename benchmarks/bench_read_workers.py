@@ -0,0 +1,138 @@
+"""
+Read throughput of one node against the number of read worker processes: a node with
+persistent log is filled with entries, then client processes drive GET /logs pages of
+the latest entries either at the writer (0 workers) or at the port of read workers.
+
+    python benchmarks/bench_read_workers.py --workers 0 1 2 4 --n 100000 --duration 10
+
+Clients run in separate processes too, so the load generator is not limited by one core.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import aiohttp
+import requests
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main.py')
+
+
+def free_port():
+    # the port after the returned one is used by read workers
+    while True:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        with socket.socket() as s:
+            try:
+                s.bind(('127.0.0.1', port + 1))
+                return port
+            except OSError:
+                continue
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url + '/logs', params={'limit': 1}, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start in {timeout}s')
+
+
+def fill(url, n, batch=1000, payload_size=64):
+    payload = {'msg': 'x' * payload_size}
+    for start in range(0, n, batch):
+        resp = requests.post(url + '/logs/batch', json=[{'payload': payload} for _ in range(min(batch, n - start))])
+        resp.raise_for_status()
+
+
+def client_process(url, n, limit, connections, duration, queue):
+    async def run():
+        done = 0
+        deadline = time.perf_counter() + duration
+
+        async def client(session):
+            nonlocal done
+            while time.perf_counter() < deadline:
+                since = random.randrange(max(n - limit, 1))
+                async with session.get(url + '/logs', params={'from': since, 'limit': limit}) as resp:
+                    await resp.read()
+                    assert resp.status == 200, resp.status
+                done += 1
+
+        connector = aiohttp.TCPConnector(limit=connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*[client(session) for _ in range(connections)])
+        return done
+
+    queue.put(asyncio.run(run()))
+
+
+def measure(url, n, limit, clients, connections, duration):
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=client_process, args=(url, n, limit, connections, duration, queue))
+             for _ in range(clients)]
+    for p in procs:
+        p.start()
+    total = sum(queue.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return round(total / duration, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4], help='Numbers of read workers to run, 0 is the writer alone')
+    parser.add_argument('--n', type=int, default=100000, help='Entries in log')
+    parser.add_argument('--limit', type=int, default=100, help='Entries per read')
+    parser.add_argument('--clients', type=int, default=4, help='Client processes')
+    parser.add_argument('--connections', type=int, default=16, help='Concurrent requests per client process')
+    parser.add_argument('--duration', type=float, default=10, help='Load time for every number of workers, s')
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        port = free_port()
+        url = f'http://127.0.0.1:{port}'
+        data_dir = tempfile.mkdtemp(prefix='rlog-bench-')
+        cmd = [sys.executable, MAIN, '--port', str(port), '-u', url, '--data-dir', data_dir]
+        if workers:
+            cmd += ['--read-workers', str(workers), '--read-port', str(port + 1)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(MAIN))
+        try:
+            wait_ready(url)
+            fill(url, args.n)
+            read_url = f'http://127.0.0.1:{port + 1}' if workers else url
+            wait_ready(read_url)
+            # warm response caches
+            measure(read_url, args.n, args.limit, args.clients, args.connections, 1)
+            results.append({'workers': workers,
+                            'reads_per_s': measure(read_url, args.n, args.limit, args.clients,
+                                                   args.connections, args.duration)})
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps({
+        'n': args.n,
+        'limit': args.limit,
+        'cores': os.cpu_count(),
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
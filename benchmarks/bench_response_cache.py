@@ -0,0 +1,70 @@
+"""
+Cost of serving GET /logs for a dashboard which polls the whole log while it grows:
+item2resp + JSONResponse over all items vs pre-encoded entries of ResponseCache.
+
+    python benchmarks/bench_response_cache.py --n 100000 --polls 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from starlette.responses import JSONResponse
+
+from const import Item, item2resp
+from rlog import RLogLocal
+from respcache import ResponseCache
+
+
+def fill(log, n):
+    for i in range(log.end, log.end + n):
+        item = Item(payload={'n': i, 'msg': 'x' * 32})
+        item.id = str(i)
+        log.append(item)
+
+
+def serialise(log, cache):
+    return JSONResponse([item2resp(it).dict() for it in log.get_all()]).body
+
+
+def cached(log, cache):
+    return cache.render_list(0, log.committed)
+
+
+def measure(read, n, polls, appends):
+    log = RLogLocal('bench', 'http://localhost', 'master')
+    cache = ResponseCache(log)
+    fill(log, n)
+    times = []
+    for _ in range(polls):
+        t = time.perf_counter()
+        body = read(log, cache)
+        times.append(time.perf_counter() - t)
+        fill(log, appends)
+    return {
+        'first_poll_s': round(times[0], 4),
+        'next_polls_s': round(sorted(times[1:])[len(times[1:]) // 2], 4) if polls > 1 else None,
+        'body_bytes': len(body),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100000, help='Entries in log')
+    parser.add_argument('--polls', type=int, default=10, help='Number of full reads, median of polls after first is reported')
+    parser.add_argument('--appends', type=int, default=100, help='Entries appended between polls')
+    args = parser.parse_args()
+
+    result = {
+        'n': args.n,
+        'serialise': measure(serialise, args.n, args.polls, args.appends),
+        'response_cache': measure(cached, args.n, args.polls, args.appends),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
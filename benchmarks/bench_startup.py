@@ -0,0 +1,107 @@
+"""
+Time-to-ready of a node with persistent log against log size: the log is written with a
+checkpoint taken `--tail` entries before its end, as if the node crashed between two
+checkpoints, then main.py is started on it and /info is polled until the node serves.
+Every size is measured with the checkpoint and without it, when the whole log is scanned.
+
+    python benchmarks/bench_startup.py --n 10000 100000 300000 --tail 1000
+
+Node is killed with SIGKILL after every start, so it does not write a checkpoint on exit.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from const import Item
+from rlog import RLogLocal
+from storage import SegmentedFileStorage
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main.py')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fill(path, n, tail, payload_size):
+    log = RLogLocal('bench', 'http://bench', 'master', storage=SegmentedFileStorage(path))
+    payload = {'msg': 'x' * payload_size}
+    for offset in range(n):
+        if offset == n - tail:
+            log.checkpoint()
+        item = Item(payload=payload)
+        item.id = str(offset)
+        log.append(item)
+    log.flush()
+    log.close()
+
+
+def time_to_ready(path, timeout=600):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, MAIN, '--port', str(port), '-u', url, '--data-dir', path,
+                             '--checkpoint-interval', '0'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(MAIN))
+    try:
+        while time.perf_counter() - t < timeout:
+            try:
+                if requests.get(url + '/info', timeout=1).status_code == 200:
+                    return time.perf_counter() - t
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f'Node did not start in {timeout}s')
+    finally:
+        proc.send_signal(signal.SIGKILL)
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, nargs='+', default=[10000, 100000, 300000], help='Log sizes to compare')
+    parser.add_argument('--tail', type=int, default=1000, help='Entries appended after the last checkpoint')
+    parser.add_argument('--payload-size', type=int, default=64, help='Payload bytes of every entry')
+    args = parser.parse_args()
+
+    results = []
+    for n in args.n:
+        path = tempfile.mkdtemp(prefix='rlog-bench-')
+        try:
+            fill(path, n, min(args.tail, n), args.payload_size)
+            checkpoint = os.path.join(path, SegmentedFileStorage.CHECKPOINT_FILE)
+            shutil.copy(checkpoint, checkpoint + '.bench')
+            with_checkpoint = time_to_ready(path)
+            os.remove(checkpoint)
+            full_scan = time_to_ready(path)
+            os.rename(checkpoint + '.bench', checkpoint)
+            results.append({
+                'n': n,
+                'checkpoint_s': round(with_checkpoint, 3),
+                'full_scan_s': round(full_scan, 3),
+            })
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    print(json.dumps({
+        'tail': args.tail,
+        'payload_size': args.payload_size,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
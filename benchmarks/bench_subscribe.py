@@ -0,0 +1,138 @@
+"""
+CPU cost of the master for consumers tailing the log: N clients subscribed to GET /subscribe
+vs N clients polling GET /logs from their cursor every `--poll-interval-ms`, while entries are
+appended at a fixed rate. Master runs as a uvicorn process, its CPU time is read from /proc.
+
+    python benchmarks/bench_subscribe.py --consumers 100 --rate 200 --duration 10
+
+Clients run in a separate process, delivery delay is measured from append to receipt.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+
+import aiohttp
+import requests
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'main.py')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    # utime + stime of process, in clock ticks
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url + '/info', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start in {timeout}s')
+
+
+def consumers_process(url, mode, consumers, poll_interval_s, duration, queue):
+    async def subscriber(session, delays, deadline):
+        async with session.get(url + '/subscribe', params={'from': 0}) as resp:
+            async for line in resp.content:
+                if line.startswith(b'data: '):
+                    delays.append(time.time() - json.loads(line[6:])['payload']['t'])
+                if time.time() > deadline:
+                    return
+
+    async def poller(session, delays, deadline):
+        cursor = 0
+        while time.time() < deadline:
+            async with session.get(url + '/logs', params={'from': cursor}) as resp:
+                items = await resp.json()
+                cursor = int(resp.headers['X-Next-Cursor'])
+            now = time.time()
+            delays.extend(now - it['payload']['t'] for it in items)
+            await asyncio.sleep(poll_interval_s)
+
+    async def run():
+        delays = []
+        deadline = time.time() + duration
+        consumer = subscriber if mode == 'subscribe' else poller
+        connector = aiohttp.TCPConnector(limit=consumers)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=duration + 5)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[consumer(session, delays, deadline) for _ in range(consumers)])
+        return delays
+
+    queue.put(asyncio.run(run()))
+
+
+def measure(mode, args):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    proc = subprocess.Popen([sys.executable, MAIN, '--port', str(port), '-u', url],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=os.path.dirname(MAIN))
+    try:
+        wait_ready(url)
+        queue = multiprocessing.Queue()
+        clients = multiprocessing.Process(target=consumers_process, args=(
+            url, mode, args.consumers, args.poll_interval_ms / 1000, args.duration, queue))
+        clients.start()
+        time.sleep(1)
+        cpu = cpu_seconds(proc.pid)
+        appended = 0
+        t = time.time()
+        with requests.Session() as session:
+            while time.time() - t < args.duration - 1:
+                session.post(url + '/log', json={'payload': {'t': time.time()}}).raise_for_status()
+                appended += 1
+                time.sleep(max(t + appended / args.rate - time.time(), 0))
+        delays = queue.get()
+        cpu = cpu_seconds(proc.pid) - cpu
+        clients.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+    delays.sort()
+    return {
+        'mode': mode,
+        'appended': appended,
+        'delivered': len(delays),
+        'master_cpu_s': round(cpu, 2),
+        'delay_p50_ms': round(delays[len(delays) // 2] * 1000, 1) if delays else None,
+        'delay_p99_ms': round(delays[int(len(delays) * 0.99)] * 1000, 1) if delays else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consumers', type=int, default=100, help='Clients tailing the log')
+    parser.add_argument('--rate', type=float, default=200, help='Appends per second')
+    parser.add_argument('--poll-interval-ms', type=float, default=100, help='Pause between polls of one client')
+    parser.add_argument('--duration', type=float, default=10, help='Time of every mode, s')
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'consumers': args.consumers,
+        'rate': args.rate,
+        'poll_interval_ms': args.poll_interval_ms,
+        'results': [measure('subscribe', args), measure('poll', args)],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Encode/decode cost of a replication batch: JSON with pydantic validation
+(as external clients are served) vs binary wire format used between nodes.
+
+    python benchmarks/bench_wire.py --batch 256 --repeat 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from pydantic import parse_obj_as
+
+import wire
+from const import Item, LogRequest, req2item, item2resp
+
+
+def make_items(n, payload_size):
+    items = []
+    for i in range(n):
+        item = Item(payload={'n': i, 'msg': 'x' * payload_size})
+        item.id = str(i)
+        items.append(item)
+    return items
+
+
+def json_roundtrip(items):
+    # master: request body; secondary: validation and response; master: parse response
+    body = json.dumps([it.to_dict() for it in items]).encode()
+    reqs = parse_obj_as(List[LogRequest], json.loads(body))
+    stored = [req2item(req) for req in reqs]
+    resp = json.dumps([item2resp(it).dict() for it in stored]).encode()
+    acks = [req2item(r) for r in json.loads(resp)]
+    return len(body) + len(resp), acks
+
+
+def binary_roundtrip(items):
+    body = wire.encode_items(items)
+    stored = wire.decode_items(body)
+    resp = wire.encode_ids([it.id for it in stored])
+    acks = wire.decode_ids(resp)
+    return len(body) + len(resp), acks
+
+
+def measure(fn, items, repeat):
+    size, _ = fn(items)
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(items)
+        dt = time.perf_counter() - t
+        best = dt if best is None else min(best, dt)
+    return {
+        'bytes': size,
+        'batch_s': round(best, 6),
+        'items_per_s': round(len(items) / best),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=256, help='Items in replication batch')
+    parser.add_argument('--payload-size', type=int, default=64, help='Size of payload string')
+    parser.add_argument('--repeat', type=int, default=200, help='Number of runs, best is reported')
+    args = parser.parse_args()
+
+    items = make_items(args.batch, args.payload_size)
+    result = {
+        'batch': args.batch,
+        'json_pydantic': measure(json_roundtrip, items, args.repeat),
+        'binary': measure(binary_roundtrip, items, args.repeat),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,11 +20,16 @@ class Item:
         'node_id',
         't0'
     ]
+    # logs keep millions of items, so no per-instance __dict__
+    # key is client idempotency key, it is neither stored nor replicated
+    __slots__ = ('id', 'payload', 'node_id', 't0', 'w', 'key')
+
     def __init__(self, 
         payload: Optional[Dict[str, Any]] = None, 
         id: Optional[str] = None, 
         node_id: Optional[str] = None,
-        w: Optional[int] = None
+        w: Optional[int] = None,
+        key: Optional[str] = None
     ) -> None:
         
         self.payload = payload
@@ -33,6 +38,7 @@ class Item:
         self.t0 = time.time()
         self.node_id = node_id
         self.w = w
+        self.key = key
 
     def _generate_id(self) -> str:
         return uuid.uuid4().hex[:16]
@@ -41,12 +47,13 @@ class Item:
         return json.dumps(self.to_dict())
 
     def to_dict(self):
-        _v = self.__dict__
-        return {k: _v[k] for k in self.__serialize__}
+        return {k: getattr(self, k) for k in self.__serialize__}
 
     def from_dict(self, obj):
         item = Item()
-        item.__dict__.update(obj)
+        for k, v in dict(obj).items():
+            if k in self.__slots__:
+                setattr(item, k, v)
         return item
 
 
@@ -55,6 +62,7 @@ class LogRequest(BaseModel):
     t0: Optional[float] # = Field(..., title="Message timestamp")
     node_id: Optional[str] # = Field(..., title="Node ID")
     w: Optional[int] = 1
+    key: Optional[str] = Field(None, title="Idempotency key, retries with the same key are appended once")
     payload: Dict[str, Any] = Field({'msg': 'message'}, title="Object to log")
 
 
@@ -77,6 +85,13 @@ def item2resp(item: Item) -> LogRequest:
     return resp
 
 
+def append2resp(item: Item, req: LogRequest) -> LogRequest:
+    # idempotency key is not stored, only the append response echoes it back to the client
+    resp = item2resp(item)
+    resp.key = req.key
+    return resp
+
+
 class RegisterSecondaryResponse(BaseModel):
     status: bool = Field(..., title="Status of secondary registering operation")
 
@@ -84,3 +99,8 @@ class RegisterSecondaryRequest(BaseModel):
     node_id: str = Field(..., title="Secondary node ID")
     url: str = Field(..., title="Secondary URL")
     role: str = Field(..., title="Secondary role")
+
+
+class TopicConfigRequest(BaseModel):
+    w: Optional[int] = Field(None, title="Minimal write concern of appends to topic")
+    r: Optional[int] = Field(None, title="Minimal read quorum of reads from topic")
@@ -0,0 +1,237 @@
+import json
+import base64
+import hashlib
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional
+
+from const import Item
+
+
+DIGEST_SIZE = 8
+
+
+def _h(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest(), 'little')
+
+
+def entry_hash(item: Item) -> int:
+    # node_id and t0 are local to every node, only id and payload are replicated as is
+    payload = json.dumps(item.payload, sort_keys=True, separators=(',', ':'))
+    return _h(f'{item.id}\0{payload}'.encode())
+
+
+def chain_next(head: int, h: int) -> int:
+    return _h(head.to_bytes(DIGEST_SIZE, 'little') + h.to_bytes(DIGEST_SIZE, 'little'))
+
+
+def digest2hex(digest: Optional[int]) -> Optional[str]:
+    return None if digest is None else format(digest, '016x')
+
+
+def hex2digest(value: Optional[str]) -> Optional[int]:
+    return None if value is None else int(value, 16)
+
+
+class HashChain(object):
+    """
+    Rolling hash over the contiguous prefix of the log: h(n+1) = H(h(n) | H(item n)).
+    Two nodes with equal chain value at offset n hold the same first n items.
+    Values are kept only every `step` items, others are recomputed from the log.
+    """
+
+    STEP = 256
+
+    def __init__(self, step: int = STEP):
+        self._step = step
+        self._checkpoints = array('Q', [0]) # chain value at offsets 0, step, 2*step...
+        self._head = 0
+        self._version = 0
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def version(self):
+        # length of the prefix covered by the chain
+        return self._version
+
+    @property
+    def head(self):
+        return self._head
+
+    def extend(self, item: Item):
+        self._head = chain_next(self._head, entry_hash(item))
+        self._version += 1
+        if self._version % self._step == 0:
+            self._checkpoints.append(self._head)
+
+    def advance(self, get: Callable[[int], Optional[Item]]):
+        # extend over items which arrived out of order and filled the gap
+        while True:
+            item = get(self._version)
+            if item is None:
+                break
+            self.extend(item)
+
+    def at(self, offset: int, get: Callable[[int], Optional[Item]]) -> Optional[int]:
+        if offset < 0 or offset > self._version:
+            return None
+        if offset == self._version:
+            return self._head
+        base = offset // self._step
+        h = self._checkpoints[base]
+        for o in range(base * self._step, offset):
+            h = chain_next(h, entry_hash(get(o)))
+        return h
+
+    def state(self) -> dict:
+        """Serializable chain values, restored by from_state without rehashing the log"""
+        return {
+            'step': self._step,
+            'version': self._version,
+            'head': digest2hex(self._head),
+            'checkpoints': base64.b64encode(self._checkpoints.tobytes()).decode(),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'HashChain':
+        chain = cls(step=state['step'])
+        chain._checkpoints = array('Q')
+        chain._checkpoints.frombytes(base64.b64decode(state['checkpoints']))
+        chain._head = hex2digest(state['head'])
+        chain._version = state['version']
+        return chain
+
+    def verify(self, get: Callable[[int], Optional[Item]]) -> bool:
+        """Head is recomputed over items after the last kept value, so tail of restored chain matches the log"""
+        if len(self._checkpoints) != self._version // self._step + 1:
+            return False
+        base = self._version // self._step
+        h = self._checkpoints[base]
+        for o in range(base * self._step, self._version):
+            item = get(o)
+            if item is None:
+                return False
+            h = chain_next(h, entry_hash(item))
+        return h == self._head
+
+    def reset(self, offset: int):
+        # drop chain after `offset`, it is rebuilt by advance()
+        if offset >= self._version:
+            return
+        base = max(offset, 0) // self._step
+        del self._checkpoints[base + 1:]
+        self._head = self._checkpoints[base]
+        self._version = base * self._step
+
+
+def digest_offsets(since: int, stop: int, max_ranges: int = 64, step: int = HashChain.STEP) -> List[int]:
+    """Range boundaries to compare: ends of the window plus aligned offsets in between"""
+    if stop <= since:
+        return [since]
+    span = step * max(1, -(-(stop - since) // (max_ranges * step)))
+    first = (since // span + 1) * span
+    return [since] + list(range(first, stop, span)) + [stop]
+
+
+def agreed_offset(offsets: Iterable[int], local: Dict[int, Optional[int]], remote: Dict[int, Optional[int]]) -> int:
+    """Last boundary up to which both chains are equal"""
+    offsets = list(offsets)
+    agreed = offsets[0]
+    for o in offsets:
+        if remote.get(o) is None or remote.get(o) != local.get(o):
+            break
+        agreed = o
+    return agreed
+
+
+def combine(left: int, right: int) -> int:
+    # empty subtrees hash to 0, so tree shape does not depend on log size
+    if left == 0 and right == 0:
+        return 0
+    return _h(left.to_bytes(DIGEST_SIZE, 'little') + right.to_bytes(DIGEST_SIZE, 'little'))
+
+
+class MerkleTree(object):
+    """
+    Merkle tree over fixed-size ranges of offsets. Node (level, index) covers leaves
+    [index * 2^level, (index + 1) * 2^level), leaf i covers offsets [i * leaf_size, (i + 1) * leaf_size).
+    Leaves are recomputed lazily after items in their range change.
+    """
+
+    LEAF_SIZE = 256
+
+    def __init__(self, leaf_size: int = LEAF_SIZE):
+        self._leaf_size = leaf_size
+        self._levels = [array('Q')] # levels[0] are leaves
+        self._dirty = set()         # leaves changed since last refresh
+
+    @property
+    def leaf_size(self):
+        return self._leaf_size
+
+    def touch(self, offset: int):
+        self._dirty.add(offset // self._leaf_size)
+
+    def touch_range(self, start: int, stop: int):
+        if stop > start:
+            self._dirty.update(range(start // self._leaf_size, (stop - 1) // self._leaf_size + 1))
+
+    def _leaf_hash(self, leaf: int, get: Callable[[int], Optional[Item]], end: int) -> int:
+        hashes = []
+        for o in range(leaf * self._leaf_size, min((leaf + 1) * self._leaf_size, end)):
+            item = get(o)
+            hashes.append(0 if item is None else entry_hash(item))
+        if not any(hashes):
+            return 0
+        return _h(b''.join(h.to_bytes(DIGEST_SIZE, 'little') for h in hashes))
+
+    def _refresh(self, get, end):
+        nleaves = -(-end // self._leaf_size)
+        leaves = self._levels[0]
+        if len(leaves) < nleaves:
+            self._dirty.update(range(len(leaves), nleaves))
+            leaves.extend([0] * (nleaves - len(leaves)))
+        dirty = {leaf for leaf in self._dirty if leaf < nleaves}
+        self._dirty.clear()
+        for leaf in dirty:
+            leaves[leaf] = self._leaf_hash(leaf, get, end)
+        # update ancestors of changed leaves only
+        level = 0
+        while len(self._levels[level]) > 1:
+            if len(self._levels) == level + 1:
+                self._levels.append(array('Q'))
+                dirty = set(range(len(self._levels[level])))
+            below, above = self._levels[level], self._levels[level + 1]
+            size = -(-len(below) // 2)
+            if len(above) < size:
+                dirty.update(2 * i for i in range(len(above), size))
+                above.extend([0] * (size - len(above)))
+            dirty = {i // 2 for i in dirty}
+            for i in dirty:
+                above[i] = combine(below[2 * i], below[2 * i + 1] if 2 * i + 1 < len(below) else 0)
+            level += 1
+
+    def height(self, end: int) -> int:
+        # level of the root covering all leaves below `end`
+        nleaves = -(-end // self._leaf_size)
+        return max(nleaves - 1, 0).bit_length()
+
+    def node(self, level: int, index: int, get: Callable[[int], Optional[Item]], end: int, log_end: int) -> int:
+        """Hash of the tree node, only offsets below `end` are taken into account"""
+        if self._dirty or len(self._levels[0]) < -(-log_end // self._leaf_size):
+            self._refresh(get, log_end)
+        return self._node(level, index, get, min(end, log_end))
+
+    def _node(self, level, index, get, end):
+        end_leaf = -(-end // self._leaf_size) # leaves at and after end_leaf are empty
+        if (index << level) >= end_leaf:
+            return 0
+        if ((index + 1) << level) * self._leaf_size <= end and level < len(self._levels) \
+                and index < len(self._levels[level]):
+            # node is below `end`, so cached value is valid
+            return self._levels[level][index]
+        if level == 0:
+            return self._leaf_hash(index, get, end)
+        return combine(self._node(level - 1, 2 * index, get, end), self._node(level - 1, 2 * index + 1, get, end))
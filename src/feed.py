@@ -0,0 +1,163 @@
+import json
+import asyncio
+import logging
+from typing import AsyncIterator
+
+import metrics
+
+
+MEDIA_TYPE = 'text/event-stream'
+
+SUBSCRIBERS_DROPPED = metrics.counter('rlog_subscribers_dropped_total',
+    'Subscribers disconnected because they did not keep up with the log')
+
+
+def _frame(offset: int, entry: bytes) -> bytes:
+    # Server-Sent Event with offset as event id, so client resumes with Last-Event-ID
+    return b'id: %d\ndata: %s\n\n' % (offset, entry)
+
+
+# comment line keeps proxies from closing idle stream
+_KEEPALIVE = (None, (), b': keepalive\n\n')
+
+
+def _close_frame(reason: str, offset: int) -> bytes:
+    data = json.dumps({'reason': reason, 'next': offset}).encode()
+    return b'event: close\ndata: %s\n\n' % data
+
+
+class _Subscriber(object):
+    __slots__ = ('offset', 'queue', 'pending')
+
+    def __init__(self, offset):
+        self.offset = offset           # next offset to send
+        self.queue = asyncio.Queue()   # (first offset, frames, joined frames) or reason of disconnect
+        self.pending = 0               # entries in queue
+
+
+class LogFeed(object):
+    """
+    Pushes committed entries of a log to subscribers. New entries are taken pre-encoded from the
+    response cache and framed once per feed, every live subscriber gets the same bytes. Subscriber
+    which still has entries not sent when its backlog would exceed `buffer_size` is disconnected,
+    so one slow client keeps a bounded amount of memory and does not hold others.
+    """
+
+    def __init__(self, log, cache, buffer_size=10000, batch_size=256, max_subscribers=1000, heartbeat_s=15.0):
+        self._log = log
+        self._cache = cache
+        self._buffer_size = buffer_size
+        self._batch_size = batch_size
+        self._max_subscribers = max_subscribers
+        self._heartbeat_s = heartbeat_s
+        self._subscribers = set() # every open stream, catching up or live
+        self._live = set()        # subscribers fed by fan-out
+        self._position = 0        # entries below it were fanned out to live subscribers
+        self._scheduled = False
+        self._heartbeat = None    # timer handle, runs while there are live subscribers
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    @property
+    def position(self):
+        if not self._live:
+            # nothing to fan out to, new live subscriber starts at the committed end
+            self._position = self._log.committed
+        return self._position
+
+    @property
+    def full(self):
+        return len(self._subscribers) >= self._max_subscribers
+
+    def notify(self):
+        # called after items are appended to local log, fan-out runs once per loop iteration
+        if self._live and not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self._fan_out)
+
+    def _fan_out(self):
+        self._scheduled = False
+        committed = self._log.committed
+        if not self._live or self._position >= committed:
+            return
+        batches = []
+        for start in range(self._position, committed, self._batch_size):
+            stop = min(start + self._batch_size, committed)
+            frames = [_frame(offset, entry) for offset, entry in
+                      enumerate(self._cache.entries(start, stop), start)]
+            batches.append((start, frames, b''.join(frames)))
+        self._position = committed
+        count = committed - batches[0][0]
+        for sub in list(self._live):
+            # subscriber which drained its queue gets a large commit whole, batches are shared anyway
+            if sub.pending and sub.pending + count > self._buffer_size:
+                self._drop(sub)
+                continue
+            for batch in batches:
+                sub.queue.put_nowait(batch)
+            sub.pending += count
+
+    def _beat(self):
+        # one timer per feed instead of a timeout per subscriber wait
+        self._heartbeat = None
+        for sub in self._live:
+            if sub.queue.empty():
+                sub.queue.put_nowait(_KEEPALIVE)
+        self._schedule_heartbeat()
+
+    def _schedule_heartbeat(self):
+        if self._live and self._heartbeat is None:
+            self._heartbeat = asyncio.get_running_loop().call_later(self._heartbeat_s, self._beat)
+
+    def _drop(self, sub):
+        logging.warning(f'Subscriber at offset {sub.offset} is {sub.pending} entries behind, disconnect it')
+        SUBSCRIBERS_DROPPED.inc()
+        self._live.discard(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.pending = 0
+        sub.queue.put_nowait('slow consumer')
+
+    async def events(self, since: int = 0) -> AsyncIterator[bytes]:
+        """SSE frames of committed entries from `since`, then of new commits until client leaves or is dropped"""
+        sub = _Subscriber(max(since, 0))
+        self._subscribers.add(sub)
+        try:
+            # history is read from the response cache until the subscriber reaches fan-out position;
+            # position is checked and subscriber joins live set without await in between
+            while sub.offset < self.position:
+                stop = min(self.position, sub.offset + self._batch_size)
+                frames = [_frame(offset, entry) for offset, entry in
+                          enumerate(self._cache.entries(sub.offset, stop), sub.offset)]
+                yield b''.join(frames)
+                sub.offset = stop
+            self._live.add(sub)
+            self._schedule_heartbeat()
+
+            while True:
+                batch = await sub.queue.get()
+                if isinstance(batch, str):
+                    yield _close_frame(batch, sub.offset)
+                    return
+                start, frames, data = batch
+                if start is None:
+                    yield data
+                    continue
+                sub.pending -= len(frames)
+                if sub.offset >= start + len(frames):
+                    # subscribed from offset which was not committed yet
+                    continue
+                yield data if sub.offset == start else b''.join(frames[sub.offset - start:])
+                sub.offset = start + len(frames)
+        finally:
+            self._live.discard(sub)
+            self._subscribers.discard(sub)
+
+    def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for sub in list(self._live):
+            self._live.discard(sub)
+            sub.queue.put_nowait('shutdown')
@@ -1,17 +1,31 @@
 import os
+import math
 import argparse
 import logging
 import asyncio
 import uvicorn
-from fastapi import FastAPI, Response, Request
-from fastapi.responses import JSONResponse
+import json
+from fastapi import FastAPI, Response, Request, Query, HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError, parse_obj_as
+from fastapi.responses import JSONResponse, StreamingResponse
 import time
+from typing import List, Optional
 from threading import Thread, Condition
 
 # from omegaconf import OmegaConf, MISSING
 # from base_cli import BaseCLI
-from const import LogRequest, LogListResponse, Item, LogNodeType, req2item, item2resp, RegisterSecondaryRequest
-from rlog import RLogServer
+from const import LogRequest, LogListResponse, Item, LogNodeType, req2item, item2resp, append2resp, RegisterSecondaryRequest, \
+    TopicConfigRequest
+from rlog import RLogServer, AdmissionControl, ReplicationSlots, Unavailable, Conflict, digest2resp, id2offset
+from topics import Topics
+from readers import ReadWorkers
+from digest import MerkleTree, digest2hex
+import wire
+import feed
+import metrics
+from utils import TransportConfig
+from storage import SegmentedFileStorage, FsyncPolicy
 
 
 logging.basicConfig(level=logging.INFO)
@@ -23,11 +37,112 @@ parser.add_argument('--port', type=int, default=int(os.environ.get("PORT", 8080)
 # parser.add_argument('-n', '--nodes', nargs='+', default=[], help='List of URLs to nodes (secondaries)')
 parser.add_argument('-m', '--master_url', type=str, default=None, help='Do not set if node is master')
 parser.add_argument('-u', '--url', type=str, help='URL to access this service')
+parser.add_argument('--batch-window-ms', type=float, default=2, help='Time window to group concurrent appends on master')
+parser.add_argument('--batch-max-size', type=int, default=256, help='Max number of items replicated in one group commit')
+parser.add_argument('--commit-pipeline', type=int, default=4, help='Group commits waiting for quorum at the same time on master')
+parser.add_argument('--pool-size', type=int, default=10, help='Max pooled connections per remote node')
+parser.add_argument('--keepalive', type=float, default=30, help='Keep-alive time for idle connections between nodes, s')
+parser.add_argument('--connect-timeout', type=float, default=1.0, help='Connect timeout for requests between nodes, s')
+parser.add_argument('--read-timeout', type=float, default=10.0, help='Read timeout for requests between nodes, s')
+parser.add_argument('--data-dir', type=str, default=None, help='Directory for persistent log. Log is kept in memory if not set')
+parser.add_argument('--fsync', type=str, default=FsyncPolicy.BATCH,
+                    choices=[FsyncPolicy.ALWAYS, FsyncPolicy.BATCH, FsyncPolicy.INTERVAL], help='When persistent log is synced to disk')
+parser.add_argument('--fsync-interval', type=float, default=1.0, help='Sync period for `interval` fsync policy, s')
+parser.add_argument('--segment-size-mb', type=int, default=64, help='Size of persistent log segment file')
+parser.add_argument('--checkpoint-interval', type=float, default=10, help='Period of checkpoints of persistent log, restart scans only records after the last one, s')
+parser.add_argument('--sparse-index-step', type=int, default=4096, help='Offsets between index entries sampled by checkpoint to validate index on restart')
+parser.add_argument('--anti-entropy-interval', type=float, default=30, help='Period of merkle tree comparison with secondaries, s')
+parser.add_argument('--probe-interval', type=float, default=1.0, help='Period of health probes of other nodes, s')
+parser.add_argument('--probe-timeout', type=float, default=1.0, help='Timeout of health probe, s')
+parser.add_argument('--heartbeat', type=float, default=1.0, help='Node is not probed if it responded to replication within this time, s')
+parser.add_argument('--snapshot-threshold', type=int, default=10000, help='Secondary which is behind by more items gets a snapshot instead of catch-up')
+parser.add_argument('--catch-up-chunk-size', type=int, default=500, help='Items in one request of catch-up of secondary')
+parser.add_argument('--catch-up-parallelism', type=int, default=4, help='Concurrent requests of catch-up of one secondary')
+parser.add_argument('--max-inflight', type=int, default=64, help='Max concurrent replication requests from this node')
+parser.add_argument('--straggler-timeout', type=float, default=30, help='Cancel replication requests still running after quorum is reached, s')
+parser.add_argument('--replication-queue-size', type=int, default=100000, help='Max items queued on master for one secondary')
+parser.add_argument('--replication-batch-size', type=int, default=512, help='Max items in one replication request')
+parser.add_argument('--replication-pipeline', type=int, default=4, help='Replication requests in flight to one secondary')
+parser.add_argument('--dedup-cache-size', type=int, default=100000, help='Max idempotency keys remembered by master')
+parser.add_argument('--dedup-ttl', type=float, default=600, help='Time idempotency key is remembered by master, s')
+parser.add_argument('--response-cache-mb', type=int, default=64, help='Memory for pre-encoded entries served by /logs and /log/{id}')
+parser.add_argument('--max-pending-appends', type=int, default=1024, help='Appends in flight on master, later ones are queued')
+parser.add_argument('--admission-queue', type=int, default=1024, help='Appends waiting for a slot, later ones get 429 at once')
+parser.add_argument('--admission-timeout', type=float, default=1.0, help='Time append waits for a slot before 429, s')
+parser.add_argument('--quorum-timeout', type=float, default=5.0, help='Time to get acks of w-1 (r-1) secondaries before 503, s')
+parser.add_argument('--max-inflight-per-node', type=int, default=8, help='Max concurrent read requests to one remote node, busy node is skipped')
+parser.add_argument('--subscriber-buffer', type=int, default=10000, help='Entries buffered for one subscriber before it is disconnected as slow')
+parser.add_argument('--max-subscribers', type=int, default=1000, help='Max open subscription streams per log')
+parser.add_argument('--read-workers', type=int, default=0, help='Processes serving reads from persistent log, requires --data-dir')
+parser.add_argument('--read-port', type=int, default=None, help='Port of read workers, service port + 1 by default')
 args = parser.parse_args()
 
 
 role = 'secondary' if args.master_url else 'master'
-RLOG = RLogServer(url=args.url, role=role)
+
+
+def make_storage(path):
+    # log is kept in memory if data directory is not set
+    if not path:
+        return None
+    return SegmentedFileStorage(path,
+        segment_size=args.segment_size_mb * 1024 * 1024,
+        fsync=args.fsync,
+        fsync_interval_s=args.fsync_interval,
+        sparse_index_step=args.sparse_index_step)
+
+
+# the same settings for default log and every topic
+SERVER_KWARGS = dict(
+    batch_window_s=args.batch_window_ms / 1000,
+    batch_max_size=args.batch_max_size,
+    commit_pipeline=args.commit_pipeline,
+    subscriber_buffer=args.subscriber_buffer,
+    catch_up_chunk_size=args.catch_up_chunk_size,
+    catch_up_parallelism=args.catch_up_parallelism,
+    checkpoint_interval_s=args.checkpoint_interval,
+    max_subscribers=args.max_subscribers,
+    transport_config=TransportConfig(
+        pool_size=args.pool_size,
+        keepalive_s=args.keepalive,
+        connect_timeout_s=args.connect_timeout,
+        read_timeout_s=args.read_timeout),
+    straggler_timeout_s=args.straggler_timeout,
+    anti_entropy_interval_s=args.anti_entropy_interval,
+    probe_interval_s=args.probe_interval,
+    probe_timeout_s=args.probe_timeout,
+    heartbeat_s=args.heartbeat,
+    snapshot_threshold=args.snapshot_threshold,
+    replication_queue_size=args.replication_queue_size,
+    replication_batch_size=args.replication_batch_size,
+    replication_pipeline=args.replication_pipeline,
+    dedup_cache_size=args.dedup_cache_size,
+    dedup_ttl_s=args.dedup_ttl,
+    response_cache_bytes=args.response_cache_mb * 1024 * 1024,
+    quorum_timeout_s=args.quorum_timeout,
+    # one limit for appends to the default log and all topics
+    admission=AdmissionControl(
+        max_inflight=args.max_pending_appends,
+        max_queue=args.admission_queue,
+        queue_timeout_s=args.admission_timeout),
+    # limits of requests to other nodes hold for the whole node as well
+    replication_slots=ReplicationSlots(
+        max_inflight=args.max_inflight,
+        max_inflight_per_node=args.max_inflight_per_node))
+RLOG = RLogServer(url=args.url, role=role, storage=make_storage(args.data_dir), **SERVER_KWARGS)
+TOPICS = Topics(RLOG,
+    lambda name, path: RLogServer(url=args.url, role=role, storage=make_storage(path),
+                                  node_id=RLOG.node.id, topic=name, scheduler=RLOG.scheduler, **SERVER_KWARGS),
+    data_dir=args.data_dir)
+READERS = None
+if args.read_workers > 0:
+    assert args.data_dir, 'Read workers serve persistent log, set --data-dir'
+    READERS = ReadWorkers(args.data_dir,
+        port=args.read_port or args.port + 1,
+        count=args.read_workers,
+        writer_url=args.url,
+        cache_bytes=args.response_cache_mb * 1024 * 1024,
+        keepalive_s=args.keepalive)
 # if role == 'secondary':
 #     RLOG.add_remote_node(args.master_url)
 
@@ -40,63 +155,281 @@ app = FastAPI(
 
 @app.on_event("startup")
 async def startup_event():
-    def _register_on_master_task():
-        time.sleep(1)
-        RLOG.add_remote_node(args.master_url)    
+    RLOG.start()
+    TOPICS.load()
+    if READERS is not None:
+        READERS.start()
+    async def _register_on_master_task():
+        await asyncio.sleep(1)
+        await RLOG.add_remote_node(args.master_url)
     # UGLY but secondaary should start before it sends req to master and register
     if role == 'secondary':
-        t = Thread(target=_register_on_master_task)
-        t.start()
+        asyncio.ensure_future(_register_on_master_task())
     
         
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # uvicorn re-raises the stop signal after it exits, so clean shutdown is checkpointed
+    # here and the next start does not scan the log
+    RLOG.checkpoint()
+    TOPICS.checkpoint()
+
+
+@app.exception_handler(Unavailable)
+async def unavailable_handler(request: Request, exc: Unavailable):
+    # 429 when master is overloaded, 503 when quorum is not reached in time
+    return JSONResponse({'detail': str(exc)}, status_code=exc.status_code,
+                        headers={'Retry-After': str(max(int(math.ceil(exc.retry_after_s)), 1))})
+
+
+async def _log_of(request: Request, create: bool = False) -> RLogServer:
+    # routes under /topics/{topic} work with the topic, the rest with the default log
+    name = request.path_params.get('topic')
+    if name is None:
+        return RLOG
+    try:
+        topic = await TOPICS.open(name) if create else TOPICS.get(name)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if topic is None:
+        raise HTTPException(status_code=404, detail=f'Topic {name} not found')
+    return topic
+
+
+# appends of clients create topics on master, secondary gets them from master, see Topics.open
+CREATE_TOPICS = role == 'master'
+
+
 @app.post("/log/{log_id}", name="log:append_known")
-def log_append_id(log_id: str, req: LogRequest):
+@app.post("/topics/{topic}/log/{log_id}", name="topic:log:append_known")
+async def log_append_id(request: Request, log_id: str, req: LogRequest):
+    if id2offset(log_id) is None:
+        raise HTTPException(status_code=422, detail=f'Item id should be a log offset, got {log_id}')
+    rlog = await _log_of(request, create=CREATE_TOPICS)
     item = req2item(req)
     item.id = log_id
-    _item = RLOG.append(item)
-    return item2resp(_item)
+    item.w = max(item.w or 1, TOPICS.config(rlog.topic)['w'])
+    try:
+        _item = await rlog.append(item)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Conflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return append2resp(_item, req)
+
+
+def _too_stale(rlog: RLogServer, max_lag: Optional[float]) -> Optional[Response]:
+    # bounded staleness: reject read if node may miss items appended on master more than max_lag seconds ago
+    if max_lag is None:
+        return None
+    staleness = rlog.staleness
+    if staleness <= max_lag:
+        return None
+    return JSONResponse({'detail': f'Node is behind master, staleness {staleness:.3f}s exceeds max_lag {max_lag}s'},
+                        status_code=503, headers={'X-Staleness': f'{staleness:.3f}'})
 
 
 @app.get("/log/{log_id}", name="log:get_known")
-def log_get_id(log_id: str):
-    _item = RLOG.get(log_id)
-    return item2resp(_item)
+@app.get("/topics/{topic}/log/{log_id}", name="topic:log:get_known")
+async def log_get_id(request: Request, log_id: str, max_lag: Optional[float] = None):
+    rlog = await _log_of(request)
+    stale = _too_stale(rlog, max_lag)
+    if stale is not None:
+        return stale
+    body = rlog.encoded_item(log_id)
+    if body is None:
+        return JSONResponse({'detail': f'Item {log_id} not found'}, status_code=404)
+    return Response(body, media_type='application/json')
 
 
 @app.post("/log", response_model=LogRequest, name="log:append_new")
-def log_append(req: LogRequest):
+@app.post("/topics/{topic}/log", response_model=LogRequest, name="topic:log:append_new")
+async def log_append(request: Request, req: LogRequest):
+    rlog = await _log_of(request, create=CREATE_TOPICS)
     l = req2item(req)
-    _item = RLOG.append(l)
-    return item2resp(_item)
+    l.w = max(l.w or 1, TOPICS.config(rlog.topic)['w'])
+    try:
+        _item = await rlog.append(l)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return append2resp(_item, req)
 
 
 @app.get("/logs", name="logs:get")
-def logs_get(r:int=1):
-    items = RLOG.get_all(r=int(r))
-    return [item2resp(it) for it in items]
+@app.get("/topics/{topic}/logs", name="topic:logs:get")
+async def logs_get(request: Request, r:int=1, since:int=Query(0, ge=0),
+                   from_:Optional[int]=Query(None, alias='from', ge=0), limit:Optional[int]=Query(None, ge=1),
+                   format:Optional[str]=None, max_lag:Optional[float]=None):
+    # `from` is the cursor returned in X-Next-Cursor, `since` is kept for older clients
+    rlog = await _log_of(request)
+    stale = _too_stale(rlog, max_lag)
+    if stale is not None:
+        return stale
+    r = max(r, TOPICS.config(rlog.topic)['r'])
+    start = from_ if from_ is not None else since
+    headers = {'X-Next-Cursor': str(rlog.next_cursor(since=start, limit=limit))}
+    if limit is not None:
+        headers['Link'] = f'<{request.url.path}?from={headers["X-Next-Cursor"]}&limit={limit}>; rel="next"'
+
+    accept = request.headers.get('accept', '')
+    if wire.MEDIA_TYPE in accept:
+        # replication between nodes
+        items = await rlog.get_all(r=int(r), since=start, limit=limit)
+        return Response(wire.encode_items(items), media_type=wire.MEDIA_TYPE, headers=headers)
+
+    ndjson = format == 'ndjson' or wire.NDJSON_MEDIA_TYPE in accept
+    if ndjson:
+        items = rlog.iter_all(since=start, limit=limit) if r <= 1 \
+            else await rlog.get_all(r=int(r), since=start, limit=limit)
+        return StreamingResponse(wire.ndjson_lines(items), media_type=wire.NDJSON_MEDIA_TYPE, headers=headers)
+
+    if r > 1:
+        # quorum check only, response is served from pre-encoded entries of the same window
+        await rlog.get_all(r=int(r), since=start, limit=limit)
+    body = rlog.encoded_list(since=start, stop=int(headers['X-Next-Cursor']))
+    return Response(body, media_type='application/json', headers=headers)
+
+
+@app.get("/subscribe", name="logs:subscribe")
+@app.get("/topics/{topic}/subscribe", name="topic:logs:subscribe")
+async def logs_subscribe(request: Request, since: int = Query(0, ge=0),
+                         from_: Optional[int] = Query(None, alias='from', ge=0)):
+    # Server-Sent Events: committed items from `from`, then new commits as they happen;
+    # reconnecting client continues after Last-Event-ID
+    rlog = await _log_of(request)
+    start = from_ if from_ is not None else since
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id is not None and last_event_id.isdigit():
+        start = int(last_event_id) + 1
+    return StreamingResponse(rlog.subscribe(since=start), media_type=feed.MEDIA_TYPE,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.post("/logs/batch", name="logs:append_batch")
+@app.post("/topics/{topic}/logs/batch", name="topic:logs:append_batch")
+async def logs_append_batch(request: Request, repair: bool = False, end: Optional[int] = None,
+                            catch_up_since: Optional[int] = None, catch_up_upto: Optional[int] = None):
+    # nodes send binary batches, external clients send list of LogRequest as JSON
+    rlog = await _log_of(request, create=CREATE_TOPICS)
+    binary = request.headers.get('content-type', '').startswith(wire.MEDIA_TYPE)
+    if binary:
+        try:
+            items = wire.decode_items(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f'Malformed batch: {e}')
+    else:
+        try:
+            reqs = parse_obj_as(List[LogRequest], await request.json())
+        except ValidationError as e:
+            raise RequestValidationError(e.raw_errors)
+        except ValueError as e:
+            # body is not JSON at all
+            raise HTTPException(status_code=422, detail=f'Malformed batch: {e}')
+        items = [req2item(req) for req in reqs]
+    min_w = TOPICS.config(rlog.topic)['w']
+    for item in items:
+        item.w = max(item.w or 1, min_w)
+    catch_up = None if catch_up_since is None or catch_up_upto is None else (catch_up_since, catch_up_upto)
+    try:
+        _items = await rlog.append_batch(items, repair=repair, catch_up=catch_up)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if end is not None:
+        # log end of master when batch was sent
+        rlog.note_master_end(end)
+    if binary:
+        return Response(wire.encode_ids([it.id for it in _items]), media_type=wire.MEDIA_TYPE)
+    return [item2resp(it) for it in _items]
 
 
 @app.post("/register", name="node:register")
 async def register_secondary(req: RegisterSecondaryRequest): # , request: Request):
-    RLOG.add_remote_node(req.url)
+    # blocking requests to the new node run in executor, see RLogServer.add_remote_node
+    if await RLOG.add_remote_node(req.url):
+        for node in RLOG.remote_nodes:
+            if node.url == req.url:
+                await TOPICS.add_node(node)
     return JSONResponse({'status': 'success'})
 
 @app.get("/healthcheck")
-def healthcheck():
+@app.get("/topics/{topic}/healthcheck")
+async def healthcheck(request: Request, end: Optional[int] = None):
+    rlog = await _log_of(request)
+    if end is not None:
+        rlog.note_master_end(end)
     return JSONResponse({'status': 'success'})
 
+@app.post("/snapshot", name="node:install_snapshot")
+@app.post("/topics/{topic}/snapshot", name="topic:node:install_snapshot")
+async def snapshot_install(request: Request, since: int = 0, upto: int = 0):
+    # body is a stream of compressed frames, see snapshot.py
+    state = await (await _log_of(request)).install_snapshot(request.stream(), since=since, upto=upto)
+    return JSONResponse(state)
+
+@app.get("/digest", name="logs:digest")
+@app.get("/topics/{topic}/digest", name="topic:logs:digest")
+async def digest(request: Request, at: List[int] = Query([])):
+    return JSONResponse(digest2resp((await _log_of(request)).node.digest(at)))
+
+@app.get("/merkle", name="logs:merkle")
+@app.get("/topics/{topic}/merkle", name="topic:logs:merkle")
+async def merkle(request: Request, level: int = 0, index: List[int] = Query([]), end: Optional[int] = None):
+    hashes = (await _log_of(request)).node.merkle(level, index, end)
+    return JSONResponse({
+        'leaf_size': MerkleTree.LEAF_SIZE,
+        'hashes': {str(i): digest2hex(h) for i, h in hashes.items()}})
+
+@app.get("/metrics")
+async def metrics_get():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/info")
-def info():
+@app.get("/topics/{topic}/info")
+async def info(request: Request, end: Optional[int] = None):
+    rlog = await _log_of(request)
+    if end is not None:
+        rlog.note_master_end(end)
+    _digest = digest2resp(rlog.node.digest())
     return JSONResponse({ 
-        'node_id': RLOG.node.id, 
-        'role': RLOG.node.role, 
-        'version': RLOG.node.data_version})
+        'node_id': rlog.node.id, 
+        'role': rlog.node.role, 
+        'topic': rlog.topic,
+        'version': rlog.node.data_version,
+        'committed': rlog.committed,
+        'allocated': rlog.allocated,
+        'staleness': rlog.staleness if rlog.staleness != float('inf') else None,
+        'digest': {'version': _digest['version'], 'digest': _digest['digest']},
+        'formats': wire.FORMATS,
+        'snapshot': rlog.snapshot_state,
+        'catch_up': rlog.catch_up_state,
+        'config': TOPICS.config(rlog.topic),
+        'transport': rlog.transport_stats()})
+
+@app.get("/topics", name="topics:list")
+async def topics_list():
+    return JSONResponse({name: {
+        'version': TOPICS.get(name).node.data_version,
+        'committed': TOPICS.get(name).committed,
+        'config': TOPICS.config(name)} for name in TOPICS.names()})
+
+@app.post("/topics/{topic}", name="topics:configure")
+async def topic_configure(topic: str, req: TopicConfigRequest):
+    # creates topic if it does not exist, w and r are minimal guarantees for its appends and reads
+    try:
+        config = await TOPICS.configure(topic, w=req.w, r=req.r)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return JSONResponse({'topic': topic, 'config': config})
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=args.port)
+    # keep server side of inter-node connections open as long as clients pool them
+    uvicorn.run(app, host="0.0.0.0", port=args.port, timeout_keep_alive=int(args.keepalive))
+    if READERS is not None:
+        READERS.stop()
+    TOPICS.stop()
     RLOG.stop()
 
 
@@ -0,0 +1,198 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Tuple
+
+
+# Minimal collectors rendered in Prometheus text format (version 0.0.4).
+# Updates come from the event loop, so values are plain numbers without locks;
+# values which are expensive to keep up to date are computed by callbacks on scrape.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    TYPE = None
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._children = {} # label values -> child
+
+    def labels(self, *values, **kwargs):
+        # children are cached, so hot paths can keep reference to them
+        if kwargs:
+            values = tuple(kwargs[n] for n in self.label_names)
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield self.name, _labels(self.label_names, values), child.value
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} {self.TYPE}'
+        for name, labels, value in self._samples():
+            yield f'{name}{labels} {_number(value)}'
+
+
+class _Value(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge computed on scrape; `func` returns {label values tuple: value}"""
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, doc: str, func: Callable[[], Dict[Tuple, float]], labels: Iterable[str] = ()):
+        super(CallbackGauge, self).__init__(name, doc, labels)
+        self._func = func
+
+    def _samples(self):
+        for values, value in self._func().items():
+            yield self.name, _labels(self.label_names, values), value
+
+
+class _HistogramValue(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer(object):
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._t)
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, doc: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labels)
+        self._buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self._buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            counts, cumulative = list(child.counts), 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', _labels(self.label_names, values, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum', _labels(self.label_names, values), child.sum
+            yield self.name + '_count', _labels(self.label_names, values), cumulative
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        # metric with the same name is replaced, e.g. callbacks of re-created server
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, doc, labels=()) -> Counter:
+    return REGISTRY.register(Counter(name, doc, labels))
+
+
+def gauge(name, doc, labels=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, doc, labels))
+
+
+def histogram(name, doc, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, doc, labels, buckets))
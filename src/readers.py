@@ -0,0 +1,238 @@
+"""
+Read workers: processes which serve GET /logs and GET /log/{id} of a node straight from
+the files of its persistent log, so reads scale with cores while the main process stays
+the only writer, owning appends, replication and repair.
+
+Workers share `--read-port` with SO_REUSEPORT, the kernel spreads connections among them.
+Quorum reads (r > 1) and reads with `max_lag` need the state of the writer and are
+redirected to it.
+
+    python main.py --port 8080 -u http://localhost:8080 --data-dir /var/rlog --read-workers 4 --read-port 8081
+"""
+import os
+import sys
+import json
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response, Query, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse
+
+import wire
+from storage import SegmentedFileReader
+from respcache import ResponseCache
+from rlog import id2offset
+from topics import TOPIC_NAME, CONFIG_FILE
+
+
+class SharedLog(object):
+    """Committed prefix of a log written by another process, with its own response cache"""
+
+    def __init__(self, path: str, cache_bytes: int = 64 * 1024 * 1024):
+        self._path = path
+        self._storage = SegmentedFileReader(path)
+        self._generation = self._storage.generation
+        self._cache = ResponseCache(self, max_bytes=cache_bytes)
+        self._config_mtime = None
+        self._min_r = 1
+
+    @property
+    def committed(self):
+        return self._storage.committed
+
+    def refresh(self):
+        # writer overwrote records on repair, entries cached before it may be wrong
+        generation = self._storage.generation
+        if generation != self._generation:
+            self._cache.clear()
+            self._generation = generation
+
+    @property
+    def min_r(self):
+        # topic config is changed by the writer, see Topics.configure
+        path = os.path.join(self._path, CONFIG_FILE)
+        mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+        if mtime != self._config_mtime:
+            self._config_mtime = mtime
+            self._min_r = 1
+            if mtime is not None:
+                with open(path) as f:
+                    self._min_r = json.load(f).get('r', 1)
+        return self._min_r
+
+    def get(self, _id):
+        offset = id2offset(_id)
+        if offset is None or offset < 0 or offset >= self.committed:
+            return None
+        return self._storage.get(offset)
+
+    def iter_all(self, since=0, limit=None):
+        return self._storage.range(since, None if limit is None else since + limit)
+
+    def next_cursor(self, since=0, limit=None):
+        end = self.committed
+        return end if limit is None else min(since + limit, max(end, since))
+
+    def encoded_item(self, log_id) -> Optional[bytes]:
+        offset = id2offset(log_id)
+        return None if offset is None else self._cache.entry(offset)
+
+    def encoded_list(self, since, stop) -> bytes:
+        return self._cache.render_list(since, stop)
+
+    def close(self):
+        self._storage.close()
+
+
+def make_app(data_dir: str, writer_url: str, cache_bytes: int) -> FastAPI:
+    app = FastAPI(title="Replicated Log reader", version="1.0")
+    logs = {} # log directory -> SharedLog
+
+    def log_of(request: Request) -> SharedLog:
+        name = request.path_params.get('topic')
+        if name is None:
+            path = data_dir
+        elif not TOPIC_NAME.match(name):
+            raise HTTPException(status_code=422, detail=f'Topic name should match {TOPIC_NAME.pattern}, got {name}')
+        else:
+            path = os.path.join(data_dir, 'topics', name)
+        log = logs.get(path)
+        if log is None:
+            # topic is opened once the writer created its files
+            if not os.path.exists(os.path.join(path, 'index')):
+                raise HTTPException(status_code=404, detail=f'Topic {name} not found')
+            log = logs[path] = SharedLog(path, cache_bytes)
+        log.refresh()
+        return log
+
+    def to_writer(request: Request) -> Response:
+        url = writer_url.rstrip('/') + request.url.path
+        if request.url.query:
+            url += '?' + request.url.query
+        return RedirectResponse(url, status_code=307)
+
+    @app.on_event("startup")
+    async def watch_writer():
+        # workers do not outlive the writer, their files may be rebuilt on its restart
+        parent = os.getppid()
+
+        async def _watch():
+            while os.getppid() == parent:
+                await asyncio.sleep(1)
+            logging.warning('Writer process exited, stopping read worker')
+            os.kill(os.getpid(), signal.SIGTERM)
+        asyncio.ensure_future(_watch())
+
+    @app.on_event("shutdown")
+    async def close_logs():
+        for log in logs.values():
+            log.close()
+
+    @app.get("/log/{log_id}", name="log:get_known")
+    @app.get("/topics/{topic}/log/{log_id}", name="topic:log:get_known")
+    async def log_get_id(request: Request, log_id: str, max_lag: Optional[float] = None):
+        if max_lag is not None:
+            return to_writer(request)
+        body = log_of(request).encoded_item(log_id)
+        if body is None:
+            return JSONResponse({'detail': f'Item {log_id} not found'}, status_code=404)
+        return Response(body, media_type='application/json')
+
+    @app.get("/logs", name="logs:get")
+    @app.get("/topics/{topic}/logs", name="topic:logs:get")
+    async def logs_get(request: Request, r:int=1, since:int=Query(0, ge=0),
+                       from_:Optional[int]=Query(None, alias='from', ge=0), limit:Optional[int]=Query(None, ge=1),
+                       format:Optional[str]=None, max_lag:Optional[float]=None):
+        log = log_of(request)
+        if max(r, log.min_r) > 1 or max_lag is not None:
+            # quorum and staleness are known to the writer only
+            return to_writer(request)
+        start = from_ if from_ is not None else since
+        cursor = log.next_cursor(since=start, limit=limit)
+        headers = {'X-Next-Cursor': str(cursor)}
+        if limit is not None:
+            headers['Link'] = f'<{request.url.path}?from={cursor}&limit={limit}>; rel="next"'
+
+        accept = request.headers.get('accept', '')
+        if wire.MEDIA_TYPE in accept:
+            items = log.iter_all(since=start, limit=cursor - start)
+            return Response(wire.encode_items(items), media_type=wire.MEDIA_TYPE, headers=headers)
+        if format == 'ndjson' or wire.NDJSON_MEDIA_TYPE in accept:
+            items = log.iter_all(since=start, limit=cursor - start)
+            return StreamingResponse(wire.ndjson_lines(items), media_type=wire.NDJSON_MEDIA_TYPE, headers=headers)
+        return Response(log.encoded_list(since=start, stop=cursor), media_type='application/json', headers=headers)
+
+    @app.get("/info")
+    async def info():
+        return JSONResponse({
+            'role': 'reader',
+            'pid': os.getpid(),
+            'writer': writer_url,
+            'committed': {os.path.relpath(path, data_dir): log.committed for path, log in logs.items()}})
+
+    return app
+
+
+class ReadWorkers(object):
+    """Read worker processes of a node, started and stopped by the writer"""
+
+    def __init__(self, data_dir: str, port: int, count: int, writer_url: str,
+                 cache_bytes: int = 64 * 1024 * 1024, keepalive_s: float = 30):
+        self._data_dir = data_dir
+        self._port = port
+        self._count = count
+        self._writer_url = writer_url
+        self._cache_bytes = cache_bytes
+        self._keepalive_s = keepalive_s
+        self._procs = []
+
+    def start(self):
+        # should be called after the writer opened its storage
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--data-dir', self._data_dir,
+               '--port', str(self._port),
+               '--writer-url', self._writer_url,
+               '--response-cache-bytes', str(self._cache_bytes),
+               '--keepalive', str(self._keepalive_s)]
+        for _ in range(self._count):
+            self._procs.append(subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__))))
+        logging.info(f'Started {self._count} read workers on port {self._port}')
+
+    def stop(self):
+        for p in self._procs:
+            p.terminate()
+        for p in self._procs:
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        self._procs = []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', type=str, required=True, help='Data directory of the writer')
+    parser.add_argument('--port', type=int, required=True, help='Port shared by read workers')
+    parser.add_argument('--writer-url', type=str, required=True, help='URL of the writer, quorum reads are redirected to it')
+    parser.add_argument('--response-cache-bytes', type=int, default=64 * 1024 * 1024, help='Memory for pre-encoded entries')
+    parser.add_argument('--keepalive', type=float, default=30, help='Keep-alive time for idle client connections, s')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('0.0.0.0', args.port))
+    app = make_app(args.data_dir, args.writer_url, args.response_cache_bytes)
+    config = uvicorn.Config(app, timeout_keep_alive=int(args.keepalive), log_level='warning')
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+if __name__ == '__main__':
+    main()
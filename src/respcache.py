@@ -0,0 +1,129 @@
+import json
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from const import Item, item2resp
+
+
+def encode_entry(item: Item) -> bytes:
+    # same bytes as JSONResponse renders for item2resp(item)
+    return json.dumps(item2resp(item).dict(), ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class _Chunk(object):
+    __slots__ = ('body', 'bounds')
+
+    def __init__(self):
+        self.body = bytearray() # encoded entries separated by ','
+        self.bounds = array('Q') # start of every entry in body
+
+    @property
+    def count(self):
+        return len(self.bounds)
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.bounds) * self.bounds.itemsize
+
+    def add(self, entry: bytes):
+        if self.bounds:
+            self.body += b','
+        self.bounds.append(len(self.body))
+        self.body += entry
+
+    def slice(self, start: int, stop: int) -> bytes:
+        # entries [start, stop) as a ','-separated fragment of JSON list
+        end = self.bounds[stop] - 1 if stop < len(self.bounds) else len(self.body)
+        return bytes(self.body[self.bounds[start]:end])
+
+
+class ResponseCache(object):
+    """
+    Pre-encoded JSON of log entries in chunks of `chunk_size` offsets. Only the committed
+    prefix is cached: entries do not change there except on repair, which invalidates the chunk.
+    Chunk at the end of the log is extended with new entries on read, least recently used
+    chunks are evicted when cache is above `max_bytes`.
+    """
+
+    def __init__(self, log, chunk_size: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self._log = log
+        self._chunk_size = chunk_size
+        self._max_bytes = max_bytes
+        self._chunks = OrderedDict() # chunk index -> _Chunk
+        self._bytes = 0
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def _chunk(self, index: int) -> _Chunk:
+        chunk = self._chunks.get(index)
+        if chunk is None:
+            chunk = self._chunks[index] = _Chunk()
+        else:
+            self._chunks.move_to_end(index)
+        start = index * self._chunk_size
+        stop = min(start + self._chunk_size, self._log.committed)
+        if start + chunk.count < stop:
+            size = chunk.size
+            for item in self._log.iter_all(since=start + chunk.count, limit=stop - start - chunk.count):
+                chunk.add(encode_entry(item))
+            self._bytes += chunk.size - size
+            self._evict(keep=index)
+        return chunk
+
+    def _evict(self, keep: int):
+        while self._bytes > self._max_bytes and len(self._chunks) > 1:
+            index = next(iter(self._chunks))
+            if index == keep:
+                self._chunks.move_to_end(index)
+                continue
+            self._bytes -= self._chunks.pop(index).size
+
+    def fragments(self, since: int, stop: int) -> List[bytes]:
+        """Encoded entries [since, stop) of committed prefix as ','-separated fragments"""
+        stop = min(stop, self._log.committed)
+        fragments = []
+        cs = self._chunk_size
+        for index in range(max(since, 0) // cs, -(-stop // cs)):
+            chunk = self._chunk(index)
+            start, end = max(since - index * cs, 0), min(stop - index * cs, chunk.count)
+            if start < end:
+                fragments.append(chunk.slice(start, end))
+        return fragments
+
+    def entries(self, since: int, stop: int) -> List[bytes]:
+        """Encoded entries [since, stop) of committed prefix, one per offset"""
+        stop = min(stop, self._log.committed)
+        entries = []
+        cs = self._chunk_size
+        for index in range(max(since, 0) // cs, -(-stop // cs)):
+            chunk = self._chunk(index)
+            start, end = max(since - index * cs, 0), min(stop - index * cs, chunk.count)
+            entries.extend(chunk.slice(i, i + 1) for i in range(start, end))
+        return entries
+
+    def render_list(self, since: int, stop: int) -> bytes:
+        return b'[' + b','.join(self.fragments(since, stop)) + b']'
+
+    def entry(self, offset: int) -> Optional[bytes]:
+        if offset < 0 or offset >= self._log.committed:
+            return None
+        chunk = self._chunks.get(offset // self._chunk_size)
+        if chunk is not None and offset % self._chunk_size < chunk.count:
+            i = offset % self._chunk_size
+            return chunk.slice(i, i + 1)
+        # single lookups do not pull whole chunk into cache
+        item = self._log.get(str(offset))
+        return None if item is None else encode_entry(item)
+
+    def invalidate(self, offset: int):
+        chunk = self._chunks.pop(offset // self._chunk_size, None)
+        if chunk is not None:
+            self._bytes -= chunk.size
+
+    def clear(self):
+        self._chunks.clear()
+        self._bytes = 0
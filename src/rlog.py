@@ -1,17 +1,60 @@
 import time
 import asyncio
-from functools import wraps
+from collections import OrderedDict, deque
+from functools import wraps, partial
 from urllib.parse import urljoin
 from typing import List, Optional
 from enum import Enum
 from const import Item, LogNodeType, req2item
+from storage import Storage, MemoryStorage
+import wire
+from snapshot import snapshot_frames, read_frames, MEDIA_TYPE as SNAPSHOT_MEDIA_TYPE
+from respcache import ResponseCache
+from feed import LogFeed
+from digest import HashChain, MerkleTree, entry_hash, digest_offsets, agreed_offset, digest2hex, hex2digest
 
-from utils import async_post, async_get, async_put, post, get
-from worker import BaseWorker
+from utils import async_post, async_get, async_put, post, get, HTTPTransport, TransportConfig
+import metrics
 
 import logging
 logging.basicConfig(level=logging.INFO)
-from threading import Thread, Condition
+
+
+REPLICATION_RTT = metrics.histogram('rlog_replication_rtt_seconds',
+    'Round trip time of successful append requests to remote node', ['node'])
+QUORUM_WAIT = metrics.histogram('rlog_quorum_wait_seconds',
+    'Time group commit waited for acks of w-1 secondaries', ['w'])
+REPLICATION_INFLIGHT = metrics.gauge('rlog_replication_inflight',
+    'Requests to remote node in flight', ['node'])
+HEALTHCHECKS = metrics.counter('rlog_healthcheck_total',
+    'Outcomes of health probes of remote node', ['node', 'result'])
+DEDUP_HITS = metrics.counter('rlog_dedup_hits_total',
+    'Appends answered with item committed earlier for the same idempotency key')
+ADMISSION_REJECTED = metrics.counter('rlog_admission_rejected_total',
+    'Appends rejected by admission control of master', ['reason'])
+QUORUM_UNAVAILABLE = metrics.counter('rlog_quorum_unavailable_total',
+    'Appends and reads which did not get quorum of secondaries in time', ['op'])
+CHECKPOINT_SECONDS = metrics.histogram('rlog_checkpoint_seconds',
+    'Time to write checkpoint of local log, restart replays only items after it')
+
+
+class Unavailable(Exception):
+    """Request is not served now, client should retry after `retry_after_s`"""
+    status_code = 503
+
+    def __init__(self, message, retry_after_s=1.0):
+        super(Unavailable, self).__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class Overloaded(Unavailable):
+    """Master has too many appends in flight, request is rejected before doing any work"""
+    status_code = 429
+
+
+class Conflict(Exception):
+    """Item with the same id and different content is already stored"""
+
 
 def urljoin(url, req):
     return url + req
@@ -30,76 +73,168 @@ def vote(items):
     return items[max_i]
 
 
-class CountDownLatch():
-    def __init__(self, count):
-        # store the count
-        self.count = count
-        self.condition = Condition()
- 
-    def count_down(self):
-        with self.condition:
-            logging.info(f'CountDownLatch {self.count}')
-            if self.count == 0:
-                return
-            self.count -= 1
-            if self.count == 0:
-                self.condition.notify_all()
- 
-    # wait for the latch to open
-    def wait(self):
-        # acquire the lock on the condition
-        with self.condition:
-            # check if the latch is already open
-            if self.count == 0:
-                return
-            # wait to be notified when the latch is open
-            self.condition.wait()
+def _resolved(value) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+
+def id2offset(_id) -> Optional[int]:
+    try:
+        offset = int(_id)
+    except (TypeError, ValueError):
+        return None
+    return offset if offset >= 0 else None
 
 
 class RLog(object):
     """docstring for RLog"""
-    def __init__(self):
-        self.__db = dict()
+    def __init__(self, storage: Optional[Storage] = None):
+        self.__db = storage if storage is not None else MemoryStorage()
+        self.__chain = self._restore_chain(self.__db.checkpoint_state)
+        self.__chain.advance(self.__db.get)
+        self.__replaced = 0
+        self.__tree = MerkleTree()
+        # leaves are hashed lazily on the first anti-entropy round
+        self.__tree.touch_range(0, self.__db.end)
+
+    def _restore_chain(self, state):
+        # chain saved by the last checkpoint, only items after it are hashed on start
+        if state is None or 'chain' not in state:
+            return HashChain()
+        chain = HashChain.from_state(state['chain'])
+        if not chain.verify(self.__db.get):
+            logging.warning(f'Digest of checkpoint does not match the log at offset {chain.version}, rehash the log')
+            return HashChain()
+        return chain
 
     def healthy(self):
         return False
 
-    def get_uuid(self):
-        # mandatory condition ID1 < ID2
-        return str(len(self.__db))
+    def iter_all(self, since: int = 0, limit: Optional[int] = None):
+        # ids are offsets in the log, so [since, since+limit) is a window of the log
+        stop = None if limit is None else since + limit
+        return self.__db.range(since, stop)
+
+    def get_all(self, since: int = 0, limit: Optional[int] = None):
+        return list(self.iter_all(since=since, limit=limit))
+
+    @property
+    def end(self):
+        # offset after the last item, cursor for the next read
+        return self.__db.end
+
+    @property
+    def committed(self):
+        # length of the contiguous prefix, items after it wait for missing ones
+        return self.__chain.version
+
+    @property
+    def replaced(self):
+        # count of items overwritten by repair since start, the end and size of the log do not show them
+        return self.__replaced
+
+    @property
+    def size(self):
+        return len(self.__db)
 
-    def get_all(self):
-        return list(self.__db.values())
+    @property
+    def size_bytes(self):
+        return self.__db.size_bytes
 
     def get(self, _id):
-        return self.__db.get(_id, None)
+        offset = id2offset(_id)
+        if offset is None:
+            return None
+        return self.__db.get(offset)
 
     def append(self, item):
         # QQ: implement linked-list to get previous message
         # WARNING: assigned outside
-        # item.id = self.get_uuid()
+        # ids are offsets leased by Sequencer of RLogServer
         
         # TEST: add delay before appending
         # time.sleep(5)
         # Simplest deduplication
         # if item.id in self.__db:
         #     return item
-        assert item.id not in self.__db, 'Object with specified ID already exists'
+        offset = id2offset(item.id)
+        assert offset is not None, f'Object ID should be log offset, got {item.id}'
+        assert offset not in self.__db, 'Object with specified ID already exists'
+
+        self.__db.put(offset, item)
+        self.__tree.touch(offset)
+        if offset == self.__chain.version:
+            self.__chain.extend(item)
+            if self.__db.end > offset + 1:
+                self.__chain.advance(self.__db.get)
+        return item
 
-        self.__db[item.id] = item
+    def check_offset(self, offset):
+        self.__db.check_offset(offset)
+
+    def replace(self, item):
+        # repair of diverged item, digests after it are recomputed
+        offset = id2offset(item.id)
+        assert offset is not None, f'Object ID should be log offset, got {item.id}'
+        self.__db.put(offset, item)
+        self.__replaced += 1
+        self.__tree.touch(offset)
+        self.__chain.reset(offset)
+        self.__chain.advance(self.__db.get)
         return item
 
+    def merkle_height(self, end=None):
+        return self.__tree.height(self.__db.end if end is None else end)
+
+    def merkle(self, level, indexes, end=None):
+        # hashes of merkle tree nodes on `level`, only items below `end` are counted
+        end = self.__db.end if end is None else end
+        return {i: self.__tree.node(level, i, self.__db.get, end, self.__db.end) for i in indexes}
+
+    def digest(self, offsets=()):
+        # chain values for prefixes of given length, None if prefix is not complete yet
+        return {
+            'version': self.__chain.version,
+            'digest': self.__chain.head,
+            'digests': {o: self.__chain.at(o, self.__db.get) for o in offsets}
+        }
+
+    def flush(self):
+        # make appended items durable according to storage fsync policy
+        self.__db.flush()
+
+    async def async_flush(self):
+        # same as flush, waiting for the disk in executor so the event loop keeps serving requests
+        if self.__db.syncs_on_flush:
+            await asyncio.get_running_loop().run_in_executor(None, self.__db.flush)
+        else:
+            self.__db.flush()
+
+    def checkpoint(self):
+        self.__db.checkpoint({'chain': self.__chain.state()})
+
+    async def async_checkpoint(self):
+        # same as checkpoint, the state is taken on the event loop and written to disk in executor
+        write = self.__db.prepare_checkpoint({'chain': self.__chain.state()})
+        if write is not None:
+            await asyncio.get_running_loop().run_in_executor(None, write)
+
+    def close(self):
+        self.__db.close()
+
     @property
     def data_version(self):
         return len(self.__db) # sorted(self.__db.keys())[-1]
 
 
 class RLogLocal(RLog):
-    def __init__(self, node_id: str, url:str, role: str):
-        super().__init__()
+    def __init__(self, node_id: str, url:str, role: str, storage: Optional[Storage] = None):
+        super().__init__(storage)
         self._node_id = node_id
         self._role = role
         self._url = url
+        self._listeners = [] # called after every flush, i.e. once appended items are durable
 
     @property
     def id(self):
@@ -116,19 +251,45 @@ class RLogLocal(RLog):
     def healthy(self):
         return True
 
-    def get_all(self) -> List[Item]:
-        return super().get_all()
+    def get_all(self, since: int = 0, limit: Optional[int] = None) -> List[Item]:
+        return super().get_all(since=since, limit=limit)
 
     def append(self, item: Item) -> Item:
         item.node_id = self._node_id
         return super().append(item)
 
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def flush(self):
+        super().flush()
+        for callback in self._listeners:
+            callback()
+
+    async def async_flush(self):
+        await super().async_flush()
+        for callback in self._listeners:
+            callback()
+
 
 class RLogRemote(RLog):
-    def __init__(self, node_id, url, role='master'):
+    def __init__(self, node_id, url, role='master', transport_config: Optional[TransportConfig] = None, formats=None,
+                 transport: Optional[HTTPTransport] = None, prefix: str = ''):
         self._url = url
         self._role = role
         self._node_id = node_id
+        # topics of the same node share connections, `prefix` selects routes of the topic
+        self._owns_transport = transport is None
+        self._transport = transport or HTTPTransport(url, transport_config)
+        self._prefix = prefix
+        # wire formats supported by node, reported in /info
+        self.formats = formats or [wire.FORMAT_JSON]
+        # node holds all items below this offset, replication lag is counted from it
+        self.acked_end = 0
+        self._rtt = REPLICATION_RTT.labels(url)
+
+    def _on_acked(self, acks, t):
+        self._rtt.observe(time.perf_counter() - t)
 
     @staticmethod
     def info(url):
@@ -140,9 +301,14 @@ class RLogRemote(RLog):
             return None
 
     @staticmethod
-    def from_url(url):
+    def from_url(url, transport_config: Optional[TransportConfig] = None):
         info = RLogRemote.info(url)
-        return RLogRemote(node_id=info['node_id'], url=url, role=info['role'])
+        return RLogRemote(node_id=info['node_id'], url=url, role=info['role'], transport_config=transport_config,
+                          formats=info.get('formats'))
+
+    @property
+    def binary(self):
+        return wire.FORMAT_BINARY in self.formats
 
     @property
     def id(self):
@@ -156,35 +322,86 @@ class RLogRemote(RLog):
     def url(self):
         return self._url
 
+    @property
+    def transport_stats(self):
+        return self._transport.stats()
+
+    def close(self):
+        if self._owns_transport:
+            self._transport.close()
+
+    def for_topic(self, prefix):
+        return RLogRemote(node_id=self._node_id, url=self._url, role=self._role, formats=self.formats,
+                          transport=self._transport, prefix=prefix)
+
+    @property
+    def last_seen(self):
+        # time of the last response from node, replication acks count as heartbeats
+        return self._transport.last_response_t
 
     def healthy(self):
         try:
-            return get(self._url + '/healthcheck', timeout=0.1)['status'] == 'success'
+            return self._transport.get(self._prefix + '/healthcheck', timeout=0.1)['status'] == 'success'
         except Exception as e:
             logging.error(f'Error during requesting secondary: {e}')
             return False
-        
-    def get_all(self, r:int=1):
+
+    async def async_healthy(self, timeout=1.0, end=None):
+        # master reports its log end, so secondary knows how fresh its data is
+        path = '/healthcheck' if end is None else f'/healthcheck?end={end}'
         try:
-            resp = get(self._url + f'/logs?r={r}', timeout=None)
-            items = [req2item(r) for r in resp]
-            return items
+            return (await self._transport.async_get(self._prefix + path, timeout=timeout))['status'] == 'success'
         except Exception as e:
             logging.error(f'Error during requesting secondary: {e}')
-            return []
+            return False
 
-    def get(self, _id):
+    async def async_info(self, timeout=1.0, end=None):
+        # state poll is a heartbeat as well, so it reports log end of master like healthcheck
+        path = '/info' if end is None else f'/info?end={end}'
+        try:
+            return await self._transport.async_get(self._prefix + path, timeout=timeout)
+        except Exception as e:
+            logging.error(f'Error during requesting secondary: {e}')
+            return None
+        
+    async def async_get_all(self, r:int=1, since:int=0, limit:Optional[int]=None):
         try:
-            resp = get(self._url + '/log/' + _id, timeout=None)
-            return req2item(resp)
+            query = f'/logs?r={r}&since={since}'
+            if limit is not None:
+                query += f'&limit={limit}'
+            if self.binary:
+                resp = await self._transport.async_request_raw('GET', self._prefix + query, accept=wire.MEDIA_TYPE, timeout=None)
+                return wire.decode_items(resp)
+            resp = await self._transport.async_get(self._prefix + query, timeout=None)
+            return [req2item(r) for r in resp]
         except Exception as e:
             logging.error(f'Error during requesting secondary: {e}')
             return None
 
-    def append(self, item):
+    async def async_append_batch(self, items, repair=False, end=None, catch_up=None):
+        # catch_up is (since, upto) range of catch-up which items are part of, reported by secondary in /info
+        params = [p for p in ('repair=true' if repair else None, None if end is None else f'end={end}') if p]
+        if catch_up is not None:
+            params += [f'catch_up_since={catch_up[0]}', f'catch_up_upto={catch_up[1]}']
+        path = '/logs/batch' + ('?' + '&'.join(params) if params else '')
         try:
-            resp = post(self._url + '/log/' + item.id, item.to_dict(), timeout=None)
-            return req2item(resp)
+            t = time.perf_counter()
+            if self.binary:
+                # acks are ids of stored items
+                resp = await self._transport.async_request_raw(
+                    'POST', self._prefix + path, wire.encode_items(items),
+                    content_type=wire.MEDIA_TYPE, accept=wire.MEDIA_TYPE, timeout=None)
+                acks = []
+                for _id in wire.decode_ids(resp):
+                    ack = Item()
+                    ack.id = _id
+                    acks.append(ack)
+                self._on_acked(acks, t)
+                return acks
+            resp = await self._transport.async_post(self._prefix + path, [it.to_dict() for it in items], timeout=None)
+            acks = [req2item(r) for r in resp]
+            self._on_acked(acks, t)
+            return acks
         except Exception as e:
             logging.error(f'Error during requesting secondary: {e}')
             return None
@@ -192,197 +409,959 @@ class RLogRemote(RLog):
     @property
     def data_version(self):
         try:
-            resp = get(self._url + f'/info')
+            resp = self._transport.get(self._prefix + '/info')
             return resp['version']
         except Exception as e:
             logging.error(f'Error during requesting secondary: {e}')
             return None
 
+    async def async_create_topic(self, name, config):
+        # config is {'w': int, 'r': int} of topic on master, node keeps the same guarantees
+        try:
+            resp = await self._transport.async_post(f'/topics/{name}', config)
+            return resp if 'config' in resp else None
+        except Exception as e:
+            logging.error(f'Error during requesting secondary: {e}')
+            return None
 
-class HealthChecker(BaseWorker):            
-    def __init__(self, on_node_delete_clb=None):
-        super(HealthChecker, self).__init__()
-        self.__nodes = {} # id -> node instance
-        self.__threads = {}
-        self.__health = {}
-        self.__thread_running = {}
+    async def async_install_snapshot(self, frames, since, upto):
+        try:
+            return await self._transport.async_post_stream(self._prefix + f'/snapshot?since={since}&upto={upto}', frames,
+                                                           SNAPSHOT_MEDIA_TYPE, timeout=None)
+        except Exception as e:
+            logging.error(f'Error during requesting secondary: {e}')
+            return None
 
+    async def async_merkle(self, level, indexes, end):
+        try:
+            resp = await self._transport.async_get(self._prefix + f'/merkle?level={level}&end={end}' + ''.join(f'&index={i}' for i in indexes))
+            return {int(i): hex2digest(h) for i, h in resp['hashes'].items()}
+        except Exception as e:
+            logging.error(f'Error during requesting secondary: {e}')
+            return None
+
+    async def async_digest(self, offsets=()):
+        try:
+            resp = await self._transport.async_get(self._prefix + '/digest' + ''.join(f'{"&" if i else "?"}at={o}' for i, o in enumerate(offsets)))
+            return _digest_from_resp(resp)
+        except Exception as e:
+            logging.error(f'Error during requesting secondary: {e}')
+            return None
+
+
+def _digest_from_resp(resp):
+    return {
+        'version': resp['version'],
+        'digest': hex2digest(resp['digest']),
+        'digests': {int(o): hex2digest(d) for o, d in resp['digests'].items()}
+    }
+
+
+def digest2resp(digest):
+    return {
+        'version': digest['version'],
+        'digest': digest2hex(digest['digest']),
+        'digests': {str(o): digest2hex(d) for o, d in digest['digests'].items()}
+    }
+
+
+class SecondaryStateManagement(object):
+    """Brings secondaries in sync with master, invoked by NodeScheduler"""
+
+    def __init__(self, local_node=None, chunk_size=500, anti_entropy_interval_s=30, max_repair_ranges=64,
+                 snapshot_threshold=10000, replication_queue=None, catch_up_parallelism=4):
+        self.__local_node = local_node
+        self._replication_queue = replication_queue or (lambda node: None)
+        self._chunk_size = chunk_size
+        self._catch_up_parallelism = catch_up_parallelism
+        self._snapshot_threshold = snapshot_threshold
+        self._anti_entropy_interval_s = anti_entropy_interval_s
+        self._max_repair_ranges = max_repair_ranges
+        self._last_anti_entropy = {} # node id -> time
+
+    async def sync(self, node, remote_ver):
+        """Returns False if node did not respond during sync"""
+        # master is source of truth, master always knows the general order. To make synced secondary is it's responsibility
+        if self.__local_node.role != 'master':
+            return True
+        if time.time() - self._last_anti_entropy.setdefault(node.id, time.time()) > self._anti_entropy_interval_s:
+            # content could differ whatever the lag is, so the prefix both nodes have is compared on interval
+            self._last_anti_entropy[node.id] = time.time()
+            if not await self._anti_entropy(node, end=min(self.__local_node.end, remote_ver)):
+                return False
+        queue = self._replication_queue(node)
+        if self.__local_node.data_version > remote_ver and queue is not None \
+                and queue.covered_from is not None and queue.covered_from <= remote_ver:
+            # the rest is in flight in replication queue
+            return True
+        if self.__local_node.data_version - remote_ver > self._snapshot_threshold:
+            # new or far behind secondary: send compact snapshot in one stream, rest is caught up incrementally
+            return await self._install_snapshot(node, since=remote_ver)
+        if self.__local_node.data_version > remote_ver:
+            # secondary is behind: push only the suffix after its high-water mark
+            return await self._catch_up(node, since=remote_ver)
+        elif self.__local_node.data_version < remote_ver:
+            # If master is outdated... 
+            second_items = await node.async_get_all(since=self.__local_node.data_version)
+            if second_items is None:
+                return False
+            # TODO: implement quorum logic to assignt right element. Here we trust secondary
+            for it in second_items:
+                if self.__local_node.get(it.id) is None:
+                    self.__local_node.append(it)
+            await self.__local_node.async_flush()
+        return True
+
+    async def _anti_entropy(self, node, end):
+        # walk merkle tree from root and compare only children of diverged nodes, offsets below `end` only
+        if end <= 0:
+            return True
+        level = self.__local_node.merkle_height(end)
+        frontier = [0]
+        while True:
+            remote = await node.async_merkle(level, frontier, end)
+            if remote is None:
+                return False
+            local = self.__local_node.merkle(level, frontier, end)
+            diverged = [i for i in frontier if local[i] != remote.get(i)][:self._max_repair_ranges]
+            if level == 0 or not diverged:
+                break
+            frontier = [c for i in diverged for c in (2 * i, 2 * i + 1)]
+            level -= 1
+
+        leaf_size = MerkleTree.LEAF_SIZE
+        for leaf in diverged:
+            start = leaf * leaf_size
+            stop = min(start + leaf_size, end)
+            items = self.__local_node.get_all(since=start, limit=stop - start)
+            logging.warning(f'Repair range [{start}, {stop}) on {node.url}')
+            if await node.async_append_batch(items, repair=True) is None:
+                return False
+        return True
+
+    async def _install_snapshot(self, node, since):
+        # log is append-only, so prefix up to current end is a point-in-time snapshot
+        upto = self.__local_node.end
+        logging.info(f'Install snapshot [{since}, {upto}) on {node.url}')
+        t0 = time.time()
+        resp = await node.async_install_snapshot(snapshot_frames(self.__local_node, since, upto), since, upto)
+        if resp is None:
+            logging.warning(f'Snapshot install on {node.url} failed')
+            return False
+        logging.info(f'Snapshot [{since}, {upto}) installed on {node.url} in {time.time() - t0:.2f}s: {resp}')
+        return True
+
+    async def _catch_up(self, node, since):
+        # missing range is split in chunks sent over several concurrent requests, so transfer is
+        # bound by bandwidth rather than round trips; secondary stores chunks as they come and
+        # exposes them in order, once every chunk before them arrived
+        upto = self.__local_node.end
+        if since >= upto:
+            return True
+        t0 = time.time()
+        starts = range(since, upto, self._chunk_size)
+        chunks = iter(starts) # shared by streams, every stream takes the next chunk in order
+        failed = []
+
+        async def _stream():
+            for start in chunks:
+                if failed:
+                    return
+                items = self.__local_node.get_all(since=start, limit=min(self._chunk_size, upto - start))
+                if items and await node.async_append_batch(items, catch_up=(since, upto)) is None:
+                    failed.append(start)
+                    return
+
+        await asyncio.gather(*[_stream() for _ in range(min(self._catch_up_parallelism, len(starts)))])
+        if failed:
+            # next sync resumes from the prefix secondary has got
+            logging.warning(f'Catch-up [{since}, {upto}) of {node.url} interrupted at offset {min(failed)}')
+            return False
+        logging.info(f'Catch-up [{since}, {upto}) of {node.url} done in {time.time() - t0:.2f}s')
+        return True
+
+    def del_node(self, node):
+        self._last_anti_entropy.pop(node.id, None)
+
+
+class NodeScheduler(object):
+    """
+    Single asyncio loop for health checks of remote nodes and state sync of logs on them.
+    Nodes which responded to replication recently are not probed. Liveness of a node is
+    tracked once for the default log; topics add state sync of their logs with `add_sync`
+    and lose the node only together with the default log.
+    """
+
+    class _NodeState(object):
+        def __init__(self, node):
+            self.node = node
+            self.healthy = True
+            self.failures = 0
+            self.sync_retries = 0
+            self.next_probe = 0
+            self.next_sync = 0
+            self.task = None
+
+    class _LogSync(object):
+        # state sync of a topic log on node, `node` is RLogRemote of the topic
+        def __init__(self, node, state_management, log_end, on_node_delete_clb):
+            self.node = node
+            self.sm = state_management
+            self.log_end = log_end
+            self.on_node_delete_clb = on_node_delete_clb
+            self.sync_retries = 0
+            self.next_sync = 0
+            self.task = None
+
+    def __init__(self, state_management, on_node_delete_clb=None,
+                 probe_interval_s=1.0, probe_timeout_s=1.0, heartbeat_s=1.0,
+                 sync_interval_s=2, max_sync_interval_s=30, max_failures=5, tick_s=0.1, log_end=None):
+        self._sm = state_management
         self._on_node_delete_clb = on_node_delete_clb or (lambda node: None)
+        self._log_end = log_end or (lambda: None)
+        self._probe_interval_s = probe_interval_s
+        self._probe_timeout_s = probe_timeout_s
+        self._heartbeat_s = heartbeat_s
+        self._sync_interval_s = sync_interval_s
+        self._max_sync_interval_s = max_sync_interval_s
+        self._max_failures = max_failures
+        self._tick_s = tick_s
+        self.__nodes = {} # id -> node state
+        self.__syncs = {} # (state management, node id) -> sync of topic log
+        self._task = None
 
     def healthy(self, node):
-        return self.__health[node.id]
-
-    def _node_healthcheck_thread(self, node):
-        retries = 0
-        default_delay_s = 2
-        max_delay_s = 30
-        max_retries = 5
-        while self.should_keep_running() and self.__thread_running.get(node.id, False):
-            # TODO: probably process healthchecks in parralel
-            self.__health[node.id] = False
-            if not node.healthy():
-                logging.warning(f'Target {node.url} not healthy... Waiting...')
-                retries += 1
-            else:
-                retries = 0
-                logging.info(f'Healthcheck OK {node.url}')
-                self.__health[node.id] = True
-            if retries > max_retries:
-                logging.error(f'Target {node.url} not healthy...')
-                # WARNING: not thread-safe. TODO: add sync privitive
-                self._on_node_delete_clb(node)
-                break
-            time.sleep(min(default_delay_s + retries, max_delay_s))
+        return node.id in self.__nodes and self.__nodes[node.id].healthy
 
     def add_node(self, node):
-        if node.healthy():
-            self.__nodes[node.id] = node
-            self.__thread_running[node.id] = True
-            self.__threads[node.id] = Thread(target=self._node_healthcheck_thread, args=(node,))
-            self.__threads[node.id].start()
-            self.__health[node.id] = True
-            return True
-        return False
+        self.__nodes[node.id] = NodeScheduler._NodeState(node)
+        return True
+
+    def add_sync(self, node, state_management, log_end=None, on_node_delete_clb=None):
+        # topic log on node already tracked by add_node, `on_node_delete_clb` is called when the node is dropped
+        self.__syncs[(state_management, node.id)] = NodeScheduler._LogSync(
+            node, state_management, log_end or (lambda: None), on_node_delete_clb or (lambda node: None))
+
+    def del_sync(self, node, state_management):
+        sync = self.__syncs.pop((state_management, node.id), None)
+        if sync is not None:
+            self._cancel(sync)
+            state_management.del_node(node)
+
+    def request_sync(self, node, state_management=None):
+        # sync node on the next tick
+        if state_management is not None:
+            state = self.__syncs.get((state_management, node.id))
+        else:
+            state = self.__nodes.get(node.id)
+        if state is not None:
+            state.next_sync = 0
 
     def del_node(self, node):
-        if node.id not in self.__threads:
+        state = self.__nodes.pop(node.id, None)
+        if state is not None:
+            self._cancel(state)
+        self._sm.del_node(node)
+        # topic logs lose the node together with the default log
+        for sync in list(self.__syncs.values()):
+            if sync.node.id == node.id:
+                self.del_sync(sync.node, sync.sm)
+                sync.on_node_delete_clb(sync.node)
+
+    @staticmethod
+    def _cancel(state):
+        if state.task is not None and not state.task.done():
+            state.task.cancel()
+
+    def start(self):
+        # should be called from running event loop
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        for state in list(self.__nodes.values()) + list(self.__syncs.values()):
+            self._cancel(state)
+
+    def _on_probe(self, state, ok):
+        now = time.time()
+        HEALTHCHECKS.labels(state.node.url, 'ok' if ok else 'fail').inc()
+        if ok:
+            if state.failures:
+                logging.info(f'Healthcheck OK {state.node.url}')
+            state.failures = 0
+            state.healthy = True
+            state.next_probe = now + self._probe_interval_s
             return
-        self.__thread_running[node.id] = False
-        # self.__threads[node.id].join() # FIXME:
-        del self.__threads[node.id]
-        del self.__health[node.id]
-        del self.__thread_running[node.id]
+        state.failures += 1
+        state.healthy = False
+        logging.warning(f'Target {state.node.url} not healthy... Waiting...')
+        if state.failures > self._max_failures:
+            logging.error(f'Target {state.node.url} not healthy...')
+            self._on_node_delete_clb(state.node)
+            return
+        state.next_probe = now + min(self._probe_interval_s + state.failures, self._max_sync_interval_s)
 
-    def run(self):
-        while self.should_keep_running():
-            time.sleep(1)
+    async def _probe(self, state):
+        self._on_probe(state, await state.node.async_healthy(timeout=self._probe_timeout_s, end=self._log_end()))
 
+    async def _poll(self, node, log_end):
+        # log end of node, None if node did not answer; state poll reports log end of master as well
+        info = await node.async_info(timeout=self._probe_timeout_s, end=log_end())
+        if info is None or 'version' not in info:
+            # topic may be not created on node yet
+            return None
+        node.formats = info.get('formats') or node.formats
+        # contiguous prefix, secondary may hold chunks of unfinished catch-up after a gap
+        remote_ver = info.get('committed', info['version'])
+        node.acked_end = max(node.acked_end, remote_ver)
+        return remote_ver
+
+    def _synced(self, state, ok):
+        state.sync_retries = 0 if ok else state.sync_retries + 1
+        state.next_sync = time.time() + min(self._sync_interval_s + state.sync_retries, self._max_sync_interval_s)
+
+    async def _sync(self, state):
+        # /info of the default log is a health probe and state poll at once
+        remote_ver = await self._poll(state.node, self._log_end)
+        self._on_probe(state, remote_ver is not None)
+        self._synced(state, remote_ver is not None and await self._sm.sync(state.node, remote_ver))
+
+    async def _sync_log(self, sync):
+        remote_ver = await self._poll(sync.node, sync.log_end)
+        self._synced(sync, remote_ver is not None and await sync.sm.sync(sync.node, remote_ver))
+
+    async def run(self):
+        while True:
+            now = time.time()
+            for state in list(self.__nodes.values()):
+                if state.task is not None and not state.task.done():
+                    continue
+                if now >= state.next_sync:
+                    state.task = asyncio.ensure_future(self._sync(state))
+                elif now >= state.next_probe:
+                    if state.failures == 0 and now - state.node.last_seen < self._heartbeat_s:
+                        # node acked traffic recently, no need to probe
+                        state.next_probe = state.node.last_seen + self._heartbeat_s
+                    else:
+                        state.task = asyncio.ensure_future(self._probe(state))
+            for sync in list(self.__syncs.values()):
+                if sync.task is not None and not sync.task.done():
+                    continue
+                # topics are not synced to a node which does not answer probes
+                if now >= sync.next_sync and self.healthy(sync.node):
+                    sync.task = asyncio.ensure_future(self._sync_log(sync))
+            await asyncio.sleep(self._tick_s)
 
 
-class SecondaryStateManagement(BaseWorker):
+class Sequencer(object):
+    """
+    Hands out log offsets on master. Ranges are leased for a whole group commit in one step
+    on the event loop, so concurrent commits never share an id and do not need a lock;
+    offsets in [committed, allocated) belong to commits in flight.
+    """
 
-    def __init__(self, local_node=None):
-        super(SecondaryStateManagement, self).__init__()
-        self.__local_node = local_node
-        self.__nodes = {} # id -> node instance
-        self.__threads = {}
-        self.__thread_running = {}
-
-    def _node_thread(self, node):
-        retries = 0
-        default_delay_s = 2
-        max_delay_s = 30
-        while self.should_keep_running() and self.__thread_running.get(node.id, False):
-            # master is source of truth, master always knows the general order. To make synced secondary is it's responsibility
-            if self.__local_node.role == 'master':
-                remote_ver = node.data_version
-                # check if version avaliable. If not - increment retries and skip all futher steps
-                if remote_ver is None:
-                    retries += 1
-                elif self.__local_node.data_version > remote_ver:
-                    # but if version exists, check history
-                    retries = 0
-                    master_items = self.__local_node.get_all()
-                    second_items = node.get_all()
-                    for i in range(len(master_items)):
-                        # TODO: make more clear expression
-                        # TODO: make smart logic of list updating without rereading all messages. Could be problem becausse of performance
-                        if len(second_items) < i and master_items[i].id != second_items[i].id:
-                            node.append(master_items[i])
-                            second_items = node.get_all()
-                        elif len(second_items) >= i:
-                            node.append(master_items[i])
-                            second_items = node.get_all()
-                elif self.__local_node.data_version < remote_ver:
-                    # If master is outdated... 
-                    second_items = node.get_all()
-                    # TODO: implement quorum logic to assignt right element. Here we trust secondary
-                    for it in second_items:
-                        if self.__local_node.get(it.id) is None:
-                            self.__local_node.append(it)
-            
-            time.sleep(min(default_delay_s + retries, max_delay_s))
+    def __init__(self, start=0):
+        self._next = start
 
-    def add_node(self, node):
-        if node.healthy():
-            self.__nodes[node.id] = node
-            self.__thread_running[node.id] = True
-            self.__threads[node.id] = Thread(target=self._node_thread, args=(node,))
-            self.__threads[node.id].start()
-            return True
-        return False
+    @property
+    def allocated(self):
+        # offset after the last leased one
+        return self._next
+
+    def lease(self, count, floor=0) -> int:
+        # items appended to the log by other paths (e.g. pulled from secondary) are never reused
+        base = max(self._next, floor)
+        self._next = base + count
+        return base
+
+
+class GroupCommit(object):
+    """
+    Collects appends arriving within a short window and commits them as one batch.
+    `commit_clb(items)` is called in group order and returns awaitable which completes the
+    commit, up to `pipeline` commits are in flight. Writers are answered in group order,
+    so a group is reported committed only after every earlier one.
+    """
+
+    def __init__(self, commit_clb, window_s=0.002, max_size=256, pipeline=1):
+        self._commit_clb = commit_clb
+        self._window_s = window_s
+        self._max_size = max_size
+        self._pending = []  # (items, future)
+        self._task = None
+        self._pipeline = pipeline
+        self._slots = None  # semaphore of commits in flight, created on event loop
+        self._last = None   # task of the latest started commit
+
+    async def submit(self, items: List[Item]) -> List[Item]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((items, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return await future
+
+    def _pending_size(self):
+        return sum(len(items) for items, _ in self._pending)
+
+    def _next_group(self):
+        group, size = [], 0
+        while self._pending and (not group or size + len(self._pending[0][0]) <= self._max_size):
+            items, future = self._pending.pop(0)
+            group.append((items, future))
+            size += len(items)
+        return group
+
+    async def _run(self):
+        # single task forms groups and starts commits; exits when nothing is pending and is restarted by submit
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._pipeline)
+        while self._pending:
+            if self._pending_size() < self._max_size:
+                # give concurrent appends a chance to join the group
+                await asyncio.sleep(self._window_s)
+            await self._slots.acquire()
+            group = self._next_group()
+            if not group:
+                self._slots.release()
+                continue
+            items = [it for its, _ in group for it in its]
+            try:
+                finish = self._commit_clb(items)
+            except Exception as e:
+                finish = self._failed(e)
+            self._last = asyncio.ensure_future(self._commit(group, items, finish, self._last))
 
-    def del_node(self, node):
-        if node.id not in self.__threads:
+    @staticmethod
+    async def _failed(error):
+        raise error
+
+    async def _commit(self, group, items, finish, previous):
+        try:
+            await finish
+            error = None
+        except Exception as e:
+            logging.error(f'Group commit of {len(items)} items failed: {e}')
+            error = e
+        finally:
+            self._slots.release()
+        if previous is not None:
+            # answer writers in order, reads of the committed prefix then see their items
+            await asyncio.wait([previous])
+        for its, future in group:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(its)
+
+    def stop(self):
+        for task in (self._task, self._last):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+class AdmissionControl(object):
+    """
+    Bounded number of appends in flight on master. When all `max_inflight` slots are taken,
+    up to `max_queue` appends wait for a slot at most `queue_timeout_s` in arrival order,
+    the rest are rejected at once, so overload turns into quick 429 instead of memory and latency.
+    """
+
+    def __init__(self, max_inflight=1024, max_queue=1024, queue_timeout_s=1.0):
+        self._max_inflight = max_inflight
+        self._max_queue = max_queue
+        self._queue_timeout_s = queue_timeout_s
+        self._inflight = 0
+        self._waiters = deque() # futures of queued appends, resolved when slot is handed over
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self._inflight < self._max_inflight and not self._waiters:
+            self._inflight += 1
             return
-        self.__thread_running[node.id] = False
-        # self.__threads[node.id].join() # FIXME:
-        del self.__threads[node.id]
-        del self.__thread_running[node.id]
+        if len(self._waiters) >= self._max_queue:
+            ADMISSION_REJECTED.labels('queue_full').inc()
+            raise Overloaded(f'{self._inflight} appends in flight and {len(self._waiters)} queued',
+                             retry_after_s=self._queue_timeout_s)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, self._queue_timeout_s)
+        except asyncio.TimeoutError:
+            self._waiters.remove(future)
+            ADMISSION_REJECTED.labels('timeout').inc()
+            raise Overloaded(f'No append slot within {self._queue_timeout_s}s', retry_after_s=self._queue_timeout_s)
+        except asyncio.CancelledError:
+            # client went away while queued, slot may have been handed over already
+            if future.done() and not future.cancelled():
+                self.release()
+            elif future in self._waiters:
+                self._waiters.remove(future)
+            raise
+
+    def release(self):
+        # slot goes to the oldest waiter, so in-flight count does not change
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self._inflight -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class ReplicationSlots(object):
+    """
+    Limits of requests from this node to remote nodes: `max_inflight` in total and `max_inflight_per_node`
+    to one node. May be shared by logs of the node like AdmissionControl, semaphores are created
+    lazily on the event loop.
+    """
+
+    def __init__(self, max_inflight=64, max_inflight_per_node=8):
+        self._max_inflight = max_inflight
+        self._max_inflight_per_node = max_inflight_per_node
+        self._total = None
+        self._nodes = {} # node id -> semaphore of requests in flight to node
+
+    @property
+    def total(self) -> asyncio.Semaphore:
+        if self._total is None:
+            self._total = asyncio.Semaphore(self._max_inflight)
+        return self._total
+
+    def node(self, node_id) -> asyncio.Semaphore:
+        slots = self._nodes.get(node_id)
+        if slots is None:
+            slots = self._nodes[node_id] = asyncio.Semaphore(self._max_inflight_per_node)
+        return slots
+
+    def discard(self, node_id):
+        self._nodes.pop(node_id, None)
+
+
+class IdempotencyCache(object):
+    """
+    Bounded LRU map of client idempotency keys to futures of (item, durable) of their commit,
+    entries expire after `ttl_s`. Item which missed quorum is kept with durable False.
+    """
+
+    def __init__(self, max_size=100000, ttl_s=600):
+        self._max_size = max_size
+        self._ttl_s = ttl_s
+        self._entries = OrderedDict() # key -> (expiration time, future of item)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        now = time.time()
+        self._entries[key] = (now + self._ttl_s, value)
+        self._entries.move_to_end(key)
+        # least recently used entries go first, expired ones are dropped along the way
+        while self._entries and (len(self._entries) > self._max_size or next(iter(self._entries.values()))[0] < now):
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+
+class ReplicationQueue(object):
+    """
+    Ordered outbound queue of master for one secondary. Items are delivered in background
+    in batches, up to `pipeline` batches in flight; failed batches are retried with backoff
+    until delivered or the queue is closed. Writers wait for the first attempt only.
+    """
+
+    def __init__(self, node, max_size=100000, max_batch=512, pipeline=4,
+                 backoff_s=0.05, max_backoff_s=5.0, on_overflow=None, log_end=None, slots=None):
+        self._node = node
+        self._slots = slots # semaphore shared by requests to all nodes, pipeline is the limit per node
+        self._log_end = log_end or (lambda: None)
+        self._max_size = max_size
+        self._max_batch = max_batch
+        self._pipeline = pipeline
+        self._backoff_s = backoff_s
+        self._max_backoff_s = max_backoff_s
+        self._on_overflow = on_overflow or (lambda node: None)
+        self._pending = deque()       # (items, future) not sent yet
+        self._unacked = OrderedDict() # first offset -> end offset of every queued item range, in order
+        self._size = 0                # queued and not acked items
+        self._end = None              # offset after the last queued item
+        self._covered_from = None     # queue delivers every item from this offset, None after overflow
+        self._failing = False         # last request failed, writers are not kept waiting for retries
+        self._wakeup = None
+        self._workers = []
+
+    @property
+    def node(self):
+        return self._node
+
+    @property
+    def size(self):
+        return self._size
 
-    def run(self):
-        while self.should_keep_running():
-            time.sleep(1)
+    @property
+    def covered_from(self):
+        return self._covered_from
 
+    @property
+    def acked_offset(self):
+        # items in [covered_from, acked_offset) are stored on node
+        if self._unacked:
+            return next(iter(self._unacked))
+        return self._end
+
+    def put(self, items: List[Item]) -> asyncio.Future:
+        """Queue items with contiguous ids, future is True once node acked them on first attempt"""
+        future = asyncio.get_running_loop().create_future()
+        if not items:
+            future.set_result(True)
+            return future
+        first, end = int(items[0].id), int(items[-1].id) + 1
+        if self._size + len(items) > self._max_size or (self._covered_from is None and self._size):
+            # node does not keep up, drop items until queue drains and let state sync repair the gap
+            if self._covered_from is not None:
+                logging.warning(f'Replication queue of {self._node.url} is full, fall back to catch-up')
+                self._covered_from = None
+                self._on_overflow(self._node)
+            future.set_result(False)
+            return future
+        if self._covered_from is None or (self._end is not None and first != self._end):
+            self._covered_from = first
+        if self._failing:
+            future.set_result(False)
+        self._pending.append((items, future))
+        self._unacked[first] = end
+        self._size += len(items)
+        self._end = end
+        self._start()
+        self._wakeup.set()
+        return future
+
+    def _start(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._workers = [w for w in self._workers if not w.done()]
+        while len(self._workers) < self._pipeline:
+            self._workers.append(asyncio.ensure_future(self._run()))
+
+    def _next_batch(self):
+        # consecutive writes are merged into one request
+        group, size = [], 0
+        while self._pending and (not group or size + len(self._pending[0][0]) <= self._max_batch):
+            items, future = self._pending.popleft()
+            group.append((items, future))
+            size += len(items)
+        return group
+
+    async def _send(self, items):
+        if self._slots is not None:
+            async with self._slots:
+                return await self._send_request(items)
+        return await self._send_request(items)
+
+    async def _send_request(self, items):
+        inflight = REPLICATION_INFLIGHT.labels(self._node.url)
+        inflight.inc()
+        try:
+            acks = await self._node.async_append_batch(items, end=self._log_end())
+        finally:
+            inflight.dec()
+        return acks is not None and [it.id for it in acks] == [it.id for it in items]
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            group = self._next_batch()
+            try:
+                await self._deliver(group)
+            finally:
+                # writers do not wait for retries, nor for closed queue
+                for _, future in group:
+                    if not future.done():
+                        future.set_result(False)
+
+    async def _deliver(self, group):
+        items = [it for its, _ in group for it in its]
+        backoff = self._backoff_s
+        while not await self._send(items):
+            self._failing = True
+            for _, future in group:
+                if not future.done():
+                    future.set_result(False)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self._max_backoff_s)
+        self._failing = False
+        for its, future in group:
+            if not future.done():
+                future.set_result(True)
+            self._unacked.pop(int(its[0].id), None)
+            self._size -= len(its)
+        if self._covered_from is not None and self._covered_from <= self._node.acked_end:
+            self._node.acked_end = max(self._node.acked_end, self.acked_offset)
+
+    def close(self):
+        for worker in self._workers:
+            if not worker.done():
+                worker.cancel()
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_result(False)
 
 
 class RLogServer(object):
-    def __init__(self, url:str, role:str):
+    ACK_POLL_S = 0.01 # period of checks of acked offsets of secondaries, see _await_acks
+
+    def __init__(self, url:str, role:str, batch_window_s=0.002, batch_max_size=256,
+                 transport_config: Optional[TransportConfig] = None,
+                 max_inflight_requests=64, straggler_timeout_s=30,
+                 storage: Optional[Storage] = None, anti_entropy_interval_s=30,
+                 probe_interval_s=1.0, probe_timeout_s=1.0, heartbeat_s=1.0,
+                 snapshot_threshold=10000, replication_queue_size=100000, replication_batch_size=512,
+                 replication_pipeline=4, dedup_cache_size=100000, dedup_ttl_s=600,
+                 response_cache_bytes=64 * 1024 * 1024, node_id=None, topic=None,
+                 max_inflight_per_node=8, quorum_timeout_s=5.0, admission: Optional[AdmissionControl] = None,
+                 replication_slots: Optional[ReplicationSlots] = None, scheduler: Optional[NodeScheduler] = None,
+                 commit_pipeline=4, subscriber_buffer=10000, max_subscribers=1000,
+                 catch_up_chunk_size=500, catch_up_parallelism=4, checkpoint_interval_s=10.0):
         super(RLogServer, self).__init__()
+        self._topic = topic # None for the default log
+        self._transport_config = transport_config or TransportConfig()
+        self._straggler_timeout_s = straggler_timeout_s
+        self._quorum_timeout_s = quorum_timeout_s
+        self._probe_interval_s = probe_interval_s
+        # may be shared by topics, so the limit holds for the whole node
+        self._admission = admission or AdmissionControl()
+        self._replication_slots = replication_slots or ReplicationSlots(max_inflight_requests, max_inflight_per_node)
+        self._stragglers = set()
+        self._replication_queue_size = replication_queue_size
+        self._replication_batch_size = replication_batch_size
+        self._replication_pipeline = replication_pipeline
+        self._queues = {} # secondary id -> ReplicationQueue, on master only
 
         import uuid
-        node_id = uuid.uuid4().hex[:16]
-        self._nodes = [RLogLocal(node_id=node_id, url=url, role=role)]
+        # topics share id of the node
+        node_id = node_id or uuid.uuid4().hex[:16]
+        self._nodes = [RLogLocal(node_id=node_id, url=url, role=role, storage=storage)]
 
         self._master_node = None
         self._local_node = self._nodes[0] # reference on self node
+        self._response_cache = ResponseCache(self._local_node, max_bytes=response_cache_bytes)
+        self._feed = LogFeed(self._local_node, self._response_cache,
+                             buffer_size=subscriber_buffer, max_subscribers=max_subscribers)
+        self._local_node.add_listener(self._feed.notify)
         
-        self._hc_worker = HealthChecker(self.del_remote_node)
-        self._hc_worker.start()
-        self._sc_worker = SecondaryStateManagement(self._local_node)
-        self._sc_worker.start()
+        self._sc_worker = SecondaryStateManagement(self._local_node, anti_entropy_interval_s=anti_entropy_interval_s,
+                                                   snapshot_threshold=snapshot_threshold,
+                                                   replication_queue=lambda node: self._queues.get(node.id),
+                                                   chunk_size=catch_up_chunk_size,
+                                                   catch_up_parallelism=catch_up_parallelism)
+        self._snapshot_state = None # progress of snapshot installed from master
+        self._catch_up_state = None # progress of chunked catch-up from master
+        # topics get the scheduler of the default log, it probes nodes once for all logs
+        self._owns_scheduler = scheduler is None
+        self._scheduler = scheduler or NodeScheduler(self._sc_worker, self.del_remote_node,
+            probe_interval_s=probe_interval_s,
+            probe_timeout_s=probe_timeout_s,
+            heartbeat_s=heartbeat_s,
+            log_end=self._master_log_end)
+        # (master log end, time it was reported) not yet covered by committed prefix
+        self._fresh_marks = deque(maxlen=4096)
+        self._fresh_at = None # secondary had every item master had at this time
+        self._sequencer = Sequencer(self._local_node.end)
+        self._gc_worker = GroupCommit(self._commit_batch, window_s=batch_window_s, max_size=batch_max_size,
+                                      pipeline=commit_pipeline)
+        self._dedup = IdempotencyCache(max_size=dedup_cache_size, ttl_s=dedup_ttl_s)
+        self._checkpoint_interval_s = checkpoint_interval_s
+        self._checkpoint_task = None
         self._read_only_mode = False
+        if topic is None:
+            # series are labeled by node only, so they describe the default log
+            self._register_metrics()
+
+    def _register_metrics(self):
+        # computed on scrape only, nothing is updated on the append path
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_replication_lag_entries',
+            'Items appended on master and not yet acked by secondary', self._lag_entries, ['node']))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_replication_lag_seconds',
+            'Age of the oldest item not yet acked by secondary', self._lag_seconds, ['node']))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_replication_queue_entries',
+            'Items queued for secondary and not acked yet',
+            lambda: {(q.node.url,): q.size for q in self._queues.values()}, ['node']))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_store_entries',
+            'Number of items in local log', lambda: {(): self._local_node.size}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_store_end_offset',
+            'Offset after the last item in local log', lambda: {(): self._local_node.end}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_admission_inflight',
+            'Appends holding a slot of admission control', lambda: {(): self._admission.inflight}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_admission_queued',
+            'Appends waiting for a slot of admission control', lambda: {(): self._admission.queued}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_allocated_offset',
+            'Offset after the last id leased by sequencer of master', lambda: {(): self._sequencer.allocated}
+                if self._local_node.role == 'master' else {}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_subscribers',
+            'Open subscription streams', lambda: {(): len(self._feed)}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_response_cache_bytes',
+            'Size of pre-encoded entries kept for reads', lambda: {(): self._response_cache.size_bytes}))
+        metrics.REGISTRY.register(metrics.CallbackGauge('rlog_store_bytes',
+            'Size of persistent log on disk', lambda: {(): self._local_node.size_bytes}
+                if self._local_node.size_bytes is not None else {}))
+
+    def _lag_entries(self):
+        if self._local_node.role != 'master':
+            return {}
+        end = self._local_node.end
+        return {(n.url,): max(end - n.acked_end, 0) for n in self._nodes[1:]}
+
+    def _lag_seconds(self):
+        if self._local_node.role != 'master':
+            return {}
+        now, lag = time.time(), {}
+        for n in self._nodes[1:]:
+            oldest = self._local_node.get(str(n.acked_end)) if n.acked_end < self._local_node.end else None
+            lag[(n.url,)] = max(now - oldest.t0, 0) if oldest is not None and oldest.t0 else 0
+        return lag
 
 
     @property
     def node(self):
         return self._local_node
 
+    @property
+    def topic(self):
+        return self._topic
+
+    @property
+    def remote_nodes(self):
+        return self._nodes[1:]
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    def start(self):
+        # background tasks run on the event loop of the service
+        if self._owns_scheduler:
+            self._scheduler.start()
+        if self._checkpoint_interval_s and self._checkpoint_task is None:
+            self._checkpoint_task = asyncio.ensure_future(self._checkpoint_loop())
+
+    async def _checkpoint_loop(self):
+        written = self._log_mark()
+        while True:
+            await asyncio.sleep(self._checkpoint_interval_s)
+            if self._log_mark() != written:
+                written = self._log_mark()
+                await self.async_checkpoint()
+
+    def _log_mark(self):
+        # repair overwrites drop the checkpoint without changing the end or size of the log
+        node = self._local_node
+        return node.end, node.size, node.committed, node.replaced
+
+    def checkpoint(self):
+        # bounds the tail replayed on restart, see SegmentedFileStorage
+        t = time.perf_counter()
+        self._local_node.checkpoint()
+        CHECKPOINT_SECONDS.observe(time.perf_counter() - t)
+
+    async def async_checkpoint(self):
+        t = time.perf_counter()
+        await self._local_node.async_checkpoint()
+        CHECKPOINT_SECONDS.observe(time.perf_counter() - t)
+
     def stop(self):
-        self._hc_worker.stop()
+        if self._checkpoint_task is not None and not self._checkpoint_task.done():
+            self._checkpoint_task.cancel()
+        self._feed.close()
+        if self._owns_scheduler:
+            self._scheduler.stop()
+        else:
+            for node in self.remote_nodes:
+                self._scheduler.del_sync(node, self._sc_worker)
+        self._gc_worker.stop()
+        for queue in self._queues.values():
+            queue.close()
+        for task in list(self._stragglers):
+            if not task.done():
+                task.cancel()
+        self._local_node.close()
 
     def del_remote_node(self, node):
         logging.info(f'Remove node {node.id}')
         index = [i for i, n in enumerate(self._nodes) if n.id==node.id]
         self._nodes.remove(node)
-        self._hc_worker.del_node(node)
-        self._sc_worker.del_node(node)
-
-    def add_remote_node(self, url):
+        queue = self._queues.pop(node.id, None)
+        if queue is not None:
+            queue.close()
+        if not self._owns_scheduler:
+            # node is dropped by the default log, which cleans up state shared by logs
+            self._scheduler.del_sync(node, self._sc_worker)
+            return
+        self._scheduler.del_node(node)
+        self._replication_slots.discard(node.id)
+        node.close()
+        REPLICATION_RTT.remove(node.url)
+        REPLICATION_INFLIGHT.remove(node.url)
+        for result in ('ok', 'fail'):
+            HEALTHCHECKS.remove(node.url, result)
+
+    async def add_remote_node(self, url):
         # Function calls on node to register node from URL.
         # adds node to local buffer
         # - call from secondary
         # -- if added node is master - register on master
         # - call from master
-
-        node = RLogRemote.from_url(url)
+        # requests to the node are blocking and run in executor, node tables are changed on the event loop only
+        loop = asyncio.get_running_loop()
+        node = await loop.run_in_executor(None, partial(RLogRemote.from_url, url,
+                                                        transport_config=self._transport_config))
 
         # do not add already added node
         if any(map(lambda x: x.id == node.id, self._nodes )):
             return False
 
         logging.info(f'Add [{node.id}] `{node.role}` node with {node.url}')
-        if not node.healthy():
+        if not await loop.run_in_executor(None, node.healthy):
             logging.warn(f'Node [{node.id}] with {url} unhealthy')
             return False
 
-        self._nodes.append(node)
-        self._hc_worker.add_node(node)
-        self._sc_worker.add_node(node)
+        if not self.add_node(node):
+            return False
 
         if node.role == 'master':
             # TODO: make separate worker that handles handshake between master and secondary.
-            ret = post(url + '/register', {
+            ret = await loop.run_in_executor(None, post, url + '/register', {
                 'url': self._local_node.url,
                 'role': self._local_node.role,
                 'node_id': self._local_node.id
@@ -392,98 +1371,420 @@ class RLogServer(object):
 
         return True
 
+    def add_node(self, node: RLogRemote):
+        # node which is already known to be alive, e.g. added to default log before topic was created;
+        # should be called on the event loop, replication queue and scheduler state live there
+        if any(n.id == node.id for n in self._nodes):
+            return False
+        if self._local_node.role == 'master' and node.role == 'secondary':
+            self._queues[node.id] = ReplicationQueue(node,
+                max_size=self._replication_queue_size,
+                max_batch=self._replication_batch_size,
+                pipeline=self._replication_pipeline,
+                on_overflow=self._scheduler.request_sync if self._owns_scheduler
+                    else partial(self._scheduler.request_sync, state_management=self._sc_worker),
+                log_end=self._master_log_end,
+                slots=self._replication_slots.total)
+        self._nodes.append(node)
+        if self._owns_scheduler:
+            self._scheduler.add_node(node)
+        else:
+            self._scheduler.add_sync(node, self._sc_worker, self._master_log_end, self.del_remote_node)
+        return True
+
     def data_version(self):
         return self._local_node.data_version()
 
-    def get_uuid_item(self):
-        return self._local_node.get_uuid()
+    def transport_stats(self):
+        return {n.id: n.transport_stats for n in self._nodes[1:]}
 
     def get(self, log_id) -> Item:
+        # items after a gap are not visible until the gap is filled
+        offset = id2offset(log_id)
+        if offset is None or offset >= self._local_node.committed:
+            return None
         return self._local_node.get(log_id)
 
-    def _run_command_on_nodes(self, cmd, ccount, **kwargs):
-        cnodes = len(self._nodes)-1
-        assert ccount <= cnodes, f"Number of nodes {cnodes}+master is less than requested for consensus {ccount}+1"
+    def encoded_item(self, log_id) -> Optional[bytes]:
+        offset = id2offset(log_id)
+        return None if offset is None else self._response_cache.entry(offset)
+
+    def encoded_list(self, since=0, stop=None) -> bytes:
+        # JSON list of items [since, stop) of committed prefix, stop is usually next_cursor
+        return self._response_cache.render_list(since, self.committed if stop is None else stop)
+
+    def subscribe(self, since=0):
+        """Async iterator of SSE frames with committed items from `since` and then new commits"""
+        if self._feed.full:
+            raise Overloaded(f'{len(self._feed)} subscribers are connected', retry_after_s=self._probe_interval_s)
+        return self._feed.events(since)
+
+    def _master_log_end(self):
+        return self._local_node.end if self._local_node.role == 'master' else None
+
+    def note_master_end(self, end):
+        # called on replication and heartbeat requests from master
+        self._fresh_marks.append((end, time.time()))
+        self._advance_freshness()
 
-        def _run_on_node(i, node, result, latch=None):
-            # if node.healthy(): # TODO: could be a problem if node has uncertaint state
+    def _advance_freshness(self):
+        committed = self._local_node.committed
+        while self._fresh_marks and self._fresh_marks[0][0] <= committed:
+            self._fresh_at = self._fresh_marks.popleft()[1]
+
+    @property
+    def staleness(self):
+        """Seconds since secondary last had every item of master, 0 on master"""
+        if self._local_node.role == 'master':
+            return 0.0
+        if self._fresh_at is None:
+            return float('inf')
+        return max(time.time() - self._fresh_at, 0.0)
+
+    @property
+    def committed(self):
+        return self._local_node.committed
+
+    @property
+    def allocated(self):
+        # ids leased by master, [committed, allocated) are commits in flight or gaps to be filled
+        if self._local_node.role == 'master':
+            return max(self._sequencer.allocated, self._local_node.end)
+        return self._local_node.end
+
+    @property
+    def stragglers(self):
+        return len(self._stragglers)
+
+    async def _run_command_on_nodes(self, cmd, ccount, **kwargs):
+        nodes = self._nodes[1:]
+        cnodes = len(nodes)
+        if ccount > cnodes:
+            raise Unavailable(f"Number of nodes {cnodes}+master is less than requested for consensus {ccount}+1",
+                              retry_after_s=self._probe_interval_s)
+
+        async def _run_on_node(i, node):
+            node_slots = self._replication_slots.node(node.id)
+            if node_slots.locked():
+                # node does not keep up, do not pile requests on it and take quorum from others
+                return None
             # throw problem if message with id already exists in secondary (for append method)
-            handler = getattr(node, cmd)
-            result[i] = handler(**kwargs)
-            if result[i] is not None:
-                latch.count_down()
-            logging.info(f'Request for {i} finished with result {result[i]}')
-            # TODO: reimplement as concurency for job handler, so wait until all pool has assigned nodes
+            async with node_slots, self._replication_slots.total:
+                # cmd is either name of RLogRemote method or coroutine function taking node
+                handler = getattr(node, 'async_' + cmd) if isinstance(cmd, str) else partial(cmd, node)
+                inflight = REPLICATION_INFLIGHT.labels(node.url)
+                inflight.inc()
+                try:
+                    result = await handler(**kwargs)
+                finally:
+                    inflight.dec()
+            logging.info(f'Request for {i} finished with result {result}')
+            return result
 
         # results for all nodes
-        results = [None] * (len(self._nodes)-1)
-        clatch = CountDownLatch(count=ccount)
-
-        # thread pool for all nodes
-        pool = [None] * (len(self._nodes)-1)
-        for i, node in enumerate(self._nodes[1:]):
-            # TODO: move to finit pool because potential zombie thread cause here
-            pool[i] = Thread(target=_run_on_node, args=(i, node, results, clatch))
-            pool[i].start()
-            
-        # TODO: smart joining to do not wait all threads 
-        # for i, node in enumerate(self._nodes):
-        #     pool[i].join()
-        clatch.wait()
+        results = [None] * cnodes
+        tasks = {asyncio.ensure_future(_run_on_node(i, node)): i for i, node in enumerate(nodes)}
+
+        # return as soon as ccount nodes responded, rest of requests keep running in background
+        acks = 0
+        pending = set(tasks)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._quorum_timeout_s
+        while pending and acks < ccount:
+            done, pending = await asyncio.wait(pending, timeout=max(deadline - loop.time(), 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                results[tasks[task]] = task.result()
+                if results[tasks[task]] is not None:
+                    acks += 1
+
+        for task in pending:
+            self._stragglers.add(task)
+            task.add_done_callback(self._stragglers.discard)
+            # secondary which does not respond in time is repaired by SecondaryStateManagement
+            loop.call_later(self._straggler_timeout_s, task.cancel)
         return results
 
+    def _visible(self, since, limit):
+        # reads see only the committed prefix, never a hole
+        return max(self.next_cursor(since=since, limit=limit) - since, 0)
 
-    def get_all(self, r=1) -> List[Item]:
+    def iter_all(self, since=0, limit=None):
+        # lazy read of local log, used for streaming responses
+        return self._local_node.iter_all(since=since, limit=self._visible(since, limit))
+
+    def next_cursor(self, since=0, limit=None):
+        end = self._local_node.committed
+        return end if limit is None else min(since + limit, max(end, since))
+
+    async def get_all(self, r=1, since=0, limit=None) -> List[Item]:
         if self._local_node.role == 'secondary':
-            return self._local_node.get_all()
+            return self._local_node.get_all(since=since, limit=self._visible(since, limit))
 
-        items = {it.id: [it] for it in self._local_node.get_all()}
+        local_items = self._local_node.get_all(since=since, limit=self._visible(since, limit))
+        items = {int(it.id): 1 for it in local_items}
 
         if r > 1:
-            results = self._run_command_on_nodes('get_all', ccount=r-1)
-
-            # aggregate all items into one map ID->list[items]
+            # compare digests first and transfer items only after the first diverged range
+            stop = self.next_cursor(since=since, limit=limit)
+            offsets = digest_offsets(since, stop)
+            local_digests = self._local_node.digest(offsets)['digests']
+
+            async def _read_from_node(node):
+                remote = await node.async_digest(offsets)
+                if remote is None:
+                    return None
+                agreed = agreed_offset(offsets, local_digests, remote['digests'])
+                if agreed >= stop:
+                    return agreed, []
+                remote_items = await node.async_get_all(since=agreed, limit=stop-agreed)
+                if remote_items is None:
+                    return None
+                return agreed, remote_items
+
+            results = await self._run_command_on_nodes(_read_from_node, ccount=r-1)
+            answered = sum(1 for res in results if res)
+            if answered < r-1:
+                QUORUM_UNAVAILABLE.labels('read').inc()
+                raise Unavailable(f'{answered} of {r-1} secondaries answered read in time',
+                                  retry_after_s=self._probe_interval_s)
+
+            # count copies of every item, transferred items count only if their content matches local one
+            hashes = {}
             for res in results:
                 if not res:
                     # skip because no response from node
                     continue
-                for it in res:
-                    if it.id not in items:
-                        items[it.id] = [it]
-                    else:
-                        items[it.id].append(it)
-        # TODO: what to do if no consensus for at least one item... Block master and do not allow to append
-        assert all(map(lambda its: len(its)>=r, items.values())), 'No consensus found for one element. Break'
-        # TODO: clarify if service should be available if no quorum
-        
-        # get 0 element from each list of results and return as array
-        return [ items[i][0] for i in sorted(items.keys(), key=lambda x: int(x)) ]
+                agreed, remote_items = res
+                for it in local_items:
+                    if int(it.id) >= agreed:
+                        break
+                    items[int(it.id)] += 1
+                if remote_items and not hashes:
+                    hashes = {int(it.id): entry_hash(it) for it in local_items}
+                for it in remote_items:
+                    offset = int(it.id)
+                    if offset in items and hashes[offset] == entry_hash(it):
+                        items[offset] += 1
+            # master does not serve items which r nodes do not agree on, e.g. a secondary lags or diverged
+            missing = [offset for offset, count in items.items() if count < r]
+            if missing:
+                QUORUM_UNAVAILABLE.labels('read').inc()
+                raise Unavailable(f'{len(missing)} items from offset {missing[0]} have no quorum of {r} nodes',
+                                  retry_after_s=self._probe_interval_s)
+
+        # local items are already ordered by offset
+        return local_items
+
+    async def append_batch(self, items: List[Item], repair=False, catch_up=None) -> List[Item]:
+        if self._local_node.role == 'secondary':
+            # batch comes from master catch-up: keep order and skip already replicated items
+            # on repair, items which differ from master are overwritten
+            self._check_ids(items)
+            result = []
+            for item in sorted(items, key=lambda it: int(it.id)):
+                existing = self._local_node.get(item.id)
+                if existing is None:
+                    item.t0 = item.t0 or time.time()
+                    existing = self._local_node.append(item)
+                elif repair and entry_hash(existing) != entry_hash(item):
+                    item.node_id = self._local_node.id
+                    existing = self._local_node.replace(item)
+                    self._response_cache.invalidate(int(item.id))
+                result.append(existing)
+            await self._local_node.async_flush()
+            if catch_up is not None:
+                self._note_catch_up(*catch_up, received=len(items))
+            return result
+
+        for item in items:
+            item.t0 = time.time()
+        return await self._submit(items)
 
+    @property
+    def snapshot_state(self):
+        return self._snapshot_state
+
+    def _note_catch_up(self, since, upto, received):
+        state = self._catch_up_state
+        if state is None or (state['since'], state['upto']) != (since, upto):
+            # new catch-up, previous one was finished or interrupted
+            state = self._catch_up_state = {'since': since, 'upto': upto, 'received': 0, 'chunks': 0,
+                                            'started': time.time()}
+        state['received'] += received
+        state['chunks'] += 1
+        state['updated'] = time.time()
 
-    def append(self, item: Item) -> Item:
+    @property
+    def catch_up_state(self):
+        """Progress of chunked catch-up: `offset` is the prefix assembled so far, chunks after a gap wait for it"""
+        state = self._catch_up_state
+        if state is None:
+            return None
+        offset = min(max(self._local_node.committed, state['since']), state['upto'])
+        done = offset >= state['upto']
+        span = state['upto'] - state['since']
+        return dict(state,
+                    offset=offset,
+                    progress=round((offset - state['since']) / span, 4) if span else 1.0,
+                    done=done)
+
+    async def install_snapshot(self, stream, since, upto):
+        # bulk load of items streamed by master, items already present are kept
+        state = self._snapshot_state = {'since': since, 'upto': upto, 'offset': since, 'loaded': 0, 'done': False}
+        async for items in read_frames(stream):
+            for item in items:
+                if self._local_node.get(item.id) is None:
+                    self._local_node.append(item)
+                    state['loaded'] += 1
+            await self._local_node.async_flush()
+            if items:
+                state['offset'] = int(items[-1].id) + 1
+        state['done'] = True
+        return state
+
+    async def append(self, item: Item) -> Item:
         item.t0 = time.time()
         if self._local_node.role == 'secondary':
-            # WARNING: item.id should be specified in request, error occures otherwise
-            return self._local_node.append(item)
-
-        # generate unique id for item in master node, define total ordering, should be replicated to others
-        item.id = self.get_uuid_item()
-
-        # run command on secondaries
-        results = self._run_command_on_nodes('append', ccount=item.w-1, item=item)
-
-        ### process results from secondaries ###
+            self._check_ids([item])
+            existing = self._local_node.get(item.id)
+            if existing is not None:
+                if existing.payload != item.payload:
+                    # differing copy is repaired by master with anti-entropy, not by appends
+                    raise Conflict(f'Item {item.id} is already stored with different payload')
+                # retried replication of already stored item
+                return existing
+            item = self._local_node.append(item)
+            await self._local_node.async_flush()
+            return item
+
+        return (await self._submit([item]))[0]
+
+    def _check_ids(self, items: List[Item]):
+        # ids on secondary come from master or clients, checked before any item of the request is stored
+        for item in items:
+            offset = id2offset(item.id)
+            if offset is None:
+                raise ValueError(f'Item id should be a log offset, got {item.id}')
+            self._local_node.check_offset(offset)
+
+    async def _submit(self, items: List[Item]) -> List[Item]:
+        # write concern is checked per request, so one unreachable w does not fail its whole group
+        nodes = len(self._nodes)
+        for item in items:
+            if (item.w or 1) > nodes:
+                raise ValueError(f'Write concern w={item.w} is above the number of nodes {nodes}')
+
+        # items with idempotency key seen before are not appended again,
+        # retry gets the item committed first or waits for commit in progress
+        loop = asyncio.get_running_loop()
+        futures, new = [], []
+        for item in items:
+            future = self._dedup.get(item.key) if item.key is not None else None
+            if future is not None:
+                DEDUP_HITS.inc()
+            else:
+                future = loop.create_future()
+                new.append((item, future))
+                if item.key is not None:
+                    self._dedup.put(item.key, future)
+            futures.append(future)
 
+        try:
+            if new:
+                async with self._admission:
+                    await self._gc_worker.submit([it for it, _ in new])
+        except Exception as e:
+            for it, future in new:
+                if self._local_node.get(it.id) is not None:
+                    # committed without quorum, it is still replicated, so retry should not append it again
+                    # but waits for acks of the queues, see _await_acks
+                    future.set_result((it, False))
+                    continue
+                if it.key is not None:
+                    self._dedup.discard(it.key)
+                future.set_exception(e)
+                # exception is raised here, mark it as retrieved for waiters which do not exist
+                future.add_done_callback(lambda f: f.exception())
+            raise
+        for it, future in new:
+            future.set_result((it, True))
+
+        result = []
+        for item, future in zip(items, futures):
+            committed, durable = await future
+            if not durable:
+                committed = await self._await_acks(committed, item.w or 1)
+                # later retries are answered at once
+                self._dedup.put(item.key, _resolved((committed, True)))
+            result.append(committed)
+        return result
+
+    async def _await_acks(self, item: Item, w: int) -> Item:
+        # retry of append which missed quorum: items stay in replication queues, so wait until
+        # w-1 secondaries acked its offset or quorum timeout passes again
+        offset = int(item.id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._quorum_timeout_s
+        while True:
+            acked = sum(1 for node in self._nodes[1:] if node.acked_end > offset)
+            if acked >= w-1:
+                return item
+            if loop.time() >= deadline:
+                QUORUM_UNAVAILABLE.labels('append').inc()
+                raise Unavailable(f'{acked} of {w-1} secondaries acked within {self._quorum_timeout_s}s',
+                                  retry_after_s=self._probe_interval_s)
+            await asyncio.sleep(self.ACK_POLL_S)
+
+    def _commit_batch(self, items: List[Item]):
+        # called by group commit in group order, nothing is awaited until items are queued,
+        # so ids and order of items in replication queues follow the order of groups
+        w = max(item.w or 1 for item in items)
+        cnodes = len(self._queues)
+        if w-1 > cnodes:
+            # node was removed after the group was submitted, see _submit;
+            # checked before ids are leased, leased ids are always appended and leave no gap
+            QUORUM_UNAVAILABLE.labels('append').inc()
+            raise Unavailable(f"Number of nodes {cnodes}+master is less than requested for consensus {w-1}+1",
+                              retry_after_s=self._probe_interval_s)
+
+        # generate unique ids for items in master node, define total ordering, should be replicated to others
+        base = self._sequencer.lease(len(items), floor=self._local_node.end)
+        for i, item in enumerate(items):
+            item.id = str(base + i)
+
+        # queues deliver items to every secondary in background, wait only for w-1 of them
+        acks = [queue.put(items) for queue in list(self._queues.values())]
+        return self._await_quorum(items, acks, w)
+
+    async def _await_quorum(self, items: List[Item], acks, w):
+        # commits of several groups wait for their acks concurrently
+        t = time.perf_counter()
         retc = 0
-        for i, node in enumerate(self._nodes[1:]):
-            if not results[i]:
-                logging.warning(f'Request from thread {i} has not yet received. Skip...')
-                continue
-            assert results[i].id == item.id, 'ID for item in Secondaary should match with local'
-            retc+=1
-        # TODO: what to do if no consensus for at least one item... Block master and do not allow to append
-        assert retc >= item.w-1, 'Cannot append item, consensus has not achieved'
-        # TODO: clarify if service should be available if no quorum
-
-        return self._local_node.append(item)
-
+        pending = set(acks)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._quorum_timeout_s
+        while pending and retc < w-1:
+            # slow secondaries do not hold the group commit longer than quorum timeout
+            done, pending = await asyncio.wait(pending, timeout=max(deadline - loop.time(), 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            retc += sum(1 for f in done if f.result())
+        QUORUM_WAIT.labels(w).observe(time.perf_counter() - t)
+
+        # items are queued for secondaries anyway, so ids are taken even if quorum is not reached
+        for item in items:
+            # SecondaryStateManagement could already pull acked item from secondary
+            if self._local_node.get(item.id) is None:
+                self._local_node.append(item)
+        await self._local_node.async_flush()
+
+        if retc < w-1:
+            # items stay in the log and queues, retry with idempotency key does not append them again
+            QUORUM_UNAVAILABLE.labels('append').inc()
+            raise Unavailable(f'{retc} of {w-1} secondaries acked within {self._quorum_timeout_s}s',
+                              retry_after_s=self._probe_interval_s)
+        return items
@@ -0,0 +1,52 @@
+import json
+import zlib
+import struct
+import asyncio
+from typing import AsyncIterator, Iterable, List
+
+from const import Item
+
+
+# snapshot stream is a sequence of frames: <u32 length><zlib(json rows)>
+# row is [id, t0, payload], node_id is set by receiving node
+FRAME_HEADER = struct.Struct('<I')
+MEDIA_TYPE = 'application/x-rlog-snapshot'
+
+
+def encode_chunk(items: Iterable[Item]) -> bytes:
+    rows = [[int(it.id), it.t0, it.payload] for it in items]
+    body = zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 1)
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_chunk(body: bytes) -> List[Item]:
+    items = []
+    for _id, t0, payload in json.loads(zlib.decompress(body)):
+        item = Item(payload=payload)
+        item.id = str(_id)
+        item.t0 = t0
+        items.append(item)
+    return items
+
+
+async def snapshot_frames(log, since: int, upto: int, chunk_size: int = 4096) -> AsyncIterator[bytes]:
+    """Frames with items of `log` in [since, upto), read lazily"""
+    for start in range(since, upto, chunk_size):
+        yield encode_chunk(log.iter_all(since=start, limit=min(chunk_size, upto - start)))
+        # let other requests run between chunks
+        await asyncio.sleep(0)
+
+
+async def read_frames(stream: AsyncIterator[bytes]) -> AsyncIterator[List[Item]]:
+    """Decode frames from request body as soon as each one is complete"""
+    buf = bytearray()
+    async for data in stream:
+        buf += data
+        while len(buf) >= FRAME_HEADER.size:
+            length, = FRAME_HEADER.unpack_from(buf)
+            if len(buf) < FRAME_HEADER.size + length:
+                break
+            body = bytes(buf[FRAME_HEADER.size:FRAME_HEADER.size + length])
+            del buf[:FRAME_HEADER.size + length]
+            yield decode_chunk(body)
+    assert not buf, 'Snapshot stream ended in the middle of a frame'
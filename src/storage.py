@@ -0,0 +1,625 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import logging
+from threading import Lock
+from typing import Callable, Iterator, Optional
+
+from const import Item
+from worker import BaseWorker
+
+
+class Storage(object):
+    """Interface of RLog storage. Items are addressed by integer offset (item id)"""
+
+    MAX_GAP = 1 << 20 # max distance of a new offset from the end, offsets in between are tracked as missing
+
+    def check_offset(self, offset: int) -> None:
+        """Raises ValueError if offset can not be stored"""
+        if offset < 0:
+            raise ValueError(f'Offset should not be negative, got {offset}')
+        if offset - self.end > self.MAX_GAP:
+            raise ValueError(f'Offset {offset} is more than {self.MAX_GAP} after the end of log {self.end}')
+
+    def put(self, offset: int, item: Item) -> None:
+        raise NotImplementedError
+
+    def get(self, offset: int) -> Optional[Item]:
+        raise NotImplementedError
+
+    def range(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Item]:
+        """Items with offsets in [start, stop) in offset order"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, offset: int) -> bool:
+        return self.get(offset) is not None
+
+    @property
+    def end(self) -> int:
+        """Highest stored offset + 1"""
+        raise NotImplementedError
+
+    @property
+    def size_bytes(self) -> Optional[int]:
+        """Size of stored data, None if storage does not track it"""
+        return None
+
+    def flush(self) -> None:
+        pass
+
+    @property
+    def syncs_on_flush(self) -> bool:
+        """True if flush waits for the disk, so callers on the event loop should run it in executor"""
+        return False
+
+    def checkpoint(self, state: dict) -> None:
+        """Make stored items durable and save `state` of the log with them, so restart skips replay"""
+        write = self.prepare_checkpoint(state)
+        if write is not None:
+            write()
+
+    def prepare_checkpoint(self, state: dict) -> Optional[Callable[[], None]]:
+        """Takes the checkpoint of stored items and `state` as of now, returns the function writing it to disk,
+        which may run in executor. None if storage keeps no checkpoints"""
+        return None
+
+    @property
+    def checkpoint_state(self) -> Optional[dict]:
+        """State saved by the checkpoint storage was recovered from, None if it started without one"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStorage(Storage):
+    """Dense list indexed by offset, missing offsets are kept as None"""
+
+    def __init__(self):
+        self.__items = []
+        self.__count = 0
+
+    def put(self, offset, item):
+        self.check_offset(offset)
+        if offset >= len(self.__items):
+            self.__items.extend([None] * (offset + 1 - len(self.__items)))
+        if self.__items[offset] is None:
+            self.__count += 1
+        self.__items[offset] = item
+
+    def get(self, offset):
+        if 0 <= offset < len(self.__items):
+            return self.__items[offset]
+        return None
+
+    def range(self, start=0, stop=None, chunk_size=1024):
+        # slice by chunks, so long reads do not copy the whole list at once
+        stop = len(self.__items) if stop is None else min(stop, len(self.__items))
+        for chunk_start in range(max(start, 0), stop, chunk_size):
+            for item in self.__items[chunk_start:min(chunk_start + chunk_size, stop)]:
+                if item is not None:
+                    yield item
+
+    def __len__(self):
+        return self.__count
+
+    @property
+    def end(self):
+        return len(self.__items)
+
+
+class FsyncPolicy(object):
+    ALWAYS = 'always'     # fsync after every record
+    BATCH = 'batch'       # fsync on flush(), called once per replicated batch
+    INTERVAL = 'interval' # fsync from background worker every `fsync_interval_s`
+
+
+class _FsyncWorker(BaseWorker):
+    def __init__(self, storage, interval_s):
+        super(_FsyncWorker, self).__init__()
+        self._storage = storage
+        self._interval_s = interval_s
+
+    def run(self):
+        while self.should_keep_running():
+            time.sleep(self._interval_s)
+            self._storage.sync()
+
+
+class _SegmentFiles(Storage):
+    """
+    Files of segmented log, shared by the writer and read-only views in other processes.
+
+    Record: <u32 length><u32 crc32><json body>. Offsets of records are kept in
+    `index` file (u64 per item offset, 0 means missing) which is memory-mapped as
+    well as segments, so neither log nor index has to fit into memory.
+    `generation` file keeps u64 counter of overwritten records.
+    """
+
+    RECORD_HEADER = struct.Struct('<II')
+    INDEX_ENTRY = struct.Struct('<Q')
+    GENERATION = struct.Struct('<Q')
+    SEGMENT_BITS = 40 # lower bits of index entry keep position inside segment
+
+    _path = None
+    _segments = None # file objects opened for reading
+    _maps = None     # mmap per segment, None while segment is empty
+    _index_map = None
+    _index_capacity = 0
+
+    def _segment_path(self, n):
+        return os.path.join(self._path, f'{n:08d}.seg')
+
+    def _index_get(self, offset):
+        if offset < 0 or offset >= self._index_capacity:
+            return None
+        entry, = self.INDEX_ENTRY.unpack_from(self._index_map, offset * self.INDEX_ENTRY.size)
+        if entry == 0:
+            return None
+        entry -= 1
+        return entry >> self.SEGMENT_BITS, entry & ((1 << self.SEGMENT_BITS) - 1)
+
+    def _map(self, segment, size):
+        # remap segment if it was appended after last mapping
+        m = self._maps[segment]
+        if m is None or len(m) < size:
+            if m is not None:
+                m.close()
+            m = mmap.mmap(self._segments[segment].fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = m
+        return m
+
+    def _read_record(self, segment, pos, size=None):
+        # returns record body or None if record is incomplete (beyond `size`) or corrupted
+        header_end = pos + self.RECORD_HEADER.size
+        if size is not None and header_end > size:
+            return None
+        length, crc = self.RECORD_HEADER.unpack_from(self._map(segment, header_end), pos)
+        if size is not None and header_end + length > size:
+            return None
+        body = self._map(segment, header_end + length)[header_end:header_end + length]
+        if zlib.crc32(body) != crc:
+            return None
+        return body
+
+
+class SegmentedFileStorage(_SegmentFiles):
+    """
+    Append-only log split into segment files `<n>.seg`, see _SegmentFiles for the layout.
+    Record is written before its index entry, so other processes may read the log
+    through SegmentedFileReader while it is appended.
+
+    `checkpoint` file marks the position in segments up to which the index file is durable,
+    with a sparse sample of index entries (every `sparse_index_step` offsets) to validate it
+    and the state of the log given by its owner. On start only records after that position
+    are scanned; without a valid checkpoint the index is rebuilt from all segments.
+    """
+
+    INDEX_GROW = 1 << 16
+    CHECKPOINT_FILE = 'checkpoint'
+    CHECKPOINT_VERSION = 1
+
+    def __init__(self, path: str, segment_size: int = 64 * 1024 * 1024,
+                 fsync: str = FsyncPolicy.BATCH, fsync_interval_s: float = 1.0,
+                 sparse_index_step: int = 4096):
+        assert fsync in (FsyncPolicy.ALWAYS, FsyncPolicy.BATCH, FsyncPolicy.INTERVAL), f'Unknown fsync policy {fsync}'
+        self._path = path
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._sparse_index_step = sparse_index_step
+        self._lock = Lock()
+        self._sync_lock = Lock()
+        self._checkpoint_lock = Lock()
+        self._dirty = False
+
+        self._segments = [] # file objects opened for reading
+        self._maps = []     # mmap per segment, None while segment is empty
+        self._end = 0
+        self._missing = set() # offsets below end without record, count is end - len(missing)
+        self._bytes = 0 # total size of segments
+        self._checkpoint_state = None
+
+        os.makedirs(path, exist_ok=True)
+        self._open_generation()
+        self._recover()
+
+        self._fsync_worker = None
+        if fsync == FsyncPolicy.INTERVAL:
+            self._fsync_worker = _FsyncWorker(self, fsync_interval_s)
+            self._fsync_worker.start()
+
+    ### index ###
+
+    def _open_generation(self):
+        self._generation_file = open(os.path.join(self._path, 'generation'), 'a+b')
+        if os.path.getsize(self._generation_file.name) < self.GENERATION.size:
+            self._generation_file.truncate(self.GENERATION.size)
+        self._generation_map = mmap.mmap(self._generation_file.fileno(), self.GENERATION.size)
+
+    def _bump_generation(self):
+        # readers drop what they cached from the log when a record is overwritten
+        generation, = self.GENERATION.unpack_from(self._generation_map)
+        self.GENERATION.pack_into(self._generation_map, 0, generation + 1)
+
+    def _open_index(self, keep=0):
+        # entries of the first `keep` offsets are kept, the rest is rebuilt from segments, see _recover
+        index_path = os.path.join(self._path, 'index')
+        self._index_file = open(index_path, 'a+b')
+        self._index_file.truncate(keep * self.INDEX_ENTRY.size)
+        self._index_map = None
+        self._index_capacity = 0
+        self._grow_index(max(keep, self.INDEX_GROW))
+
+    def _grow_index(self, capacity):
+        if self._index_map is not None:
+            self._index_map.close()
+        self._index_file.truncate(capacity * self.INDEX_ENTRY.size)
+        self._index_map = mmap.mmap(self._index_file.fileno(), capacity * self.INDEX_ENTRY.size)
+        self._index_capacity = capacity
+
+    def _index_set(self, offset, segment, pos):
+        if offset < 0:
+            # pack_into would count a negative position from the end of the index
+            raise ValueError(f'Offset should not be negative, got {offset}')
+        if offset >= self._index_capacity:
+            self._grow_index(max(self._index_capacity * 2, offset + self.INDEX_GROW))
+        self.INDEX_ENTRY.pack_into(self._index_map, offset * self.INDEX_ENTRY.size,
+                                   ((segment << self.SEGMENT_BITS) | pos) + 1)
+
+    ### segments ###
+
+    def _add_segment(self, n):
+        path = self._segment_path(n)
+        open(path, 'ab').close()
+        self._segments.append(open(path, 'rb'))
+        self._maps.append(None)
+        self._writer = open(path, 'ab', buffering=0)
+        self._writer_pos = os.path.getsize(path)
+
+    def _track(self, offset):
+        if offset >= self._end:
+            self._missing.update(range(self._end, offset))
+            self._end = offset + 1
+        else:
+            self._missing.discard(offset)
+
+    def _recover(self):
+        t = time.perf_counter()
+        # segments are numbered sequentially from 0 and never removed
+        count = len([f for f in os.listdir(self._path) if f.endswith('.seg')])
+        checkpoint = self._read_checkpoint(count)
+        # index entries written after the checkpoint are dropped and set again by the scan of
+        # records after the checkpoint position, so entries of torn records do not survive
+        self._open_index(keep=checkpoint['end'] if checkpoint is not None else 0)
+        for segment in range(max(count, 1)):
+            self._add_segment(segment)
+        if checkpoint is not None and not self._restore_checkpoint(checkpoint):
+            logging.warning(f'Checkpoint of {self._path} does not match the log, rebuild index from all segments')
+            checkpoint = None
+            self._index_map.close()
+            self._index_file.close()
+            self._open_index()
+
+        first, first_pos = (checkpoint['segment'], checkpoint['pos']) if checkpoint is not None else (0, 0)
+        scanned = 0
+        for segment in range(len(self._segments)):
+            size = os.path.getsize(self._segment_path(segment))
+            if segment < first:
+                self._bytes += size
+                continue
+            pos = first_pos if segment == first else 0
+            while True:
+                body = self._read_record(segment, pos, size)
+                if body is None:
+                    break
+                offset = int(json.loads(body)['id'])
+                self._track(offset)
+                self._index_set(offset, segment, pos)
+                pos += self.RECORD_HEADER.size + len(body)
+                scanned += 1
+            if pos < size:
+                # torn write at the end of log, drop it
+                logging.warning(f'Truncate segment {self._segment_path(segment)} at {pos} of {size} bytes')
+                if self._maps[segment] is not None:
+                    self._maps[segment].close()
+                    self._maps[segment] = None
+                with open(self._segment_path(segment), 'r+b') as f:
+                    f.truncate(pos)
+                size = pos
+            if segment == len(self._segments) - 1:
+                self._writer_pos = size
+            self._bytes += size
+        logging.info(f'Recovered {len(self)} items from {len(self._segments)} segments in {self._path}: '
+                     f'{"checkpoint and " if checkpoint is not None else ""}{scanned} records scanned '
+                     f'in {time.perf_counter() - t:.3f}s')
+
+    ### checkpoint ###
+
+    def _read_checkpoint(self, segments):
+        path = os.path.join(self._path, self.CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Checkpoint of {self._path} is not readable: {e}')
+            return None
+        if checkpoint.get('version') != self.CHECKPOINT_VERSION or checkpoint['segment'] >= segments \
+                or os.path.getsize(self._segment_path(checkpoint['segment'])) < checkpoint['pos'] \
+                or os.path.getsize(os.path.join(self._path, 'index')) < checkpoint['end'] * self.INDEX_ENTRY.size:
+            logging.warning(f'Checkpoint of {self._path} is ahead of the log files, ignore it')
+            return None
+        return checkpoint
+
+    def _restore_checkpoint(self, checkpoint):
+        # entries of the sparse sample should be in the index and point to records of their offsets
+        for offset, entry in checkpoint['sparse']:
+            raw, = self.INDEX_ENTRY.unpack_from(self._index_map, offset * self.INDEX_ENTRY.size)
+            if raw != entry:
+                return False
+            segment, pos = self._index_get(offset)
+            if segment >= len(self._segments):
+                return False
+            body = self._read_record(segment, pos, os.path.getsize(self._segment_path(segment)))
+            if body is None or int(json.loads(body)['id']) != offset:
+                return False
+        self._end = checkpoint['end']
+        self._missing = {o for start, stop in checkpoint['missing'] for o in range(start, stop)}
+        # gaps below the end could be filled after the checkpoint, other entries below it are
+        # changed only by overwrites which drop the checkpoint
+        for offset in self._missing:
+            self.INDEX_ENTRY.pack_into(self._index_map, offset * self.INDEX_ENTRY.size, 0)
+        self._checkpoint_state = checkpoint.get('state')
+        return True
+
+    def _missing_ranges(self):
+        ranges = []
+        for offset in sorted(self._missing):
+            if ranges and ranges[-1][1] == offset:
+                ranges[-1][1] = offset + 1
+            else:
+                ranges.append([offset, offset + 1])
+        return ranges
+
+    def _drop_checkpoint(self):
+        # index entry of an overwritten record cannot be restored, next start rebuilds index
+        path = os.path.join(self._path, self.CHECKPOINT_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def prepare_checkpoint(self, state):
+        # the checkpoint is taken under the write lock, disk work runs outside of it so puts do not wait
+        with self._lock:
+            sparse = []
+            for offset in range(0, self._end, self._sparse_index_step):
+                raw, = self.INDEX_ENTRY.unpack_from(self._index_map, offset * self.INDEX_ENTRY.size)
+                if raw:
+                    sparse.append([offset, raw])
+            checkpoint = {
+                'version': self.CHECKPOINT_VERSION,
+                'segment': len(self._segments) - 1,
+                'pos': self._writer_pos,
+                'end': self._end,
+                'missing': self._missing_ranges(),
+                'sparse': sparse,
+                'state': state,
+            }
+            generation, = self.GENERATION.unpack_from(self._generation_map)
+            # writer may be closed by rollover and index remapped by growth meanwhile
+            fds = [os.dup(self._writer.fileno()), os.dup(self._index_file.fileno())]
+
+        def write():
+            try:
+                # fsync of the index file also writes pages dirtied through its shared mmap
+                for fd in fds:
+                    os.fsync(fd)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            path = os.path.join(self._path, self.CHECKPOINT_FILE)
+            with self._checkpoint_lock:
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(checkpoint, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with self._lock:
+                    generation_now, = self.GENERATION.unpack_from(self._generation_map)
+                    if generation_now != generation:
+                        # a record covered by the checkpoint was overwritten, next checkpoint covers it
+                        os.remove(path + '.tmp')
+                        return
+                    os.replace(path + '.tmp', path)
+        return write
+
+    @property
+    def checkpoint_state(self):
+        return self._checkpoint_state
+
+    ### storage interface ###
+
+    def put(self, offset, item):
+        self.check_offset(offset)
+        body = json.dumps(item.to_dict()).encode()
+        record = self.RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+        with self._lock:
+            overwrite = offset < self._end and offset not in self._missing
+            if overwrite:
+                self._drop_checkpoint()
+            if self._writer_pos > 0 and self._writer_pos + len(record) > self._segment_size:
+                self._rollover()
+            pos = self._writer_pos
+            self._writer.write(record)
+            self._writer_pos += len(record)
+            self._bytes += len(record)
+            if self._fsync == FsyncPolicy.ALWAYS:
+                os.fsync(self._writer.fileno())
+            else:
+                self._dirty = True
+            self._track(offset)
+            self._index_set(offset, len(self._segments) - 1, pos)
+            if overwrite:
+                self._bump_generation()
+
+    def _rollover(self):
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._add_segment(len(self._segments))
+
+    def get(self, offset):
+        loc = self._index_get(offset)
+        if loc is None:
+            return None
+        segment, pos = loc
+        with self._lock:
+            body = self._read_record(segment, pos)
+        if body is None:
+            return None
+        return Item().from_dict(json.loads(body))
+
+    def range(self, start=0, stop=None):
+        stop = self._end if stop is None else min(stop, self._end)
+        for offset in range(max(start, 0), stop):
+            item = self.get(offset)
+            if item is not None:
+                yield item
+
+    def __len__(self):
+        return self._end - len(self._missing)
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def sync(self):
+        # fsync runs outside of the write lock so puts do not wait for the disk, syncs are serialized
+        # so a caller finding nothing dirty returns only after the sync covering its writes completed
+        with self._sync_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                fd = os.dup(self._writer.fileno()) # writer may be closed by rollover meanwhile
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def flush(self):
+        if self._fsync == FsyncPolicy.BATCH:
+            self.sync()
+
+    @property
+    def syncs_on_flush(self):
+        return self._fsync == FsyncPolicy.BATCH
+
+    def close(self):
+        if self._fsync_worker is not None:
+            self._fsync_worker.stop()
+        self.sync()
+        self._writer.close()
+        for m in self._maps:
+            if m is not None:
+                m.close()
+        for f in self._segments:
+            f.close()
+        self._index_map.close()
+        self._index_file.close()
+        self._generation_map.close()
+        self._generation_file.close()
+
+
+class SegmentedFileReader(_SegmentFiles):
+    """
+    Read-only view of SegmentedFileStorage directory from another process. Index and
+    segments are remapped when the writer grows them; `committed` is the contiguous
+    prefix of indexed offsets, the same prefix which the writer exposes to reads.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._segments = []
+        self._maps = []
+        self._committed = 0
+        self._index_file = open(os.path.join(path, 'index'), 'rb')
+        self._generation_file = open(os.path.join(path, 'generation'), 'rb')
+        self._generation_map = mmap.mmap(self._generation_file.fileno(), self.GENERATION.size,
+                                         access=mmap.ACCESS_READ)
+
+    def _index_get(self, offset):
+        if offset >= self._index_capacity:
+            self._remap_index()
+        return super(SegmentedFileReader, self)._index_get(offset)
+
+    def _remap_index(self):
+        capacity = os.fstat(self._index_file.fileno()).st_size // self.INDEX_ENTRY.size
+        if capacity <= self._index_capacity:
+            return
+        if self._index_map is not None:
+            self._index_map.close()
+        self._index_map = mmap.mmap(self._index_file.fileno(), capacity * self.INDEX_ENTRY.size,
+                                    access=mmap.ACCESS_READ)
+        self._index_capacity = capacity
+
+    def _map(self, segment, size):
+        # segments created by the writer after this view was opened
+        while len(self._segments) <= segment:
+            self._segments.append(open(self._segment_path(len(self._segments)), 'rb'))
+            self._maps.append(None)
+        return super(SegmentedFileReader, self)._map(segment, size)
+
+    @property
+    def generation(self) -> int:
+        generation, = self.GENERATION.unpack_from(self._generation_map)
+        return generation
+
+    @property
+    def committed(self) -> int:
+        while self._index_get(self._committed) is not None:
+            self._committed += 1
+        return self._committed
+
+    def get(self, offset):
+        loc = self._index_get(offset)
+        if loc is None:
+            return None
+        body = self._read_record(*loc)
+        if body is None:
+            return None
+        return Item().from_dict(json.loads(body))
+
+    def range(self, start=0, stop=None):
+        stop = self.committed if stop is None else min(stop, self.committed)
+        for offset in range(max(start, 0), stop):
+            item = self.get(offset)
+            if item is not None:
+                yield item
+
+    def __len__(self):
+        return self.committed
+
+    @property
+    def end(self):
+        return self.committed
+
+    def close(self):
+        for m in self._maps:
+            if m is not None:
+                m.close()
+        for f in self._segments:
+            f.close()
+        if self._index_map is not None:
+            self._index_map.close()
+        self._index_file.close()
+        self._generation_map.close()
+        self._generation_file.close()
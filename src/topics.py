@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+from rlog import RLogServer, RLogRemote
+
+
+TOPIC_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+CONFIG_FILE = 'topic.json'
+
+
+def topic_prefix(name: str) -> str:
+    return f'/topics/{name}'
+
+
+class Topics(object):
+    """
+    Named partitions of the log. Every topic is a separate RLogServer with its own store,
+    id sequence, group commit and replication queues, total order holds within a topic only.
+    Topics share node id, remote nodes and their health probes with the default log, a topic
+    only syncs its own state on the nodes and loses a node together with the default log.
+    Master creates a topic on a secondary with POST /topics/{name} before the node is added
+    to the topic, requests to unknown topics are not served by secondaries.
+    """
+
+    ATTACH_TIMEOUT_S = 5.0 # time open() waits for secondaries, unreachable ones are attached in background
+
+    def __init__(self, default: RLogServer, factory: Callable[[str, Optional[str]], RLogServer],
+                 data_dir: Optional[str] = None):
+        self._default = default
+        self._factory = factory # (name, data directory or None) -> RLogServer
+        self._data_dir = data_dir
+        self._topics = {}       # name -> RLogServer
+        self._config = {}       # name -> {'w': int, 'r': int}, minimal guarantees of topic
+
+    def _path(self, name):
+        return None if self._data_dir is None else os.path.join(self._data_dir, 'topics', name)
+
+    def names(self) -> List[str]:
+        return sorted(self._topics)
+
+    def get(self, name: str) -> Optional[RLogServer]:
+        return self._topics.get(name)
+
+    def _create(self, name: str) -> RLogServer:
+        if not TOPIC_NAME.match(name):
+            raise ValueError(f'Topic name should match {TOPIC_NAME.pattern}, got {name}')
+        # should be called from running event loop, topic starts its checkpoints
+        topic = self._factory(name, self._path(name))
+        topic.start()
+        self._topics[name] = topic
+        self._config[name] = self._load_config(name)
+        logging.info(f'Topic `{name}` opened with {topic.node.data_version} items')
+        return topic
+
+    async def open(self, name: str) -> RLogServer:
+        """Topic by name, created if it does not exist; on master it is created on secondaries too"""
+        topic = self._topics.get(name)
+        if topic is not None:
+            return topic
+        topic = self._create(name)
+        if self._default.node.role == 'master' and self._default.remote_nodes:
+            attach = [asyncio.ensure_future(self._attach(name, topic, node)) for node in self._default.remote_nodes]
+            await asyncio.wait(attach, timeout=self.ATTACH_TIMEOUT_S)
+        return topic
+
+    async def _attach(self, name, topic, node: RLogRemote):
+        # secondary has the topic before master replicates or probes it, retried while node is registered
+        delay = 0.1
+        while await node.async_create_topic(name, self.config(name)) is None:
+            if self._topics.get(name) is not topic or all(n.id != node.id for n in self._default.remote_nodes):
+                return False
+            logging.warning(f'Topic `{name}` is not created on {node.url}, retry in {delay:.1f}s')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.ATTACH_TIMEOUT_S)
+        return topic.add_node(node.for_topic(topic_prefix(name)))
+
+    async def add_node(self, node: RLogRemote):
+        # node registered on master after topics were created
+        if self._default.node.role != 'master' or not self._topics:
+            return
+        attach = [asyncio.ensure_future(self._attach(name, topic, node)) for name, topic in self._topics.items()]
+        await asyncio.wait(attach, timeout=self.ATTACH_TIMEOUT_S)
+
+    def load(self):
+        # topics persisted in data directory are opened on start, before any node is registered
+        if self._data_dir is None or not os.path.isdir(os.path.join(self._data_dir, 'topics')):
+            return
+        for name in sorted(os.listdir(os.path.join(self._data_dir, 'topics'))):
+            if TOPIC_NAME.match(name) and name not in self._topics:
+                self._create(name)
+
+    def config(self, name: Optional[str]) -> Dict[str, int]:
+        return self._config.get(name) or {'w': 1, 'r': 1}
+
+    async def configure(self, name: str, w: Optional[int] = None, r: Optional[int] = None) -> Dict[str, int]:
+        await self.open(name)
+        config = dict(self.config(name))
+        if w is not None:
+            config['w'] = w
+        if r is not None:
+            config['r'] = r
+        self._config[name] = config
+        path = self._path(name)
+        if path is not None:
+            with open(os.path.join(path, CONFIG_FILE), 'w') as f:
+                json.dump(config, f)
+        return config
+
+    def _load_config(self, name):
+        path = self._path(name)
+        if path is not None and os.path.exists(os.path.join(path, CONFIG_FILE)):
+            with open(os.path.join(path, CONFIG_FILE)) as f:
+                return json.load(f)
+        return {'w': 1, 'r': 1}
+
+    def checkpoint(self):
+        for topic in self._topics.values():
+            topic.checkpoint()
+
+    def stop(self):
+        for topic in self._topics.values():
+            topic.stop()
@@ -1,4 +1,8 @@
 import json
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
 import aiohttp
 import aiohttp_retry
 import requests
@@ -55,3 +59,144 @@ def post_retry(url, data, timeout=10, retry_attempts=10):
     ret = s.mount(url, HTTPAdapter(max_retries=retries))
     # s.get('http://httpstat.us/500')
 
+
+
+# sessions being closed, the loop keeps only weak references to tasks
+_closing = set()
+
+
+@dataclass
+class TransportConfig:
+    pool_size: int = 10
+    keepalive_s: float = 30
+    connect_timeout_s: float = 1.0
+    read_timeout_s: float = 10.0
+
+
+class HTTPTransport(object):
+    """Keep-alive connection pool to a single node, both for sync and async calls"""
+
+    def __init__(self, base_url: str, config: Optional[TransportConfig] = None):
+        self._base_url = base_url
+        self._config = config or TransportConfig()
+
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._config.pool_size)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+        # aiohttp session is bound to event loop, so it is created on first async call
+        self._async_session = None
+        self._async_stats = {'connections': 0, 'reused': 0}
+        # any response from node proves it is alive
+        self.last_response_t = 0
+
+    @property
+    def config(self):
+        return self._config
+
+    def _timeout(self, timeout):
+        if timeout == 'default':
+            return (self._config.connect_timeout_s, self._config.read_timeout_s)
+        if timeout is None:
+            return (self._config.connect_timeout_s, None)
+        return timeout
+
+    def get(self, path, timeout='default'):
+        ret = self._session.get(self._base_url + path, timeout=self._timeout(timeout))
+        self.last_response_t = time.time()
+        return ret.json()
+
+    def post(self, path, data, timeout='default'):
+        ret = self._session.post(self._base_url + path, json=data, timeout=self._timeout(timeout))
+        self.last_response_t = time.time()
+        return ret.json()
+
+    def _get_async_session(self):
+        if self._async_session is None or self._async_session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_create)
+            trace.on_connection_reuseconn.append(self._on_connection_reuse)
+            connector = aiohttp.TCPConnector(
+                limit=self._config.pool_size,
+                keepalive_timeout=self._config.keepalive_s)
+            self._async_session = aiohttp.ClientSession(
+                connector=connector,
+                json_serialize=json.dumps,
+                trace_configs=[trace],
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self._config.connect_timeout_s,
+                    sock_read=self._config.read_timeout_s))
+        return self._async_session
+
+    async def _on_connection_create(self, session, ctx, params):
+        self._async_stats['connections'] += 1
+
+    async def _on_connection_reuse(self, session, ctx, params):
+        self._async_stats['reused'] += 1
+
+    def _async_timeout(self, timeout):
+        if timeout == 'default':
+            return None  # session defaults
+        return aiohttp.ClientTimeout(total=timeout, sock_connect=self._config.connect_timeout_s)
+
+    async def async_get(self, path, timeout='default'):
+        session = self._get_async_session()
+        async with session.get(self._base_url + path, timeout=self._async_timeout(timeout)) as resp:
+            self.last_response_t = time.time()
+            return await resp.json()
+
+    async def async_post(self, path, data, timeout='default'):
+        session = self._get_async_session()
+        async with session.post(self._base_url + path, json=data, timeout=self._async_timeout(timeout)) as resp:
+            self.last_response_t = time.time()
+            return await resp.json()
+
+    async def async_request_raw(self, method, path, data=None, content_type=None, accept=None, timeout='default'):
+        # request with binary body and response
+        headers = {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if accept:
+            headers['Accept'] = accept
+        session = self._get_async_session()
+        async with session.request(method, self._base_url + path, data=data, headers=headers,
+                                   timeout=self._async_timeout(timeout)) as resp:
+            self.last_response_t = time.time()
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def async_post_stream(self, path, data, content_type, timeout='default'):
+        # `data` is async iterator of bytes, sent with chunked encoding
+        session = self._get_async_session()
+        async with session.post(self._base_url + path, data=data, headers={'Content-Type': content_type},
+                                timeout=self._async_timeout(timeout)) as resp:
+            self.last_response_t = time.time()
+            return await resp.json()
+
+    def stats(self):
+        pools = self._adapter.poolmanager.pools
+        pools = [pools[key] for key in pools.keys()]
+        num_requests = sum(pool.num_requests for pool in pools)
+        num_connections = sum(pool.num_connections for pool in pools)
+        return {
+            'sync_requests': num_requests,
+            'sync_connections': num_connections,
+            'sync_reused': max(num_requests - num_connections, 0),
+            'async_connections': self._async_stats['connections'],
+            'async_reused': self._async_stats['reused'],
+        }
+
+    def close(self):
+        self._session.close()
+        if self._async_session is not None and not self._async_session.closed:
+            # closing requires running loop, removed nodes are closed on it; connector is dropped otherwise
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                task = loop.create_task(self._async_session.close())
+                _closing.add(task)
+                task.add_done_callback(_closing.discard)
+        self._async_session = None
@@ -0,0 +1,80 @@
+import json
+import struct
+from typing import Iterable, List
+
+from const import Item
+
+
+# Binary format for replication between nodes, external clients use JSON.
+# items: <magic><u32 count> then per item <i64 id><f64 t0><u32 len><payload json>
+# ids (acks): <magic><u32 count><i64 id> * count
+MEDIA_TYPE = 'application/x-rlog'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+FORMAT_BINARY = 'binary'
+FORMAT_JSON = 'json'
+FORMATS = [FORMAT_BINARY, FORMAT_JSON]
+
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<qdI')
+MAGIC_ITEMS = b'RLI1'
+MAGIC_IDS = b'RLA1'
+
+
+def encode_items(items: Iterable[Item]) -> bytes:
+    parts = [b'']
+    count = 0
+    for it in items:
+        payload = json.dumps(it.payload, separators=(',', ':')).encode()
+        parts.append(RECORD.pack(int(it.id), it.t0 or 0.0, len(payload)))
+        parts.append(payload)
+        count += 1
+    parts[0] = HEADER.pack(MAGIC_ITEMS, count)
+    return b''.join(parts)
+
+
+def decode_items(data: bytes) -> List[Item]:
+    # body comes from other nodes or clients, malformed one raises ValueError
+    try:
+        magic, count = HEADER.unpack_from(data)
+    except struct.error as e:
+        raise ValueError(f'Truncated binary message: {e}')
+    if magic != MAGIC_ITEMS:
+        raise ValueError('Wrong binary message type')
+    pos = HEADER.size
+    items = []
+    for _ in range(count):
+        try:
+            _id, t0, length = RECORD.unpack_from(data, pos)
+        except struct.error as e:
+            raise ValueError(f'Truncated binary message: {e}')
+        pos += RECORD.size
+        if pos + length > len(data):
+            raise ValueError(f'Truncated binary message: payload of item {_id} ends after the message')
+        item = Item(payload=json.loads(data[pos:pos + length]))
+        item.id = str(_id)
+        item.t0 = t0 or None
+        items.append(item)
+        pos += length
+    return items
+
+
+def encode_ids(ids: List[str]) -> bytes:
+    return HEADER.pack(MAGIC_IDS, len(ids)) + struct.pack(f'<{len(ids)}q', *map(int, ids))
+
+
+def decode_ids(data: bytes) -> List[str]:
+    magic, count = HEADER.unpack_from(data)
+    assert magic == MAGIC_IDS, 'Wrong binary message type'
+    return [str(i) for i in struct.unpack_from(f'<{count}q', data, HEADER.size)]
+
+
+def ndjson_lines(items: Iterable[Item], chunk_size: int = 256) -> Iterable[str]:
+    # serialise lazily, one write per chunk of lines
+    chunk = []
+    for it in items:
+        chunk.append(json.dumps(it.to_dict()))
+        if len(chunk) >= chunk_size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
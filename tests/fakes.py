@@ -0,0 +1,89 @@
+"""Remote nodes for tests: RLogServer of another node called in the same process instead of over HTTP"""
+import time
+import asyncio
+
+import wire
+from rlog import RLogServer
+
+
+def new_server(role, **kwargs):
+    kwargs.setdefault('checkpoint_interval_s', 0)
+    return RLogServer(url=f'http://{role}', role=role, **kwargs)
+
+
+class LoopbackNode(object):
+    """
+    Stands for RLogRemote of `server`. Items cross the node boundary encoded as on the wire, so nodes never
+    share Item objects. `down` makes every request fail, `delay_s` is added to every request,
+    `calls` counts requests by method.
+    """
+
+    role = 'secondary'
+    binary = True
+
+    def __init__(self, server: RLogServer, delay_s: float = 0):
+        self.server = server
+        self.id = server.node.id
+        self.url = f'http://{self.id}'
+        self.formats = list(wire.FORMATS)
+        self.acked_end = 0
+        self.last_seen = 0
+        self.down = False
+        self.delay_s = delay_s
+        self.calls = {}
+
+    async def _respond(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.delay_s:
+            await asyncio.sleep(self.delay_s)
+        if self.down:
+            return False
+        self.last_seen = time.time()
+        return True
+
+    async def async_healthy(self, timeout=1.0, end=None):
+        if not await self._respond('healthy'):
+            return False
+        if end is not None:
+            self.server.note_master_end(end)
+        return True
+
+    async def async_info(self, timeout=1.0, end=None):
+        if not await self._respond('info'):
+            return None
+        if end is not None:
+            self.server.note_master_end(end)
+        return {'node_id': self.id, 'role': self.role, 'version': self.server.node.data_version,
+                'committed': self.server.committed, 'formats': self.formats}
+
+    async def async_append_batch(self, items, repair=False, end=None, catch_up=None):
+        if not await self._respond('append_batch'):
+            return None
+        acks = await self.server.append_batch(wire.decode_items(wire.encode_items(items)), repair=repair,
+                                              catch_up=catch_up)
+        if end is not None:
+            self.server.note_master_end(end)
+        return acks
+
+    async def async_get_all(self, r=1, since=0, limit=None):
+        if not await self._respond('get_all'):
+            return None
+        return wire.decode_items(wire.encode_items(await self.server.get_all(r=r, since=since, limit=limit)))
+
+    async def async_digest(self, offsets=()):
+        if not await self._respond('digest'):
+            return None
+        return self.server.node.digest(offsets)
+
+    async def async_merkle(self, level, indexes, end):
+        if not await self._respond('merkle'):
+            return None
+        return self.server.node.merkle(level, indexes, end)
+
+    async def async_install_snapshot(self, frames, since, upto):
+        if not await self._respond('install_snapshot'):
+            return None
+        return await self.server.install_snapshot(frames, since=since, upto=upto)
+
+    def close(self):
+        pass
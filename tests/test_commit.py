@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from const import Item
+from rlog import Sequencer, GroupCommit
+from fakes import LoopbackNode, new_server
+
+
+def test_sequencer_leases_disjoint_ranges():
+    sequencer = Sequencer(start=5)
+    assert sequencer.lease(3) == 5
+    assert sequencer.lease(2) == 8
+    assert sequencer.allocated == 10
+    # offsets appended by other paths are never leased again
+    assert sequencer.lease(1, floor=20) == 20
+    assert sequencer.lease(1, floor=3) == 21
+    assert sequencer.allocated == 22
+
+
+def test_concurrent_submits_form_one_group():
+    async def run():
+        groups = []
+
+        async def commit(items):
+            return items
+
+        def commit_clb(items):
+            groups.append([it.payload['i'] for it in items])
+            return commit(items)
+
+        gc = GroupCommit(commit_clb, window_s=0.01, max_size=10)
+        await asyncio.gather(*[gc.submit([Item(payload={'i': i})]) for i in range(5)])
+        assert groups == [[0, 1, 2, 3, 4]]
+        # groups are split by max_size, submit is never split
+        await asyncio.gather(*[gc.submit([Item(payload={'i': i}) for i in range(j, j + 4)]) for j in (0, 4, 8)])
+        assert groups[1:] == [[0, 1, 2, 3, 4, 5, 6, 7], [8, 9, 10, 11]]
+
+    asyncio.run(run())
+
+
+def test_pipelined_groups_are_answered_in_order():
+    async def run():
+        inflight, answered = [0, 0], []
+
+        async def commit(items):
+            inflight[0] += 1
+            inflight[1] = max(inflight)
+            # earlier groups take longer, so later ones finish first
+            await asyncio.sleep(0.05 - 0.01 * items[0].payload['i'])
+            inflight[0] -= 1
+
+        async def writer(i):
+            await gc.submit([Item(payload={'i': i})])
+            answered.append(i)
+
+        gc = GroupCommit(commit, window_s=0, max_size=1, pipeline=3)
+        await asyncio.gather(*[writer(i) for i in range(5)])
+        assert answered == [0, 1, 2, 3, 4]
+        assert inflight[1] == 3
+
+    asyncio.run(run())
+
+
+def test_failed_group_fails_only_its_writers():
+    async def run():
+        async def commit(items):
+            if items[0].payload['i'] == 1:
+                raise RuntimeError('no quorum')
+
+        gc = GroupCommit(commit, window_s=0, max_size=1, pipeline=2)
+        results = await asyncio.gather(*[gc.submit([Item(payload={'i': i})]) for i in range(3)],
+                                       return_exceptions=True)
+        assert isinstance(results[1], RuntimeError)
+        assert [r[0].payload['i'] for r in (results[0], results[2])] == [0, 2]
+
+    asyncio.run(run())
+
+
+def test_ids_follow_items_pulled_from_secondary():
+    async def run():
+        master, secondary = new_server('master'), new_server('secondary')
+        for offset in range(5):
+            item = Item(payload={'i': offset})
+            item.id = str(offset)
+            await secondary.append(item)
+        node = LoopbackNode(secondary)
+        master.add_node(node)
+        # master restarted with an empty log and pulls what the secondary has acked
+        assert await master._sc_worker.sync(node, remote_ver=5)
+        assert master.committed == 5
+        item = await master.append(Item(payload={'i': 5}))
+        assert item.id == '5'
+        assert master.allocated == 6
+        master.stop()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('pipeline', [1, 4])
+def test_commits_keep_log_and_replication_order(pipeline):
+    async def run():
+        master, secondary = new_server('master', commit_pipeline=pipeline, batch_max_size=3), new_server('secondary')
+        master.add_node(LoopbackNode(secondary, delay_s=0.005))
+        items = await asyncio.gather(*[master.append(Item(payload={'i': i}, w=2)) for i in range(20)])
+        assert sorted(int(it.id) for it in items) == list(range(20))
+        assert master.committed == secondary.committed == 20
+        assert master.node.digest()['digest'] == secondary.node.digest()['digest']
+        master.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,11 @@
+from const import LogRequest, req2item, item2resp, append2resp
+
+
+def test_key_is_echoed_only_by_append():
+    req = LogRequest(key='k1', payload={'msg': 'x'})
+    item = req2item(req)
+    item.id = '0'
+    assert append2resp(item, req).key == 'k1'
+    # stored items do not keep the key, reads should not return it
+    item.key = None
+    assert item2resp(item).key is None
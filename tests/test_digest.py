@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from const import Item
+from rlog import RLogLocal
+from digest import HashChain
+from fakes import LoopbackNode, new_server
+
+
+def new_item(offset, payload=None):
+    item = Item(payload=payload or {'i': offset})
+    item.id = str(offset)
+    return item
+
+
+def new_log(offsets, changed=None):
+    # `changed` is {offset: payload} of items which differ from the other log
+    changed = changed or {}
+    log = RLogLocal('node', 'http://node', 'master')
+    for offset in offsets:
+        log.append(new_item(offset, changed.get(offset)))
+    return log
+
+
+def root(log, end):
+    level = log.merkle_height(end)
+    return log.merkle(level, [0], end)[0]
+
+
+@pytest.mark.parametrize('end', [1, 255, 256, 257, 700, 1024])
+def test_merkle_root_covers_only_offsets_below_end(end):
+    longer = new_log(range(1500))
+    assert root(longer, end) == root(new_log(range(end)), end)
+    # the item right at end does not change the root
+    assert root(new_log(range(1500), changed={end: {'x': 1}}), end) == root(longer, end)
+    assert root(new_log(range(1500), changed={end - 1: {'x': 1}}), end) != root(longer, end)
+
+
+def test_merkle_root_follows_replace():
+    log = new_log(range(1000))
+    before = root(log, 1000)
+    log.replace(new_item(300, {'x': 1}))
+    assert root(log, 1000) != before
+    assert root(log, 1000) == root(new_log(range(1000), changed={300: {'x': 1}}), 1000)
+
+
+@pytest.mark.parametrize('diverged, end', [(300, 1000), (700, 1000), (999, 1000), (600, 650)])
+def test_anti_entropy_repairs_only_diverged_leaf(diverged, end):
+    async def run():
+        master, secondary = new_server('master'), new_server('secondary')
+        for offset in range(1000):
+            master.node.append(new_item(offset))
+            secondary.node.append(new_item(offset, {'x': 1} if offset == diverged else None))
+        node = LoopbackNode(secondary)
+        assert await master._sc_worker._anti_entropy(node, end=end)
+        assert node.calls['append_batch'] == 1
+        assert secondary.node.get(str(diverged)).payload == {'i': diverged}
+        assert secondary.node.digest()['digest'] == master.node.digest()['digest']
+        # one path from the root to the diverged leaf is walked
+        assert node.calls['merkle'] == master.node.merkle_height(end) + 1
+
+    asyncio.run(run())
+
+
+def test_anti_entropy_ignores_items_after_end():
+    async def run():
+        master, secondary = new_server('master'), new_server('secondary')
+        for offset in range(600):
+            master.node.append(new_item(offset))
+            secondary.node.append(new_item(offset, {'x': 1} if offset == 550 else None))
+        node = LoopbackNode(secondary)
+        assert await master._sc_worker._anti_entropy(node, end=500)
+        assert 'append_batch' not in node.calls
+        assert secondary.node.get('550').payload == {'x': 1}
+
+    asyncio.run(run())
+
+
+def test_chain_is_rebuilt_after_replace():
+    log = new_log(range(700))
+    log.replace(new_item(300, {'x': 1}))
+    expected = new_log(range(700), changed={300: {'x': 1}})
+    offsets = [0, 255, 256, 300, 301, 512, 699, 700]
+    assert log.committed == 700
+    assert log.digest(offsets) == expected.digest(offsets)
+    # prefix before the replaced item is the same as before
+    assert log.digest([300])['digests'][300] == new_log(range(700)).digest([300])['digests'][300]
+
+
+def test_chain_advances_over_filled_gap():
+    log = RLogLocal('node', 'http://node', 'secondary')
+    for offset in [0, 1, 5, 6, 2, 4, 3]:
+        log.append(new_item(offset))
+        if offset == 6:
+            assert log.committed == 2
+    assert log.committed == 7
+    assert log.digest() == new_log(range(7)).digest()
+
+
+def test_chain_state_round_trip():
+    log = new_log(range(600))
+    chain = HashChain()
+    for offset in range(600):
+        chain.extend(log.get(str(offset)))
+    restored = HashChain.from_state(chain.state())
+    assert restored.head == chain.head and restored.version == 600
+    assert restored.verify(lambda o: log.get(str(o)))
+    assert not restored.verify(lambda o: new_item(o, {'x': 1}) if o == 599 else log.get(str(o)))
@@ -0,0 +1,132 @@
+import asyncio
+
+from const import Item
+from rlog import ReplicationQueue
+
+
+def items(start, count):
+    result = []
+    for offset in range(start, start + count):
+        item = Item(payload={'i': offset})
+        item.id = str(offset)
+        result.append(item)
+    return result
+
+
+class FakeNode(object):
+    """Secondary which records delivered batches; fails the first `failures` requests, `delay_s(items)` per batch"""
+
+    def __init__(self, failures=0, delay_s=None):
+        self.url = 'http://secondary'
+        self.acked_end = 0
+        self.batches = []
+        self.failures = failures
+        self.delay_s = delay_s or (lambda items: 0)
+        self.attempts = 0
+        self.ends = []
+
+    async def async_append_batch(self, items, end=None):
+        self.attempts += 1
+        await asyncio.sleep(self.delay_s(items))
+        if self.failures:
+            self.failures -= 1
+            return None
+        self.batches.append([it.id for it in items])
+        self.ends.append(end)
+        return items
+
+
+def delivered(node):
+    return [int(_id) for batch in node.batches for _id in batch]
+
+
+def test_items_are_delivered_in_order_in_merged_batches():
+    async def run():
+        node = FakeNode()
+        queue = ReplicationQueue(node, max_batch=4, pipeline=1, log_end=lambda: 100)
+        futures = [queue.put(items(offset, 2)) for offset in range(0, 10, 2)]
+        assert await asyncio.gather(*futures) == [True] * 5
+        assert delivered(node) == list(range(10))
+        assert max(len(batch) for batch in node.batches) == 4
+        # secondary learns log end of master with every batch
+        assert set(node.ends) == {100}
+        assert queue.size == 0 and queue.acked_offset == 10 and node.acked_end == 10
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_failed_batch_is_retried_with_backoff_and_writers_do_not_wait():
+    async def run():
+        node = FakeNode(failures=3)
+        queue = ReplicationQueue(node, pipeline=1, backoff_s=0.01)
+        # the first attempt fails, writer is answered at once and the queue keeps retrying
+        assert await queue.put(items(0, 2)) is False
+        # while the node fails, later writers are not kept waiting either
+        assert await queue.put(items(2, 2)) is False
+        for _ in range(100):
+            if queue.size == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert delivered(node) == [0, 1, 2, 3]
+        assert node.attempts == 3 + len(node.batches)
+        assert node.acked_end == 4
+        # node recovered, writers wait for its acks again
+        assert await queue.put(items(4, 1)) is True
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_acked_offset_waits_for_the_oldest_batch():
+    async def run():
+        # the first batch is slow, later ones are acked before it
+        node = FakeNode(delay_s=lambda items: 0.1 if items[0].id == '0' else 0)
+        queue = ReplicationQueue(node, max_batch=2, pipeline=3)
+        first = queue.put(items(0, 2))
+        rest = [queue.put(items(offset, 2)) for offset in (2, 4)]
+        assert await asyncio.gather(*rest) == [True, True]
+        assert not first.done()
+        assert queue.acked_offset == 0 and node.acked_end == 0
+        assert await first is True
+        assert queue.acked_offset == 6 and node.acked_end == 6
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_overflow_falls_back_to_catch_up_until_queue_drains():
+    async def run():
+        node = FakeNode(delay_s=lambda items: 0.05)
+        overflows = []
+        queue = ReplicationQueue(node, max_size=5, max_batch=4, pipeline=1, on_overflow=overflows.append)
+        kept = queue.put(items(0, 4))
+        assert queue.covered_from == 0
+        # queue is full: items are dropped and state sync is asked to catch the node up
+        assert await queue.put(items(4, 2)) is False
+        assert overflows == [node] and queue.covered_from is None
+        # nothing is queued until the queue drains, even if there is room
+        assert await queue.put(items(4, 1)) is False
+        assert await kept is True
+        assert await queue.put(items(6, 1)) is True
+        assert queue.covered_from == 6
+        assert delivered(node) == [0, 1, 2, 3, 6]
+        # queue does not know what node has after the overflow, acked end of node is left to state sync
+        assert node.acked_end == 0
+        assert overflows == [node]
+        queue.close()
+
+    asyncio.run(run())
+
+
+def test_close_answers_queued_writers():
+    async def run():
+        node = FakeNode(delay_s=lambda items: 10)
+        queue = ReplicationQueue(node, max_batch=1, pipeline=1)
+        futures = [queue.put(items(offset, 1)) for offset in range(3)]
+        await asyncio.sleep(0.01)
+        queue.close()
+        await asyncio.sleep(0)
+        assert [f.result() for f in futures] == [False] * 3
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import time
+import asyncio
+
+from const import Item
+from rlog import NodeScheduler, SecondaryStateManagement
+from fakes import LoopbackNode, new_server
+
+
+class BusyNode(LoopbackNode):
+    """Node which always responded to something recently, e.g. to requests of other topics on the same connection"""
+
+    @property
+    def last_seen(self):
+        return time.time()
+
+    @last_seen.setter
+    def last_seen(self, value):
+        pass
+
+
+def new_scheduler(master, **kwargs):
+    return NodeScheduler(SecondaryStateManagement(master.node), log_end=lambda: master.node.end,
+                         probe_interval_s=0.05, heartbeat_s=0.05, sync_interval_s=0.1, tick_s=0.01, **kwargs)
+
+
+def test_idle_synced_secondary_stays_fresh():
+    async def run():
+        master, secondary = new_server('master'), new_server('secondary')
+        for i in range(10):
+            await master.append(Item(payload={'i': i}))
+        node = BusyNode(secondary)
+        scheduler = new_scheduler(master)
+        scheduler.add_node(node)
+        scheduler.start()
+        try:
+            await asyncio.sleep(0.3)
+            assert secondary.committed == 10
+            samples = []
+            for _ in range(20):
+                samples.append(secondary.staleness)
+                await asyncio.sleep(0.05)
+        finally:
+            scheduler.stop()
+        # heartbeats are skipped for a busy node, state polls report the log end instead
+        assert node.calls.get('healthy', 0) == 0
+        assert max(samples) < 0.5
+
+    asyncio.run(run())
+
+
+
+def test_topics_share_probes_and_lose_node_with_default_log():
+    async def run():
+        master, secondary = new_server('master'), new_server('secondary')
+        secondary_topic = new_server('secondary', topic='t', node_id=secondary.node.id)
+        deleted = []
+
+        def del_remote_node(node):
+            deleted.append(node)
+            scheduler.del_node(node)
+
+        scheduler = new_scheduler(master, on_node_delete_clb=del_remote_node, max_failures=2, max_sync_interval_s=0.1)
+        topic = new_server('master', topic='t', node_id=master.node.id, scheduler=scheduler)
+        for i in range(5):
+            await topic.append(Item(payload={'i': i}))
+        node, topic_node = LoopbackNode(secondary), LoopbackNode(secondary_topic)
+        scheduler.add_node(node)
+        topic.add_node(topic_node)
+        scheduler.start()
+        try:
+            await asyncio.sleep(0.5)
+            # topic log is synced, its node is probed by the default log only
+            assert secondary_topic.committed == 5
+            assert topic_node.calls.get('info', 0) > 0 and topic_node.calls.get('healthy', 0) == 0
+
+            node.down = topic_node.down = True
+            for _ in range(100):
+                if deleted:
+                    break
+                await asyncio.sleep(0.02)
+            assert deleted == [node]
+            assert topic.remote_nodes == []
+        finally:
+            scheduler.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,126 @@
+import time
+import asyncio
+
+import pytest
+
+from const import Item
+from rlog import Unavailable, Overloaded, Conflict, ReplicationSlots, AdmissionControl, IdempotencyCache
+from fakes import LoopbackNode, new_server
+
+
+def keyed(key, w=1, i=0):
+    return Item(payload={'i': i}, key=key, w=w)
+
+
+def test_retry_after_missed_quorum_waits_for_acks():
+    async def run():
+        master, secondary = new_server('master', quorum_timeout_s=0.5), new_server('secondary')
+        node = LoopbackNode(secondary)
+        node.down = True
+        master.add_node(node)
+
+        with pytest.raises(Unavailable):
+            await master.append(keyed('k', w=2))
+        # the item is in the log of master, retry does not append it again but needs the acks as well
+        with pytest.raises(Unavailable):
+            await master.append(keyed('k', w=2))
+        assert master.committed == 1
+
+        node.down = False
+        item = await master.append(keyed('k', w=2))
+        assert item.id == '0' and master.committed == 1
+        assert secondary.committed == 1
+        master.stop()
+
+    asyncio.run(run())
+
+
+def test_secondary_rejects_different_item_at_stored_id():
+    async def run():
+        secondary = new_server('secondary')
+        item = Item(payload={'i': 0})
+        item.id = '0'
+        await secondary.append(item)
+        retried = Item(payload={'i': 0})
+        retried.id = '0'
+        assert (await secondary.append(retried)).payload == {'i': 0}
+        other = Item(payload={'i': 1})
+        other.id = '0'
+        with pytest.raises(Conflict):
+            await secondary.append(other)
+        assert secondary.get('0').payload == {'i': 0}
+
+    asyncio.run(run())
+
+
+class CountingNode(LoopbackNode):
+    """Slow node which records how many of its requests and requests to `others` run at once"""
+
+    def __init__(self, server, inflight):
+        super(CountingNode, self).__init__(server, delay_s=0.02)
+        self.inflight = inflight # shared by nodes: [current, max]
+
+    async def async_append_batch(self, items, **kwargs):
+        self.inflight[0] += 1
+        self.inflight[1] = max(self.inflight)
+        try:
+            return await super(CountingNode, self).async_append_batch(items, **kwargs)
+        finally:
+            self.inflight[0] -= 1
+
+
+def test_replication_slots_are_shared_by_logs():
+    async def run():
+        slots, inflight = ReplicationSlots(max_inflight=2), [0, 0]
+        logs = [new_server('master', replication_slots=slots, replication_pipeline=4, batch_window_s=0)
+                for _ in range(3)]
+        for log in logs:
+            log.add_node(CountingNode(new_server('secondary'), inflight))
+        await asyncio.gather(*[log.append(Item(payload={'i': i}, w=2)) for log in logs for i in range(10)])
+        assert inflight[1] == 2
+        for log in logs:
+            log.stop()
+
+    asyncio.run(run())
+
+
+def test_idempotency_cache_evicts_least_recently_used_and_expired():
+    cache = IdempotencyCache(max_size=2, ttl_s=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    # b was used least recently
+    assert cache.get('b') is None and cache.get('a') == 1 and cache.get('c') == 3
+
+    cache = IdempotencyCache(ttl_s=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None and len(cache) == 0
+
+
+def test_key_in_flight_is_appended_once():
+    async def run():
+        master = new_server('master')
+        first, second = await asyncio.gather(master.append(keyed('k')), master.append(keyed('k')))
+        assert first is second and first.id == '0'
+        assert master.committed == 1
+        assert (await master.append(keyed('k'))).id == '0'
+        assert (await master.append(keyed('other'))).id == '1'
+
+    asyncio.run(run())
+
+
+def test_key_of_rejected_append_is_forgotten():
+    async def run():
+        admission = AdmissionControl(max_inflight=1, max_queue=0)
+        master = new_server('master', admission=admission)
+        await admission.acquire()
+        # nothing was appended, so a retry appends the item
+        with pytest.raises(Overloaded):
+            await master.append(keyed('k'))
+        admission.release()
+        assert (await master.append(keyed('k'))).id == '0'
+        assert master.committed == 1
+
+    asyncio.run(run())
@@ -0,0 +1,186 @@
+"""Crash recovery of SegmentedFileStorage: the log reopened after a crash should match the log that was written"""
+import os
+import asyncio
+
+import pytest
+
+from const import Item
+from rlog import RLogLocal, RLogServer
+from storage import SegmentedFileStorage, MemoryStorage
+
+
+def new_item(offset):
+    item = Item(payload={'msg': f'item {offset}'})
+    item.id = str(offset)
+    return item
+
+
+def open_log(path):
+    return RLogLocal('node', 'http://node', 'master',
+                     storage=SegmentedFileStorage(str(path), segment_size=4096, sparse_index_step=4))
+
+
+def reference_log(offsets):
+    log = RLogLocal('node', 'http://node', 'master', storage=MemoryStorage())
+    for offset in offsets:
+        log.append(new_item(offset))
+    return log
+
+
+def assert_same(log, expected):
+    assert log.committed == expected.committed
+    assert log.digest()['digest'] == expected.digest()['digest']
+    for offset in range(expected.committed + 5):
+        item, ref = log.get(str(offset)), expected.get(str(offset))
+        assert (item and item.payload) == (ref and ref.payload)
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    log = open_log(tmp_path)
+    for offset in range(20):
+        log.append(new_item(offset))
+    log.checkpoint()
+    for offset in range(20, 30):
+        log.append(new_item(offset))
+    log.close()
+
+    # crash in the middle of the last record
+    segments = sorted(f for f in os.listdir(tmp_path) if f.endswith('.seg'))
+    last = tmp_path / segments[-1]
+    os.truncate(last, os.path.getsize(last) - 5)
+
+    log = open_log(tmp_path)
+    assert_same(log, reference_log(range(29)))
+    # the torn record is written again at the same offset
+    log.append(new_item(29))
+    log.close()
+    assert_same(open_log(tmp_path), reference_log(range(30)))
+
+
+def test_gaps_filled_after_checkpoint(tmp_path):
+    offsets = list(range(10)) + [15, 16]
+    log = open_log(tmp_path)
+    for offset in offsets:
+        log.append(new_item(offset))
+    log.checkpoint()
+    for offset in range(10, 15):
+        log.append(new_item(offset))
+    log.close()
+    assert os.path.exists(tmp_path / SegmentedFileStorage.CHECKPOINT_FILE)
+
+    log = open_log(tmp_path)
+    assert_same(log, reference_log(range(17)))
+
+
+def test_missing_offsets_survive_checkpoint(tmp_path):
+    log = open_log(tmp_path)
+    for offset in list(range(10)) + [15]:
+        log.append(new_item(offset))
+    log.checkpoint()
+    log.close()
+
+    log = open_log(tmp_path)
+    assert log.committed == 10
+    assert log.get('12') is None
+    for offset in range(10, 15):
+        log.append(new_item(offset))
+    assert_same(log, reference_log(range(16)))
+
+
+def test_overwrite_drops_checkpoint(tmp_path):
+    log = open_log(tmp_path)
+    for offset in range(50):
+        log.append(new_item(offset))
+    log.checkpoint()
+    replaced = Item(payload={'msg': 'replaced'})
+    replaced.id = '7'
+    log.replace(replaced)
+    log.close()
+    assert not os.path.exists(tmp_path / SegmentedFileStorage.CHECKPOINT_FILE)
+
+    log = open_log(tmp_path)
+    expected = reference_log(range(50))
+    expected.replace(replaced)
+    assert_same(log, expected)
+
+
+@pytest.mark.parametrize('offset', [-1, 1 << 30])
+def test_offset_out_of_range_is_rejected(tmp_path, offset):
+    storage = SegmentedFileStorage(str(tmp_path))
+    with pytest.raises(ValueError):
+        storage.put(offset, new_item(offset))
+    assert storage.end == 0
+
+
+def test_async_flush_syncs_appended_items(tmp_path):
+    log = open_log(tmp_path)
+    flushed = []
+    log.add_listener(lambda: flushed.append(log.committed))
+
+    async def append():
+        for offset in range(10):
+            log.append(new_item(offset))
+        await log.async_flush()
+
+    asyncio.run(append())
+    assert flushed == [10]
+    log.close()
+    assert_same(open_log(tmp_path), reference_log(range(10)))
+
+
+def test_async_checkpoint_is_restored(tmp_path):
+    log = open_log(tmp_path)
+    for offset in range(30):
+        log.append(new_item(offset))
+    asyncio.run(log.async_checkpoint())
+    for offset in range(30, 40):
+        log.append(new_item(offset))
+    log.close()
+
+    storage = SegmentedFileStorage(str(tmp_path), segment_size=4096, sparse_index_step=4)
+    assert storage.checkpoint_state is not None
+    log = RLogLocal('node', 'http://node', 'master', storage=storage)
+    assert_same(log, reference_log(range(40)))
+
+
+def test_checkpoint_taken_before_overwrite_is_not_written(tmp_path):
+    storage = SegmentedFileStorage(str(tmp_path), segment_size=4096, sparse_index_step=4)
+    for offset in range(20):
+        storage.put(offset, new_item(offset))
+    write = storage.prepare_checkpoint({})
+    # repair overwrites a record while the checkpoint is written in executor
+    storage.put(7, new_item(7))
+    write()
+    assert not os.path.exists(tmp_path / SegmentedFileStorage.CHECKPOINT_FILE)
+    assert not os.path.exists(tmp_path / (SegmentedFileStorage.CHECKPOINT_FILE + '.tmp'))
+    storage.close()
+
+
+def test_checkpoint_loop_rewrites_checkpoint_dropped_by_overwrite(tmp_path):
+    async def run():
+        storage = SegmentedFileStorage(str(tmp_path), segment_size=4096, sparse_index_step=4)
+        server = RLogServer(url='http://master', role='master', storage=storage, checkpoint_interval_s=0.01)
+        server.start()
+        await asyncio.sleep(0)
+        for offset in range(50):
+            server.node.append(new_item(offset))
+        path = tmp_path / SegmentedFileStorage.CHECKPOINT_FILE
+        for _ in range(100):
+            if path.exists():
+                break
+            await asyncio.sleep(0.01)
+        assert path.exists()
+        replaced = Item(payload={'msg': 'replaced'})
+        replaced.id = '7'
+        server.node.replace(replaced)
+        # end, size and committed of the log are the same, the checkpoint is written again all the same
+        assert not path.exists()
+        for _ in range(100):
+            if path.exists():
+                break
+            await asyncio.sleep(0.01)
+        assert path.exists()
+        server.stop()
+        server.node.close()
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+import asyncio
+
+from aiohttp import web
+
+from utils import HTTPTransport
+
+
+async def healthcheck(request):
+    return web.json_response({'status': 'success'})
+
+
+def test_close_releases_async_session():
+    async def run():
+        app = web.Application()
+        app.router.add_get('/healthcheck', healthcheck)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            transport = HTTPTransport(f'http://127.0.0.1:{port}')
+            assert (await transport.async_get('/healthcheck'))['status'] == 'success'
+            session = transport._async_session
+            transport.close()
+            await asyncio.sleep(0.01)
+            assert session.closed
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+import pytest
+
+import wire
+from const import Item
+
+
+def items(n):
+    result = []
+    for i in range(n):
+        item = Item(payload={'i': i})
+        item.id = str(i)
+        result.append(item)
+    return result
+
+
+def test_items_round_trip():
+    decoded = wire.decode_items(wire.encode_items(items(3)))
+    assert [(it.id, it.payload) for it in decoded] == [(str(i), {'i': i}) for i in range(3)]
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'RLI',
+    wire.encode_ids(['1']),
+    wire.encode_items(items(2))[:-3],
+    wire.encode_items(items(2))[:wire.HEADER.size + 5],
+    wire.encode_items(items(1))[:-1] + b'{',
+])
+def test_malformed_items_raise_value_error(data):
+    with pytest.raises(ValueError):
+        wire.decode_items(data)